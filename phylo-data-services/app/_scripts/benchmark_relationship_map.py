@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""Benchmark of the gene-order homology relationship map, on synthetic data.
+
+It compares TreeViewDataService.get_gene_order_homology_relationship_map
+with the previous version (which, for every leaf, scanned all the genes of
+the neighbourhoods), and checks that both give the same map.
+
+Run it from the app directory:
+
+    python _scripts/benchmark_relationship_map.py [n_leaves ...]
+"""
+import random
+import sys
+from datetime import datetime
+from pathlib import Path
+from time import perf_counter
+from typing import Iterable
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from models.gene_neighbourhood_dao import GeneNeighbourhoodDAO  # noqa: E402
+from services.tree_view_data_service import GeneID  # noqa: E402
+from services.tree_view_data_service import GeneRelationData  # noqa: E402
+from services.tree_view_data_service import MainContigGeneID  # noqa: E402
+from services.tree_view_data_service import ProteinID  # noqa: E402
+from services.tree_view_data_service import TreeViewDataService  # noqa: E402
+
+NEIGHBOURS: int = 3  # genes at each side of the main gene of every leaf
+
+
+class PreviousTreeViewDataService(TreeViewDataService):
+    """The service with the previous (quadratic) relationship map."""
+
+    @classmethod
+    def get_gene_order_homology_relationship_map(
+        cls,
+        leaf_protein_ids: Iterable[ProteinID],
+        seed_gene: GeneNeighbourhoodDAO,
+        grouped_genes_by_contig: dict[MainContigGeneID, list[GeneNeighbourhoodDAO]],
+        target_neighbourhoods: Iterable[GeneNeighbourhoodDAO],
+        homolog_target_to_seed_map: dict[GeneID, GeneID],
+        ortholog_target_to_seed_map: dict[GeneID, GeneID],
+    ) -> dict[ProteinID, dict[GeneID, GeneRelationData]]:
+        seed_contig_genes: list[GeneNeighbourhoodDAO] = grouped_genes_by_contig[
+            seed_gene.main_contig_gene_id
+        ]
+        seed_neighbour_assigned_colors: dict[GeneID, str] = (
+            cls._get_seed_neighbour_assigned_colors(
+                seed_gene_id=seed_gene.gene_id,
+                seed_contig_genes=seed_contig_genes,
+            )
+        )
+        relationship_map: dict[ProteinID, dict[GeneID, GeneRelationData]] = (
+            cls._init_relationship_map_with_seed_neighbours(
+                seed_gene, seed_contig_genes
+            )
+        )
+
+        for target_protein_id in leaf_protein_ids:
+            for gene in target_neighbourhoods:
+                leaf_gene_id: GeneID = gene.gene_id
+                gene_protein_id: ProteinID = gene.protein_id
+                main_contig_gene_id: MainContigGeneID = gene.main_contig_gene_id
+                if target_protein_id != gene_protein_id:
+                    continue
+
+                if leaf_gene_id in relationship_map[seed_gene.protein_id]:
+                    relationship_map.setdefault(
+                        target_protein_id,
+                        {
+                            leaf_gene_id: relationship_map[seed_gene.protein_id][
+                                leaf_gene_id
+                            ]
+                        },
+                    )
+                else:
+                    homologous_seed_neighbour_gene_id: GeneID | None = (
+                        homolog_target_to_seed_map.get(leaf_gene_id, None)
+                    )
+                    orthologous_seed_neighbour_gene_id: GeneID | None = (
+                        ortholog_target_to_seed_map.get(leaf_gene_id, None)
+                    )
+
+                    leaf_gene_color_data = cls._get_colors_and_strokes(
+                        seed_gene_id=seed_gene.gene_id,
+                        seed_neighbour_assigned_colors=seed_neighbour_assigned_colors,
+                        neighbour_gene_id=leaf_gene_id,
+                        homologous_neighbour_gene_id=homologous_seed_neighbour_gene_id,
+                        orthologous_neighbour_gene_id=orthologous_seed_neighbour_gene_id,
+                    )
+
+                    relationship_map.setdefault(
+                        target_protein_id,
+                        {
+                            leaf_gene_id: {
+                                "homologous_with": homologous_seed_neighbour_gene_id,
+                                "orthologous_with": orthologous_seed_neighbour_gene_id,
+                                "assigned_color": leaf_gene_color_data["bg_color"],
+                                "stroke_color": leaf_gene_color_data["stroke_color"],
+                                "stroke_width": leaf_gene_color_data["stroke_width"],
+                                "gene": gene,
+                            }
+                        },
+                    )
+                for leaf_neighbour_gene in grouped_genes_by_contig[main_contig_gene_id]:
+                    leaf_neighbour_gene_id = leaf_neighbour_gene.gene_id
+
+                    if leaf_neighbour_gene_id in relationship_map[seed_gene.protein_id]:
+                        relationship_map[target_protein_id][leaf_neighbour_gene_id] = (
+                            relationship_map[seed_gene.protein_id][
+                                leaf_neighbour_gene_id
+                            ]
+                        )
+                    else:
+                        leaf_neighbour_homolog_gene_id: GeneID | None = (
+                            homolog_target_to_seed_map.get(leaf_neighbour_gene_id, None)
+                        )
+                        leaf_neighbour_ortholog_gene_id: GeneID | None = (
+                            ortholog_target_to_seed_map.get(
+                                leaf_neighbour_gene_id, None
+                            )
+                        )
+
+                        leaf_neighbour_gene_color_data = cls._get_colors_and_strokes(
+                            seed_gene_id=seed_gene.gene_id,
+                            seed_neighbour_assigned_colors=seed_neighbour_assigned_colors,
+                            neighbour_gene_id=leaf_neighbour_gene_id,
+                            homologous_neighbour_gene_id=leaf_neighbour_homolog_gene_id,
+                            orthologous_neighbour_gene_id=leaf_neighbour_ortholog_gene_id,
+                        )
+
+                        relationship_map[target_protein_id][leaf_neighbour_gene_id] = {
+                            "homologous_with": leaf_neighbour_homolog_gene_id,
+                            "orthologous_with": leaf_neighbour_ortholog_gene_id,
+                            "assigned_color": leaf_neighbour_gene_color_data[
+                                "bg_color"
+                            ],
+                            "stroke_color": leaf_neighbour_gene_color_data[
+                                "stroke_color"
+                            ],
+                            "stroke_width": leaf_neighbour_gene_color_data[
+                                "stroke_width"
+                            ],
+                            "gene": leaf_neighbour_gene,
+                        }
+        return relationship_map
+
+
+
+def make_neighbourhoods(
+    n_leaves: int,
+) -> tuple[list[ProteinID], GeneNeighbourhoodDAO, list[GeneNeighbourhoodDAO]]:
+    """Return the leaf protein ids, the seed gene and all the neighbourhoods."""
+    neighbourhoods: list[GeneNeighbourhoodDAO] = []
+    gene_id: int = 0
+    for protein_id in range(1, n_leaves + 1):
+        main_gene_id: int = gene_id
+        for order in range(-NEIGHBOURS, NEIGHBOURS + 1):
+            neighbourhoods.append(
+                GeneNeighbourhoodDAO(
+                    gene_id=gene_id,
+                    main_contig_gene_id=main_gene_id,
+                    external_gene_id=f"ext-{gene_id}",
+                    contig_id=f"contig-{protein_id}",
+                    gene_name=f"gene-{gene_id}",
+                    source="synthetic",
+                    start=1000 * (order + NEIGHBOURS),
+                    end=1000 * (order + NEIGHBOURS) + random.randint(100, 900),
+                    relative_contig_gene_order=order,
+                    strand=random.choice("+-"),
+                    timestamp=datetime(2024, 1, 1),
+                    genome_id=protein_id,
+                    # The main gene is the one of the leaf protein.
+                    protein_id=protein_id if order == 0 else -gene_id,
+                )
+            )
+            gene_id += 1
+    seed_gene: GeneNeighbourhoodDAO = neighbourhoods[NEIGHBOURS]
+    return list(range(1, n_leaves + 1)), seed_gene, neighbourhoods
+
+
+def benchmark(n_leaves: int) -> None:
+    random.seed(n_leaves)
+    leaf_protein_ids, seed_gene, neighbourhoods = make_neighbourhoods(n_leaves)
+
+    grouped_genes_by_contig: dict[MainContigGeneID, list[GeneNeighbourhoodDAO]] = {}
+    for gene in neighbourhoods:
+        grouped_genes_by_contig.setdefault(gene.main_contig_gene_id, []).append(gene)
+    target_neighbourhoods: list[GeneNeighbourhoodDAO] = [
+        gene for gene in neighbourhoods if gene.gene_id != seed_gene.gene_id
+    ]
+
+    # Some genes are homologous (or also orthologous) to the seed neighbours.
+    seed_gene_ids: list[GeneID] = [
+        gene.gene_id for gene in grouped_genes_by_contig[seed_gene.main_contig_gene_id]
+    ]
+    homologs: dict[GeneID, GeneID] = {}
+    orthologs: dict[GeneID, GeneID] = {}
+    for gene in target_neighbourhoods:
+        if random.random() < 0.5:
+            homologs[gene.gene_id] = random.choice(seed_gene_ids)
+            if random.random() < 0.5:
+                orthologs[gene.gene_id] = homologs[gene.gene_id]
+
+    times: list[float] = []
+    results: list[dict] = []
+    for service in [PreviousTreeViewDataService, TreeViewDataService]:
+        start: float = perf_counter()
+        results.append(
+            service.get_gene_order_homology_relationship_map(
+                leaf_protein_ids,
+                seed_gene,
+                grouped_genes_by_contig,
+                target_neighbourhoods,
+                homologs,
+                orthologs,
+            )
+        )
+        times.append(perf_counter() - start)
+
+    assert results[0] == results[1], "the relationship maps are different"
+    print(
+        f"{n_leaves:>6} leaves {len(neighbourhoods):>7} genes: "
+        f"previous {times[0]:8.3f} s  now {times[1]:8.3f} s  "
+        f"({times[0] / times[1]:.0f}x)"
+    )
+
+
+if __name__ == "__main__":
+    for n in [int(arg) for arg in sys.argv[1:]] or [100, 500, 1000, 2000]:
+        benchmark(n)
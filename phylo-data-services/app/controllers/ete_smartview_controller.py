@@ -18,9 +18,13 @@ from pydantic import BaseModel
 
 from utils.mariadb_connection import MariadbSession
 from models.tree_dao import TreeDAO
+from services.tree_view_data_service import TREE_VIEW_DATA_CACHE
 from services.tree_view_data_service import TreeViewDataService
 from utils.tree_viewer import add_tree
+from utils.tree_viewer import DRAW_EXECUTOR
+from utils.tree_viewer import DRAW_RESPONSE_CACHE
 from utils.tree_viewer import GLOBAL_TREE_CACHE
+from utils.tree_viewer import wait_for_tree_store
 
 router = APIRouter()
 
@@ -54,6 +58,38 @@ class CacheCheckResponse(BaseModel):
     exists: bool
 
 
+class CacheStatsResponse(BaseModel):
+    trees: int
+    max_trees: int
+    resident_bytes: int
+    max_bytes: int
+    hits: int
+    misses: int
+    evictions: int
+    expirations: int
+    save_failures: int
+    lost_changes: int
+
+
+class DrawExecutorStatsResponse(BaseModel):
+    max_workers: int
+    max_pending: int
+    pending: int
+    submitted: int
+    coalesced: int
+    rejected: int
+
+
+class BoundedCacheStatsResponse(BaseModel):
+    entries: int
+    max_entries: int
+    resident_bytes: int
+    max_bytes: int
+    hits: int
+    misses: int
+    evictions: int
+
+
 class SequenceSearchRetrieveResult(BaseModel):
     result: str
 
@@ -103,6 +139,8 @@ def get_tree_view_from_db(
     ops.update_sizes_all(tree_view_data["tree"])
 
     tid: int = add_tree(tree_view_data)
+    # The following requests may be served by any other worker.
+    wait_for_tree_store(tid)
     print(f'Added tree {tree_view_data["name"]} with id {tid}.')
     response = RedirectResponse(url=f'/static/gui.html?tree={tree_view_data["name"]}')
     return response
@@ -113,5 +151,33 @@ def check_global_tree_cache(tree_id: int) -> CacheCheckResponse:
     global GLOBAL_TREE_CACHE
     GLOBAL_TREE_CACHE.remove_stale_tree_caches()
     return CacheCheckResponse(
-        tree_id=tree_id, exists=tree_id in GLOBAL_TREE_CACHE.trees
+        tree_id=tree_id, exists=GLOBAL_TREE_CACHE.contains(tree_id)
     )
+
+
+@router.get("/ete-smartview/cache-stats", response_model=CacheStatsResponse)
+def get_global_tree_cache_stats() -> CacheStatsResponse:
+    global GLOBAL_TREE_CACHE
+    return CacheStatsResponse(**GLOBAL_TREE_CACHE.get_stats())
+
+
+@router.get(
+    "/ete-smartview/draw-cache-stats", response_model=BoundedCacheStatsResponse
+)
+def get_draw_response_cache_stats() -> BoundedCacheStatsResponse:
+    return BoundedCacheStatsResponse(**DRAW_RESPONSE_CACHE.get_stats())
+
+
+@router.get(
+    "/ete-smartview/draw-executor-stats", response_model=DrawExecutorStatsResponse
+)
+def get_draw_executor_stats() -> DrawExecutorStatsResponse:
+    return DrawExecutorStatsResponse(**DRAW_EXECUTOR.get_stats())
+
+
+@router.get(
+    "/ete-smartview/tree-view-data-cache-stats",
+    response_model=BoundedCacheStatsResponse,
+)
+def get_tree_view_data_cache_stats() -> BoundedCacheStatsResponse:
+    return BoundedCacheStatsResponse(**TREE_VIEW_DATA_CACHE.get_stats())
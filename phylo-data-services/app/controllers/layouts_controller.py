@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 from fastapi import APIRouter
 
+from utils.tree_viewer import get_layouts_state
 from utils.tree_viewer import get_tid
+from utils.tree_viewer import get_tree_data
 from utils.tree_viewer import GLOBAL_TREE_CACHE
 
 router = APIRouter()
@@ -38,18 +40,11 @@ def get_layouts_tree_id(tree_id: str) -> dict[str, dict[str, bool]]:
     global GLOBAL_TREE_CACHE
     # Return dict that, for every layout module in the tree, has a dict
     # with the names of its layouts and whether they are active or not.
-    result: tuple[int, list[int]] | None = get_tid(tree_id)
+    result: tuple[int, list[int | str]] | None = get_tid(tree_id)
     if result is None:
         raise ValueError(f"Could not get TID for tree_id: {tree_id}")
     cache_tree_id, _ = result
-    tree_layouts: dict
-    tree_layouts = GLOBAL_TREE_CACHE.trees[cache_tree_id].layouts  # type: ignore
-
-    layouts: dict[str, dict[str, bool]] = {}
-    for module, lys in tree_layouts.items():
-        layouts[module] = {l.name: l.active for l in lys if l.name}
-
-    return layouts
+    return get_layouts_state(get_tree_data(cache_tree_id))
 
 
 @router.put("/layouts/update")
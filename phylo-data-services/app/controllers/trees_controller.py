@@ -1,7 +1,12 @@
 #!/usr/bin/env python3
+import asyncio
 import json
 import sys
 from time import time
+from typing import Any
+from typing import AsyncIterator
+from typing import Callable
+from typing import Iterator
 
 import brotli  # type: ignore
 from ete4 import Tree as Tree_ete  # type: ignore
@@ -9,29 +14,51 @@ from ete4.core import operations as ops  # type: ignore
 from ete4.parser import newick  # type: ignore
 from ete4.smartview.renderer import drawer as drawer_module  # type: ignore
 from fastapi import APIRouter
+from fastapi import Body
 from fastapi import HTTPException
 from fastapi import Request
 from fastapi import Response
 from fastapi.datastructures import QueryParams
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
+from utils.draw_response_cache import DrawResponse
+from utils.draw_response_cache import normalize_draw_args
+from utils.read_write_lock import ReadWriteLock
 from utils.tree_viewer import activate_clade  # type: ignore
 from utils.tree_viewer import activate_node
 from utils.tree_viewer import change_selection_name
 from utils.tree_viewer import deactivate_clade
 from utils.tree_viewer import deactivate_node
+from utils.tree_viewer import DRAW_EXECUTOR
+from utils.tree_viewer import DRAW_RESPONSE_CACHE
 from utils.tree_viewer import find_node
 from utils.tree_viewer import get_active_clade
 from utils.tree_viewer import get_drawer
+from utils.tree_viewer import get_drawer_info
+from utils.tree_viewer import get_histogram
+from utils.tree_viewer import get_layout_tooltip
+from utils.tree_viewer import get_layouts_state
 from utils.tree_viewer import get_newick
+from utils.tree_viewer import get_node
+from utils.tree_viewer import get_node_handle
+from utils.tree_viewer import get_node_steps
 from utils.tree_viewer import get_nodes_info
+from utils.tree_viewer import get_percentiles
+from utils.tree_viewer import get_property_names
 from utils.tree_viewer import get_selection_info
 from utils.tree_viewer import get_selections
 from utils.tree_viewer import get_stats
+from utils.tree_viewer import get_subtree_id
 from utils.tree_viewer import get_tid
+from utils.tree_viewer import get_tree_data
 from utils.tree_viewer import GLOBAL_TREE_CACHE
+from utils.tree_viewer import index_node_tooltip
 from utils.tree_viewer import load_tree
+from utils.tree_viewer import load_tree_data
+from utils.tree_viewer import mark_tree_modified
 from utils.tree_viewer import prune_by_selection
+from utils.tree_viewer import reload_tree
 from utils.tree_viewer import remove_active
 from utils.tree_viewer import remove_search
 from utils.tree_viewer import remove_selection
@@ -101,31 +128,42 @@ def get_trees() -> list[dict[str, str]]:
         raise HTTPException(
             status_code=404, detail="invalid path /trees in safe_mode mode"
         )
+    # From the store, since the other workers may have other trees in memory.
     tree_return: list[dict[str, str]] = [
-        {"id": str(tid), "name": str(tdata.name)} for tid, tdata in GLOBAL_TREE_CACHE.trees.items()  # type: ignore
+        {"id": str(tid), "name": str(name)}
+        for tid, name in sorted(GLOBAL_TREE_CACHE.tree_names().items())
     ]
     return tree_return
 
 
 def touch_and_get(
     tree_id: str | int | None,
-) -> tuple[TreeData | None, list[int] | None]:  # typed
+) -> tuple[TreeData | None, list[int | str]]:  # typed
     global GLOBAL_TREE_CACHE
     """Load tree, update its timer, and return the tree data object and subtree."""
     tid: int
-    subtree: list[int] | None = None
+    subtree: list[int | str] = []
     tree_data: TreeData | None = None
 
     tid_subtree = get_tid(tree_id)
     if tid_subtree is not None:
         tid, subtree = tid_subtree
-        tree_data = GLOBAL_TREE_CACHE.trees[int(tid)]
-
-    load_tree(tree_id)  # load if it was not loaded in memory
-    tree_data.timer = time()  # type: ignore # update the tree's timer
+        # Load if it was not loaded in memory (or was evicted from it).
+        tree_data, _ = load_tree_data(tree_id)
+        tree_data.timer = time()  # update the tree's timer
     return tree_data, subtree
 
 
+def tree_lock(tree_id: str | int | None) -> ReadWriteLock:
+    """Return the lock of the tree (loading it if needed).
+
+    Hold it for writing while changing the tree or its selections, searches
+    and active nodes, so draws never see them half-changed.
+    """
+    tree_data, _ = touch_and_get(tree_id)
+    return tree_data.lock  # type: ignore
+
+
 @router.get("/trees/{tree_id}")  # typed
 def get_tree_tree_id(tree_id: int | None) -> dict[str, str | list | None]:
     global GLOBAL_TREE_CACHE
@@ -140,19 +178,18 @@ def get_tree_tree_id(tree_id: int | None) -> dict[str, str | list | None]:
             status_code=404,
             detail=f"Tree data not found or has None value for tree ID: {tree_id}.",
         )
-    props: set[str | int] = set()
-    node: Tree
-    for node in tree_data.tree[subtree].traverse():  # type: ignore
-        props |= {k for k in node.props if not k.startswith("_")}
+    props: list[str] = [
+        pname for pname in get_property_names(tree_id) if not pname.startswith("_")
+    ]
     tree_return: dict[str, str | list | None] = {
         "name": tree_data.name,
-        "props": list(props),
+        "props": props,
     }
     return tree_return
 
 
 @router.get("/trees/{tree_id}/nodeinfo")  # typed
-def get_tree_nodeinfo(tree_id: int | None) -> dict:
+def get_tree_nodeinfo(tree_id: str | None) -> dict:
     global GLOBAL_TREE_CACHE
     tree_data, subtree = touch_and_get(tree_id)
     if not tree_data:
@@ -160,7 +197,7 @@ def get_tree_nodeinfo(tree_id: int | None) -> dict:
             status_code=404,
             detail=f"Tree data not found or has None value for tree ID: {tree_id}.",
         )
-    nodeinfo: dict = tree_data.tree[subtree].props  # type: ignore
+    nodeinfo: dict = get_node(tree_data, subtree).props
     return nodeinfo
 
 
@@ -173,34 +210,35 @@ def get_tree_nodestyle(tree_id: str | int | None) -> NodeStyle:
             status_code=404,
             detail=f"Tree data not found nor in the database nor in the runtime cache with ID: {tree_id}",
         )
+    style: dict = get_node(tree_data, subtree).sm_style
     nodestyle: NodeStyle = NodeStyle(
-        fgcolor=tree_data.tree[subtree].sm_style["fgcolor"],
-        bgcolor=tree_data.tree[subtree].sm_style["bgcolor"],
-        fgopacity=tree_data.tree[subtree].sm_style["fgopacity"],
-        outline_line_color=tree_data.tree[subtree].sm_style["outline_line_color"],
-        outline_line_width=tree_data.tree[subtree].sm_style["outline_line_width"],
-        outline_color=tree_data.tree[subtree].sm_style["outline_color"],
-        outline_opacity=tree_data.tree[subtree].sm_style["outline_opacity"],
-        vt_line_color=tree_data.tree[subtree].sm_style["vt_line_color"],
-        hz_line_color=tree_data.tree[subtree].sm_style["hz_line_color"],
-        hz_line_type=tree_data.tree[subtree].sm_style["hz_line_type"],
-        vt_line_type=tree_data.tree[subtree].sm_style["vt_line_type"],
-        size=tree_data.tree[subtree].sm_style["size"],
-        shape=tree_data.tree[subtree].sm_style["shape"],
-        draw_descendants=tree_data.tree[subtree].sm_style["draw_descendants"],
-        hz_line_width=tree_data.tree[subtree].sm_style["hz_line_width"],
-        vt_line_width=tree_data.tree[subtree].sm_style["vt_line_width"],
+        fgcolor=style["fgcolor"],
+        bgcolor=style["bgcolor"],
+        fgopacity=style["fgopacity"],
+        outline_line_color=style["outline_line_color"],
+        outline_line_width=style["outline_line_width"],
+        outline_color=style["outline_color"],
+        outline_opacity=style["outline_opacity"],
+        vt_line_color=style["vt_line_color"],
+        hz_line_color=style["hz_line_color"],
+        hz_line_type=style["hz_line_type"],
+        vt_line_type=style["vt_line_type"],
+        size=style["size"],
+        shape=style["shape"],
+        draw_descendants=style["draw_descendants"],
+        hz_line_width=style["hz_line_width"],
+        vt_line_width=style["vt_line_width"],
     )
     return nodestyle
 
 
 @router.get("/trees/{tree_id}/editable_props")  # typed
-def get_tree_editable_props(tree_id: int | None) -> dict[str, str]:
+def get_tree_editable_props(tree_id: str | None) -> dict[str, str]:
     global GLOBAL_TREE_CACHE
     tree_data, subtree = touch_and_get(tree_id)
     filtered_props: dict[str, str] = {
         k: v
-        for k, v in tree_data.tree[subtree].props.items()  # type: ignore
+        for k, v in get_node(tree_data, subtree).props.items()  # type: ignore
         if k not in ["tooltip", "hyperlink"] and type(v) in [int, float, str]
     }
     return filtered_props
@@ -228,7 +266,7 @@ def get_tree_newick(tree_id: int | str) -> str:
 
 
 @router.get("/trees/{tree_id}/seq")  # typed
-def get_tree_seq(tree_id: int | None) -> str:
+def get_tree_seq(tree_id: str | None) -> str:
     global GLOBAL_TREE_CACHE
     tree_data, subtree = touch_and_get(tree_id)
 
@@ -240,18 +278,33 @@ def get_tree_seq(tree_id: int | None) -> str:
 
     fasta_leaf: str = "\n".join(
         fasta(leaf)
-        for leaf in tree_data.tree[subtree].leaves()  # type: ignore
-        if leaf.props.get("seq")
+        for leaf in get_leaves_with_seq(get_node(tree_data, subtree))  # type: ignore
     )
 
     return fasta_leaf
 
 
+def get_leaves_with_seq(tree: Tree_ete) -> Iterator[Tree_ete]:
+    """Yield the leaves with a sequence, in order.
+
+    Subtrees without any (according to their count nseqs) are skipped.
+    """
+    pending: list[Tree_ete] = [tree] if tree.nseqs > 0 else []
+    while pending:
+        node: Tree_ete = pending.pop()
+        if node.is_leaf:
+            yield node
+        else:
+            pending.extend(
+                child for child in reversed(node.children) if child.nseqs > 0
+            )
+
+
 @router.get("/trees/{tree_id}/nseq")  # typed
 def get_tree_nseq(tree_id: str | None | int) -> int:
     global GLOBAL_TREE_CACHE
     tree_data, subtree = touch_and_get(tree_id)
-    return sum(1 for leaf in tree_data.tree[subtree].leaves() if leaf.props.get("seq"))  # type: ignore
+    return get_node(tree_data, subtree).nseqs  # type: ignore
 
 
 @router.get("/trees/{tree_id}/all_selections")  # typed
@@ -265,14 +318,19 @@ def get_tree_all_selections(
             status_code=404, detail=f"Tree data not found for tree ID: {tree_id}."
         )
     all_selections: dict[str, dict[int | str, dict[str, int]]] = {
-        "selected": {
-            name: {"nresults": len(results), "nparents": len(parents)}
-            for name, (results, parents) in (tree_data.selected or {}).items()
-        }
+        "selected": get_marks_counts(tree_data.selected)
     }
     return all_selections
 
 
+def get_marks_counts(marks: dict | None) -> dict[int | str, dict[str, int]]:
+    "Return the number of results and parents of the given searches or selections"
+    return {
+        text: {"nresults": len(results), "nparents": len(parents)}
+        for text, (results, parents) in (marks or {}).items()
+    }
+
+
 @router.get("/trees/{tree_id}/selections")  # typed
 def get_tree_selections(
     tree_id: str | None,
@@ -293,28 +351,32 @@ def get_tree_select(tree_id: str, request: Request) -> dict[str, str | int]:
     select_params: QueryParams = request.query_params
     nresults: int
     nparents: int
-    nresults, nparents = store_selection(tree_id, dict(select_params))
+    with tree_lock(tree_id).write():
+        nresults, nparents = store_selection(tree_id, dict(select_params))
     return {"message": "ok", "nresults": nresults, "nparents": nparents}
 
 
 @router.get("/trees/{tree_id}/unselect")  # typed
 def get_tree_unselect(tree_id: str, request: Request) -> dict[str, str]:
     global GLOBAL_TREE_CACHE
-    removed: bool = unselect_node(tree_id, dict(request.query_params))
+    with tree_lock(tree_id).write():
+        removed: bool = unselect_node(tree_id, dict(request.query_params))
     return {"message": "ok" if removed else "selection not found"}
 
 
 @router.get("/trees/{tree_id}/remove_selection")  # typed
 def get_tree_remove_selection(tree_id: str, request: Request) -> dict[str, str]:
     global GLOBAL_TREE_CACHE
-    removed: tuple = remove_selection(tree_id, dict(request.query_params))
+    with tree_lock(tree_id).write():
+        removed: tuple = remove_selection(tree_id, dict(request.query_params))
     return {"message": "ok" if removed else "selection not found"}
 
 
 @router.get("/trees/{tree_id}/change_selection_name")  # typed
 def get_tree_change_Selection_name(tree_id: int, request: Request) -> dict[str, str]:
     global GLOBAL_TREE_CACHE
-    change_selection_name(tree_id, dict(request.query_params))
+    with tree_lock(tree_id).write():
+        change_selection_name(tree_id, dict(request.query_params))
     return {"message": "ok"}
 
 
@@ -330,14 +392,16 @@ def get_tree_selection_info(
 @router.get("/trees/{tree_id}/search_to_selection")  # typed
 def get_tree_search_to_selection(tree_id: int, request: Request):
     global GLOBAL_TREE_CACHE
-    search_to_selection(tree_id, dict(request.query_params))
+    with tree_lock(tree_id).write():
+        search_to_selection(tree_id, dict(request.query_params))
     return {"message": "ok"}
 
 
 @router.get("/trees/{tree_id}/prune_by_selection")  # pending
 def get_tree_prune_by_selection(tree_id: int, request: Request) -> dict[str, str]:
     global GLOBAL_TREE_CACHE
-    prune_by_selection(tree_id, dict(request.query_params))
+    with tree_lock(tree_id).write():
+        prune_by_selection(tree_id, dict(request.query_params))
     return {"message": "ok"}
 
 
@@ -345,7 +409,7 @@ def get_tree_prune_by_selection(tree_id: int, request: Request) -> dict[str, str
 def get_tree_active(tree_id: str) -> str:
     global GLOBAL_TREE_CACHE
     tree_data, subtree = touch_and_get(tree_id)
-    node: Tree = tree_data.tree[subtree]  # type: ignore
+    node: Tree_ete = get_node(tree_data, subtree)  # type: ignore
 
     if get_active_clade(node, tree_data.active.clades.results):  # type: ignore
         return "active_clade"
@@ -358,28 +422,32 @@ def get_tree_active(tree_id: str) -> str:
 @router.get("/trees/{tree_id}/activate_node")  # typed
 def get_tree_activate_node(tree_id: str) -> dict[str, str]:
     global GLOBAL_TREE_CACHE
-    activate_node(tree_id)
+    with tree_lock(tree_id).write():
+        activate_node(tree_id)
     return {"message": "ok"}
 
 
 @router.get("/trees/{tree_id}/deactivate_node")  # typed
 def get_tree_deactivate_node(tree_id: str) -> dict[str, str]:
     global GLOBAL_TREE_CACHE
-    deactivate_node(tree_id)
+    with tree_lock(tree_id).write():
+        deactivate_node(tree_id)
     return {"message": "ok"}
 
 
 @router.get("/trees/{tree_id}/activate_clade")  # typed
 def get_tree_activate_clade(tree_id: str) -> dict[str, str]:
     global GLOBAL_TREE_CACHE
-    activate_clade(tree_id)
+    with tree_lock(tree_id).write():
+        activate_clade(tree_id)
     return {"message": "ok"}
 
 
 @router.get("/trees/{tree_id}/deactivate_clade")  # typed
 def get_tree_deactivate_clade(tree_id: str) -> dict[str, str]:
     global GLOBAL_TREE_CACHE
-    deactivate_clade(tree_id)
+    with tree_lock(tree_id).write():
+        deactivate_clade(tree_id)
     return {"message": "ok"}
 
 
@@ -387,7 +455,8 @@ def get_tree_deactivate_clade(tree_id: str) -> dict[str, str]:
 def get_tree_store_active_nodes(tree_id: str, request: Request) -> dict[str, str | int]:
     global GLOBAL_TREE_CACHE
     tree_data, _ = touch_and_get(tree_id)
-    nresults, nparents = store_active(tree_data, 0, dict(request.query_params))
+    with tree_data.lock.write():  # type: ignore
+        nresults, nparents = store_active(tree_data, 0, dict(request.query_params))
     return {"message": "ok", "nresults": nresults, "nparents": nparents}
 
 
@@ -397,7 +466,8 @@ def get_tree_store_active_clades(
 ) -> dict[str, str | int]:
     global GLOBAL_TREE_CACHE
     tree_data, _ = touch_and_get(tree_id)
-    nresults, nparents = store_active(tree_data, 1, dict(request.query_params))
+    with tree_data.lock.write():  # type: ignore
+        nresults, nparents = store_active(tree_data, 1, dict(request.query_params))
     return {"message": "ok", "nresults": nresults, "nparents": nparents}
 
 
@@ -405,7 +475,8 @@ def get_tree_store_active_clades(
 def get_tree_remote_active_nodes(tree_id: str) -> dict[str, str]:
     global GLOBAL_TREE_CACHE
     tree_data, _ = touch_and_get(tree_id)
-    remove_active(tree_data, 0)
+    with tree_data.lock.write():  # type: ignore
+        remove_active(tree_data, 0)
     return {"message": "ok"}
 
 
@@ -413,7 +484,8 @@ def get_tree_remote_active_nodes(tree_id: str) -> dict[str, str]:
 def get_tree_remote_active_clades(tree_id: str) -> dict[str, str]:
     global GLOBAL_TREE_CACHE
     tree_data, _ = touch_and_get(tree_id)
-    remove_active(tree_data, 1)
+    with tree_data.lock.write():  # type: ignore
+        remove_active(tree_data, 1)
     return {"message": "ok"}
 
 
@@ -424,8 +496,8 @@ def get_tree_all_active(
     global GLOBAL_TREE_CACHE
     tree_data, _ = touch_and_get(tree_id)
     return {
-        "nodes": get_nodes_info(tree_data.active.nodes.results, ["*"]),  # type: ignore
-        "clades": get_nodes_info(tree_data.active.clades.results, ["*"]),  # type: ignore
+        "nodes": get_nodes_info(tree_data, tree_data.active.nodes.results, ["*"]),  # type: ignore
+        "clades": get_nodes_info(tree_data, tree_data.active.clades.results, ["*"]),  # type: ignore
     }
 
 
@@ -437,12 +509,17 @@ def get_tree_all_active_leaves(
 ):  # Need to check the contents of the output list
     global GLOBAL_TREE_CACHE
     tree_data, _ = touch_and_get(tree_id)
+    if not tree_data:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Tree data not found or has None value for tree ID: {tree_id}.",
+        )
     active_leaves: set[str] = set(
         n for n in tree_data.active.nodes.results if n.is_leaf  # type: ignore
     )
     for n in tree_data.active.clades.results:  # type: ignore
         active_leaves.update(set(n.leaves()))
-    return get_nodes_info(active_leaves, ["*"])
+    return get_nodes_info(tree_data, active_leaves, ["*"])
 
 
 @router.get("/trees/{tree_id}/searches")  # typed
@@ -456,12 +533,7 @@ def get_tree_searches(
             status_code=404,
             detail=f"Tree data not found or has None value for tree ID: {tree_id}.",
         )
-    return {
-        "searches": {
-            text: {"nresults": len(results), "nparents": len(parents)}
-            for text, (results, parents) in (tree_data.searches or {}).items()
-        }
-    }
+    return {"searches": get_marks_counts(tree_data.searches)}
 
 
 @router.get("/trees/{tree_id}/search")  # typed
@@ -469,14 +541,16 @@ def get_tree_search(tree_id: str, request: Request) -> dict[str, int | str]:
     global GLOBAL_TREE_CACHE
     nresults: int
     nparents: int
-    nresults, nparents = store_search(tree_id, dict(request.query_params))  # type: ignore
+    with tree_lock(tree_id).write():
+        nresults, nparents = store_search(tree_id, dict(request.query_params))  # type: ignore
     return {"message": "ok", "nresults": nresults, "nparents": nparents}
 
 
 @router.get("/trees/{tree_id}/remove_search")  # typed
 def get_tree_remove_search(tree_id: int, request: Request) -> dict[str, str]:
     global GLOBAL_TREE_CACHE
-    removed: tuple = remove_search(tree_id, dict(request.query_params))
+    with tree_lock(tree_id).write():
+        removed: tuple = remove_search(tree_id, dict(request.query_params))
     return {"message": "ok" if removed else "search not found"}
 
 
@@ -493,7 +567,7 @@ def get_tree_find(tree_id: str, request: Request) -> dict[str, str]:
         node: Tree_ete = find_node(tree_data.tree, dict(request.query_params))
         if node is None:
             raise HTTPException(status_code=404, detail="Returned node has None value!")
-        return {"id": ",".join(map(str, node.id))}
+        return {"id": get_node_handle(tree_data, node)}
     except Exception as e:
         print(f"[ERROR] {str(e)}", file=sys.stderr)
         raise HTTPException(
@@ -501,56 +575,247 @@ def get_tree_find(tree_id: str, request: Request) -> dict[str, str]:
         )
 
 
+# Bytes of ndjson to gather before passing them to the compressor/client.
+DRAW_STREAM_CHUNK_SIZE: int = 64 * 1024
+# Biggest streamed response (as sent) that is also kept in the draw cache.
+DRAW_STREAM_MAX_CACHED_BYTES: int = 8 * 1024**2
+
+
 @router.get("/trees/{tree_id}/draw")  # typed
-def get_tree_draw(tree_id, request: Request, response: Response) -> Response:
+async def get_tree_draw(tree_id, request: Request, response: Response) -> Response:
+    """Return the graphics of the tree for the viewport in the query params.
+
+    With stream=1, graphics are sent as they are drawn, one json array per
+    line (ndjson), instead of all together in a single json array.
+    """
     global GLOBAL_TREE_CACHE
-    tree_data = GLOBAL_TREE_CACHE.trees.get(int(tree_id))
+    draw_args: dict[str, str] = dict(request.query_params)
+    stream: bool = draw_args.pop("stream", "0") == "1"
+    if stream:  # a stream cannot be shared with other requests
+        return await stream_tree_draw(tree_id, draw_args)
+
+    # Identical requests being drawn at the same time are drawn only once.
+    # The version is in the key (like in the draw cache), so a request made
+    # after an edit does not join a draw of the tree from before it.
+    tid: int
+    tid, _ = get_tid(tree_id)  # type: ignore
+    draw_key: tuple = (
+        str(tree_id),
+        GLOBAL_TREE_CACHE.get_version(tid),
+        normalize_draw_args(draw_args),
+    )
+    graphics: DrawResponse = await DRAW_EXECUTOR.run(
+        draw_key, draw_tree, tree_id, draw_args
+    )
+    return draw_response(graphics)
+
+
+async def stream_tree_draw(tree_id: str, draw_args: dict[str, str]) -> Response:
+    """Return a response that streams the drawing of the tree.
+
+    The tree is drawn in the draw executor like any other drawing (so it
+    counts against its limits), which passes the chunks to the response
+    through a queue as they are ready. It never waits for the client, so
+    the tree stays locked only while it is being drawn.
+    """
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+    chunks: asyncio.Queue[bytes | Exception | None] = asyncio.Queue()
+
+    def send(chunk: bytes | Exception | None) -> None:
+        loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+
+    def draw() -> None:
+        try:
+            draw_tree(tree_id, draw_args, send)
+        except Exception as e:  # raised again by the response
+            send(e)
+        else:
+            send(None)  # the end
+
+    DRAW_EXECUTOR.submit(None, draw)
+
+    # Errors before the first chunk can still be returned with their status.
+    first_chunk: bytes | Exception | None = await chunks.get()
+    if isinstance(first_chunk, Exception):
+        raise first_chunk
+
+    async def stream_chunks() -> AsyncIterator[bytes]:
+        chunk: bytes | Exception | None = first_chunk
+        while chunk is not None:
+            if isinstance(chunk, Exception):
+                raise chunk  # too late for an error status
+            yield chunk
+            chunk = await chunks.get()
+
+    return StreamingResponse(
+        stream_chunks(),
+        media_type="application/x-ndjson",
+        headers={"Content-Encoding": "br"} if GLOBAL_TREE_CACHE.compress else None,
+    )
+
+
+def draw_tree(
+    tree_id: str,
+    draw_args: dict[str, str],
+    send: Callable[[bytes], None] | None = None,
+) -> DrawResponse | None:
+    """Return the drawing of the tree (run in the draw executor threads).
+
+    If send is given, the drawing is passed to it in chunks of ndjson as
+    it is drawn (see stream_draw()), and None is returned.
+    """
+    global GLOBAL_TREE_CACHE
+    tid: int
+    subtree: list[int | str]
+    tid, subtree = get_tid(tree_id)  # type: ignore
+    tree_data: TreeData | None = None
+    if GLOBAL_TREE_CACHE.contains(tid):
+        tree_data = get_tree_data(tid)
     if not tree_data or not tree_data.tree_node_tooltip_data:
         raise HTTPException(
             status_code=404,
             detail=f"Tree data not found nor in the database nor in the runtime cache with ID: {tree_id}",
         )
 
-    drawer: drawer_module.DrawerRectFaces | None = get_drawer(
-        tree_id, dict(request.query_params)
-    )
+    # get_drawer() takes the write lock itself when the layouts or the
+    # ultrametric state asked for need a change of the tree.
+    drawer: drawer_module.DrawerRectFaces | None = get_drawer(tree_id, draw_args)
     if drawer is None:
         raise HTTPException(
             status_code=404,
             detail=f"Returned drawer has None value for tree ID: {tree_id}!",
         )
+
+    # get_drawer() may have reloaded the tree.
+    tree_data = get_tree_data(tid)
+    with tree_data.lock.read():  # many draws at once, but no changes meanwhile
+        cache_key = DRAW_RESPONSE_CACHE.make_key(
+            tid,
+            tree_data.version,
+            {**draw_args, "stream": str(int(send is not None)), "subtree": str(subtree)},
+            GLOBAL_TREE_CACHE.compress,
+        )
+        cached_response: DrawResponse | None = DRAW_RESPONSE_CACHE.get(cache_key)
+        if cached_response is not None:
+            if send is None:
+                return cached_response
+            send(cached_response.content)
+            return None
+
+        if send is not None:
+            stream_draw(drawer, tree_data, cache_key, send)
+            return None
+
+        try:
+            drawed_graphics = [
+                add_tooltip_data(graphic, tree_data) for graphic in drawer.draw()
+            ]
+        except (AssertionError, SyntaxError) as e:
+            raise HTTPException(status_code=400, detail=f"when drawing: {e}")
+
+    graphics: bytes = json.dumps(drawed_graphics).encode("utf8")
+    new_response: DrawResponse = DrawResponse(content=graphics)
+    if GLOBAL_TREE_CACHE.compress:  # type: ignore
+        new_response = DrawResponse(
+            content=brotli.compress(graphics), content_encoding="br"
+        )
+    DRAW_RESPONSE_CACHE.put(cache_key, new_response)
+    return new_response
+
+
+def add_tooltip_data(graphic: list, tree_data: TreeData) -> list:
+    """Return the graphic, with the tooltip data as props if it is a protein."""
+    if graphic[0] == "nodebox":
+        tooltip: dict | None = tree_data.tooltip_index.get(graphic[2])  # type: ignore
+        if tooltip is not None:
+            graphic[3] = tooltip
+    return graphic
+
+
+def stream_draw(
+    drawer: drawer_module.DrawerRectFaces,
+    tree_data: TreeData,
+    cache_key: tuple,
+    send: Callable[[bytes], None],
+) -> None:
+    """Send the graphics of the drawer as (maybe compressed) ndjson chunks.
+
+    Must be called with the tree locked for reading. Once sent, the
+    response is cached too, unless it is too big (keeping it would defeat
+    the purpose of streaming).
+    """
+    compressor: Any = brotli.Compressor() if GLOBAL_TREE_CACHE.compress else None
+    sent: list[bytes] | None = []  # None if it will not be cached
+    nsent: int = 0
+
+    def encode(data: bytes) -> bytes:
+        return compressor.process(data) if compressor is not None else data
+
+    def keep_and_send(chunk: bytes) -> None:
+        nonlocal sent, nsent
+        nsent += len(chunk)
+        if sent is not None and nsent <= DRAW_STREAM_MAX_CACHED_BYTES:
+            sent.append(chunk)
+        else:
+            sent = None
+        send(chunk)
+
+    lines: list[bytes] = []
+    nbytes: int = 0
     try:
-        drawed_graphics = list(drawer.draw())
-        for idx, g in enumerate(drawed_graphics):
-            if g[0] == "nodebox" and str(drawed_graphics[idx][2]).lower().startswith(
-                "phy"
-            ):
-                node_id: str = drawed_graphics[idx][2]
-                node_id_parts: list[str] = node_id.lower().replace("phy", "").split("_")
-                protein_id: str = node_id_parts[0]
-                drawed_graphics[idx][3] = {
-                    "node_id": node_id,
-                    **tree_data.tree_node_tooltip_data[int(protein_id)].model_dump(),
-                }
-
-        graphics: bytes = json.dumps(drawed_graphics).encode("utf8")
-        if GLOBAL_TREE_CACHE.compress:  # type: ignore
-            compressed_graphics: bytes = brotli.compress(graphics)
-            response = Response(
-                content=compressed_graphics, media_type="application/json"
-            )
-            response.headers["Content-Encoding"] = "br"
-            return response
-        return Response(content=graphics, media_type="application/json")
+        for graphic in drawer.draw():
+            line: bytes = json.dumps(add_tooltip_data(graphic, tree_data)).encode()
+            lines.append(line + b"\n")
+            nbytes += len(line) + 1
+            if nbytes >= DRAW_STREAM_CHUNK_SIZE:
+                chunk: bytes = encode(b"".join(lines))
+                lines, nbytes = [], 0
+                if chunk:
+                    keep_and_send(chunk)
     except (AssertionError, SyntaxError) as e:
-        raise HTTPException(status_code=400, detail=f"when drawing: {e}")
+        if nsent == 0:
+            raise HTTPException(status_code=400, detail=f"when drawing: {e}")
+        # Too late for an error status: the response has already started.
+        print(f"[ERROR] when drawing: {e}", file=sys.stderr)
+        sent = None  # do not cache an incomplete drawing
+
+    chunk = encode(b"".join(lines))
+    if compressor is not None:
+        chunk += compressor.finish()
+    if chunk:
+        keep_and_send(chunk)
+
+    if sent is not None:
+        DRAW_RESPONSE_CACHE.put(
+            cache_key,
+            DrawResponse(
+                content=b"".join(sent),
+                content_encoding="br" if compressor is not None else None,
+                media_type="application/x-ndjson",
+            ),
+        )
+
+
+def draw_response(graphics: DrawResponse) -> Response:
+    response = Response(content=graphics.content, media_type=graphics.media_type)
+    if graphics.content_encoding is not None:
+        response.headers["Content-Encoding"] = graphics.content_encoding
+    return response
+
+
+@router.get("/trees/{tree_id}/tooltips/{layout_name}/{tooltip_id}")  # typed
+def get_tree_tooltip(tree_id: str, layout_name: str, tooltip_id: int) -> str:
+    """Return the html of a tooltip that faces in the drawings refer to."""
+    global GLOBAL_TREE_CACHE
+    touch_and_get(tree_id)
+    return get_layout_tooltip(tree_id, layout_name, tooltip_id)
 
 
 @router.get("/trees/{tree_id}/size")  # typed
 def get_tree_size(tree_id: str) -> dict[str, float]:
     global GLOBAL_TREE_CACHE
     tree_data, subtree = touch_and_get(tree_id)
-    width, height = tree_data.tree[subtree].size  # type: ignore
+    width, height = get_node(tree_data, subtree).size  # type: ignore
     return {"width": width, "height": height}
 
 
@@ -570,12 +835,8 @@ def get_trees_collapse(tree_id: str) -> int:
 @router.get("/trees/{tree_id}/properties")  # typed
 def get_tree_properties(tree_id: str) -> list[str]:
     global GLOBAL_TREE_CACHE
-    tree_data, subtree = touch_and_get(tree_id)
-    props: set[str] = set()
-    for node in tree_data.tree[subtree].traverse():  # type: ignore
-        props = node.props.keys()
-
-    return list(props)
+    touch_and_get(tree_id)
+    return get_property_names(tree_id)
 
 
 @router.get("/trees/{tree_id}/properties/{pname}")  # typed
@@ -584,20 +845,32 @@ def get_tree_properties_pname(tree_id: str, pname: str) -> dict[str, float] | No
     return get_stats(tree_id, pname)
 
 
+@router.get("/trees/{tree_id}/properties/{pname}/percentiles")  # typed
+def get_tree_properties_percentiles(
+    tree_id: str, pname: str, q: str = "5,25,50,75,95"
+) -> dict[str, float]:
+    global GLOBAL_TREE_CACHE
+    touch_and_get(tree_id)
+    return get_percentiles(tree_id, pname, q)
+
+
+@router.get("/trees/{tree_id}/properties/{pname}/histogram")  # typed
+def get_tree_properties_histogram(
+    tree_id: str, pname: str, bins: int = 10
+) -> dict[str, list]:
+    global GLOBAL_TREE_CACHE
+    touch_and_get(tree_id)
+    return get_histogram(tree_id, pname, bins)
+
+
 @router.get("/trees/{tree_id}/nodecount")  # typed
 def get_tree_nodecount(tree_id: str) -> dict[str, int]:
     global GLOBAL_TREE_CACHE
     tree_data, subtree = touch_and_get(tree_id)
 
-    tnodes: int = 0
-    tleaves: int = 0
-    node: Tree_ete
-    for node in tree_data.tree[subtree].traverse():  # type: ignore
-        tnodes += 1
-        if node.is_leaf:
-            tleaves += 1
-
-    return {"tnodes": tnodes, "tleaves": tleaves}
+    # Counts kept up to date with the sizes of the nodes.
+    node: Tree_ete = get_node(tree_data, subtree)  # type: ignore
+    return {"tnodes": node.nnodes, "tleaves": int(node.size[1])}
 
 
 @router.get("/trees/{tree_id}/ultrametric")  # typed
@@ -610,21 +883,62 @@ def get_tree_ultrametric(tree_id: str) -> bool | None:
     return ultrametric
 
 
-@router.put("/trees/{tree_id}/sort")  # typed
-async def put_tree_sort(tree_id: str, request: Request) -> dict[str, str]:
+@router.get("/trees/{tree_id}/metadata")  # typed
+def get_tree_metadata(tree_id: str, drawer: str | None = None) -> dict[str, Any]:
+    """Return all that the GUI asks for when it opens a tree, in one response.
+
+    It has what the endpoints name, size, nodecount, ultrametric,
+    collapse_size, all_selections and searches return, and the ones of
+    /layouts/{tree_id} and /drawers/{drawer}/{tree_id} (None if the
+    drawer is not valid, or not given).
+    """
     global GLOBAL_TREE_CACHE
-    body: dict = await request.json()
+    tree_data, subtree = touch_and_get(tree_id)
+    if not tree_data or not tree_data.tree or not tree_data.style:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Tree data not found nor in the database nor in the runtime cache with ID: {tree_id}",
+        )
+
+    with tree_data.lock.read():
+        node: Tree_ete = get_node(tree_data, subtree)
+        drawer_info: dict[str, str | int] | None = None
+        if drawer:
+            try:
+                drawer_info = get_drawer_info(drawer, tree_data)
+            except HTTPException:
+                pass  # the GUI falls back to a default drawer
+
+        width: float
+        height: float
+        width, height = node.size
+        return {
+            "name": tree_data.name,
+            "size": {"width": width, "height": height},
+            "nodecount": {"tnodes": node.nnodes, "tleaves": int(height)},
+            "ultrametric": tree_data.ultrametric,
+            "collapse_size": tree_data.style.collapse_size,
+            "layouts": get_layouts_state(tree_data),
+            "drawer": drawer_info,
+            "selected": get_marks_counts(tree_data.selected),
+            "searches": get_marks_counts(tree_data.searches),
+        }
+
 
+@router.put("/trees/{tree_id}/sort")  # typed
+def put_tree_sort(tree_id: str, body: Any = Body()) -> dict[str, str]:
+    global GLOBAL_TREE_CACHE
     node_id: str
     key_text: str
     reverse: bool
     node_id, key_text, reverse = body
-    sort_subtree(tree_id, node_id, key_text, reverse)
-    return {"message": "ok"}
+    with tree_lock(tree_id).write():
+        subtree_id: str = sort_subtree(tree_id, node_id, key_text, reverse)
+    return {"message": "ok", "subtree": subtree_id}
 
 
 @router.put("/trees/{tree_id}/set_outgroup")  # typed
-async def put_tree_set_outgroup(tree_id: str, request: Request) -> dict[str, str]:
+def put_tree_set_outgroup(tree_id: str, node_id: Any = Body()) -> dict[str, str]:
     global GLOBAL_TREE_CACHE
     tree_data, subtree = touch_and_get(tree_id)
     if not tree_data or not tree_data.ultrametric:
@@ -636,28 +950,43 @@ async def put_tree_set_outgroup(tree_id: str, request: Request) -> dict[str, str
         raise HTTPException(
             status_code=400, detail="operation not allowed with subtree"
         )
-    node_id: dict = await request.json()
-    tree_data.tree.set_outgroup(tree_data.tree[node_id])  # type: ignore
-    ops.update_sizes_all(tree_data.tree)
-    return {"message": "ok"}
+    with tree_data.lock.write():
+        node: Tree_ete = get_node(tree_data, get_node_steps(node_id))
+        # Rerooting only changes the nodes in its lineage (and their children).
+        lineage: list[Tree_ete] = list(node.lineage())
+        tree_data.tree.set_outgroup(node)  # type: ignore
+        ops.update_sizes_dirty(
+            lineage + [child for n in lineage for child in n.children]
+        )
+        mark_tree_modified(tree_data, reindex=True)
+        subtree_id: str = get_subtree_id(tree_data, tree_data.tree)
+    return {"message": "ok", "subtree": subtree_id}
 
 
 @router.put("/trees/{tree_id}/move")  # typed
-async def put_tree_move(tree_id: str, request: Request) -> dict[str, str] | None:
+def put_tree_move(tree_id: str, body: Any = Body()) -> dict[str, str] | None:
     global GLOBAL_TREE_CACHE
     tree_data, subtree = touch_and_get(tree_id)
-    body: dict = await request.json()
+    if not tree_data:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Tree data not found or has None value for tree ID: {tree_id}.",
+        )
     node_id: str = body[0]
     shift: str = body[1]
     try:
-        ops.move(tree_data.tree[subtree][node_id], shift)  # type: ignore
-        return {"message": "ok"}
+        with tree_data.lock.write():
+            tree: Tree_ete = get_node(tree_data, subtree)
+            ops.move(get_node(tree_data, subtree + get_node_steps(node_id)), shift)
+            mark_tree_modified(tree_data, reindex=True)
+            subtree_id: str = get_subtree_id(tree_data, tree)
+        return {"message": "ok", "subtree": subtree_id}
     except AssertionError as e:
         raise HTTPException(status_code=400, detail=f"cannot move {node_id}: {e}")
 
 
 @router.put("/trees/{tree_id}/remove")  # typed
-async def put_tree_remove(tree_id: str, request: Request) -> dict[str, str] | None:
+def put_tree_remove(tree_id: str, node_id: Any = Body()) -> dict[str, str] | None:
     global GLOBAL_TREE_CACHE
     tree_data, subtree = touch_and_get(tree_id)
     if not tree_data or not tree_data.ultrametric:
@@ -665,34 +994,40 @@ async def put_tree_remove(tree_id: str, request: Request) -> dict[str, str] | No
             status_code=404,
             detail=f"Tree data not found nor in the database nor in the runtime cache with ID: {tree_id}",
         )
-    body: str = await request.json()
-    node_id: str = body
     try:
-        ops.remove(tree_data.tree[subtree][node_id])  # type: ignore
-        ops.update_sizes_all(tree_data.tree)
+        with tree_data.lock.write():
+            tree: Tree_ete = get_node(tree_data, subtree)
+            node: Tree_ete = get_node(tree_data, subtree + get_node_steps(node_id))
+            parent: Tree_ete | None = node.up
+            ops.remove(node)
+            ops.update_sizes_dirty([parent])
+            mark_tree_modified(tree_data, reindex=True)
+            subtree_id: str = get_subtree_id(tree_data, tree)
     except AssertionError as e:
         raise HTTPException(status_code=400, detail=f"cannot move {node_id}: {e}")
 
-    return {"message": "ok"}
+    return {"message": "ok", "subtree": subtree_id}
 
 
 @router.put("/trees/{tree_id}/rename")  # typed
-async def put_tree_rename(tree_id: str, request: Request) -> dict[str, str] | None:
+def put_tree_rename(tree_id: str, body: Any = Body()) -> dict[str, str] | None:
     global GLOBAL_TREE_CACHE
     tree_data, subtree = touch_and_get(tree_id)
     node_id: str = ""
-    body = await request.json()
     try:
         node_id = body[0]
         name: str = body[1]
-        tree_data.tree[subtree][node_id].name = name  # type: ignore
+        with tree_data.lock.write():  # type: ignore
+            get_node(tree_data, subtree + get_node_steps(node_id)).name = name  # type: ignore
+            index_node_tooltip(tree_data, name)  # type: ignore
+            mark_tree_modified(tree_data, reindex=True)  # type: ignore
     except AssertionError as e:
         raise HTTPException(status_code=400, detail=f"cannot rename {node_id}: {e}")
     return {"message": "ok"}
 
 
 @router.put("/trees/{tree_id}/edit")  # typed
-async def put_tree_edit(tree_id: str, request: Request) -> dict[str, str] | None:
+def put_tree_edit(tree_id: str, body: Any = Body()) -> dict[str, str] | None:
     global GLOBAL_TREE_CACHE
     tree_data, subtree = touch_and_get(tree_id)
     if not tree_data or not tree_data.tree:
@@ -700,21 +1035,23 @@ async def put_tree_edit(tree_id: str, request: Request) -> dict[str, str] | None
             status_code=404,
             detail=f"Tree data not found nor in the database nor in the runtime cache with ID: {tree_id}",
         )
-    body = await request.json()
     node_id: str = body[0]
     content: str = body[1]
     try:
-        node: Tree = tree_data.tree[subtree][node_id]  # type: ignore
+        with tree_data.lock.write():
+            node: Tree_ete = get_node(tree_data, subtree + get_node_steps(node_id))
 
-        node.props = newick.get_props(content, is_leaf=True)
-        ops.update_sizes_all(tree_data.tree)
+            node.props = newick.get_props(content, is_leaf=True)
+            ops.update_sizes_dirty([node])
+            index_node_tooltip(tree_data, node.name)
+            mark_tree_modified(tree_data, reindex=True)
         return {"message": "ok"}
     except (AssertionError, newick.NewickError) as e:
         raise HTTPException(status_code=400, detail=f"cannot edit {node_id}: {e}")
 
 
 @router.put("/trees/{tree_id}/to_dendrogram")  # typing
-async def put_tree_to_dendrogram(tree_id: str, request: Request) -> dict[str, str]:
+def put_tree_to_dendrogram(tree_id: str, node_id: Any = Body()) -> dict[str, str]:
     global GLOBAL_TREE_CACHE
     tree_data, subtree = touch_and_get(tree_id)
     if not tree_data or not tree_data.tree:
@@ -722,15 +1059,18 @@ async def put_tree_to_dendrogram(tree_id: str, request: Request) -> dict[str, st
             status_code=404,
             detail=f"Tree data not found nor in the database nor in the runtime cache with ID: {tree_id}",
         )
-    node_id: str = await request.json()
-    ops.to_dendrogram(tree_data.tree[subtree][node_id])  # type: ignore
-    ops.update_sizes_all(tree_data.tree)
+    with tree_data.lock.write():
+        node: Tree_ete = get_node(tree_data, subtree + get_node_steps(node_id))
+        ops.to_dendrogram(node)
+        ops.update_sizes_all(node)  # all its dists changed
+        ops.update_sizes_dirty([node.up])
+        mark_tree_modified(tree_data, props_changed=True)
     return {"message": "ok"}
 
 
 @router.put("/trees/{tree_id}/to_ultrametric")  # typing
-async def put_tree_to_ultrametric(
-    tree_id: str, request: Request
+def put_tree_to_ultrametric(
+    tree_id: str, node_id: Any = Body()
 ) -> dict[str, str] | None:
     global GLOBAL_TREE_CACHE
     tree_data, subtree = touch_and_get(tree_id)
@@ -740,11 +1080,12 @@ async def put_tree_to_ultrametric(
             detail=f"Tree data not found nor in the database nor in the runtime cache with ID: {tree_id}",
         )
     try:
-        body: str = await request.json()
-        node_id: str = body
-        node: Tree = tree_data.tree[subtree][node_id]  # type: ignore
-        ops.to_ultrametric(node)
-        ops.update_sizes_all(tree_data.tree)
+        with tree_data.lock.write():
+            node: Tree_ete = get_node(tree_data, subtree + get_node_steps(node_id))
+            ops.to_ultrametric(node)
+            ops.update_sizes_all(node)  # all its dists changed
+            ops.update_sizes_dirty([node.up])
+            mark_tree_modified(tree_data, props_changed=True)
         return {"message": "ok"}
     except AssertionError as e:
         raise HTTPException(
@@ -754,15 +1095,18 @@ async def put_tree_to_ultrametric(
 
 
 @router.put("/trees/{tree_id}/update_props")  # typing
-async def put_tree_update_props(
-    tree_id: str, request: Request
+def put_tree_update_props(
+    tree_id: str, body: dict = Body()
 ) -> dict[str, str] | None:
     global GLOBAL_TREE_CACHE
     tree_data, subtree = touch_and_get(tree_id)
-    node: Tree = tree_data.tree[subtree]  # type: ignore
-    body: dict = await request.json()
+    node: Tree_ete = get_node(tree_data, subtree)  # type: ignore
     try:
-        update_node_props(node, body)
+        with tree_data.lock.write():  # type: ignore
+            update_node_props(node, body)
+            ops.update_sizes_dirty([node])  # its dist may have changed
+            index_node_tooltip(tree_data, node.name)  # type: ignore
+            mark_tree_modified(tree_data, reindex=True)  # type: ignore
         return {"message": "ok"}
     except AssertionError as e:
         raise HTTPException(
@@ -772,16 +1116,17 @@ async def put_tree_update_props(
 
 
 @router.put("/trees/{tree_id}/update_nodestyle")  # typed
-async def put_tree_update_nodestyle(
-    tree_id: str, request: Request
+def put_tree_update_nodestyle(
+    tree_id: str, body: dict = Body()
 ) -> dict[str, str] | None:
     global GLOBAL_TREE_CACHE
     tree_data, subtree = touch_and_get(tree_id)
-    node: Tree = tree_data.tree[subtree]  # type: ignore
+    node: Tree_ete = get_node(tree_data, subtree)  # type: ignore
     try:
-        body: dict = await request.json()
-        update_node_style(node, dict(body))
-        tree_data.nodestyles[node] = body  # type: ignore
+        with tree_data.lock.write():  # type: ignore
+            update_node_style(node, dict(body))
+            tree_data.nodestyles[node] = body  # type: ignore
+            mark_tree_modified(tree_data)  # type: ignore
         return {"message": "ok"}
     except AssertionError as e:
         raise HTTPException(
@@ -799,8 +1144,9 @@ def put_tree_reinitialize(tree_id: str) -> dict[str, str]:
             status_code=404,
             detail=f"Tree data not found nor in the database nor in the runtime cache with ID: {tree_id}",
         )
-    tree_data.initialized = False
-    ops.update_sizes_all(tree_data.tree)
+    with tree_data.lock.write():
+        tree_data.initialized = False  # sizes are unchanged, only styles
+        mark_tree_modified(tree_data)
     return {"message": "ok"}
 
 
@@ -814,5 +1160,5 @@ def put_tree_reload(tree_id: str) -> dict[str, str]:
             status_code=400, detail="operation not allowed with subtree"
         )
 
-    GLOBAL_TREE_CACHE.trees.pop(tree_id, None)  # type: ignore # avoid possible key-error
+    reload_tree(int(tree_id))
     return {"message": "ok"}
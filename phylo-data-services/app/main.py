@@ -40,6 +40,7 @@ async def lifespan(app: FastAPI):
     BlastDBService.generate_blast_databases_for_genomes()
     PhyloExplorerDBService.generate_phylo_explorer_db()
     phylome_downloads_controller.setup_context()
+    GLOBAL_TREE_CACHE.start_background_eviction()
     yield
 
 
@@ -84,16 +85,18 @@ def nice_html(content, title="Tree Explorer"):
 @app.get("/", response_model=None)
 async def get_root() -> str | Response:
     global GLOBAL_TREE_CACHE
-    tree: dict[trees_controller.Tree] = GLOBAL_TREE_CACHE.trees  # type: ignore
+    tree: list[trees_controller.TreeData] = [
+        tree_data for _, tree_data in GLOBAL_TREE_CACHE.cached_trees()
+    ]
     if GLOBAL_TREE_CACHE and tree:
-        if len(GLOBAL_TREE_CACHE.trees) == 1:  # type: ignore
-            name: str = list(t.name for t in GLOBAL_TREE_CACHE.trees.values())[0]  # type: ignore
+        if len(tree) == 1:  # type: ignore
+            name: str = tree[0].name  # type: ignore
             response = RedirectResponse(url=f"/static/gui.html?tree={name}")
             return response
         else:
             trees: str = "\n".join(
                 '<li><a href="/static/gui.html?tree=' f'{t.name}">{t.name}</li>'
-                for t in GLOBAL_TREE_CACHE.trees.values()  # type: ignore
+                for t in tree  # type: ignore
             )
             return nice_html(f"<h1>Loaded Trees</h1><ul>\n{trees}\n</ul>")
     return nice_html(
@@ -2,14 +2,17 @@
 from __future__ import annotations
 
 import sys
+from copy import copy
 from dataclasses import dataclass
 from datetime import datetime
-from functools import lru_cache
 from itertools import groupby
 from typing import Callable, Optional
+from typing import Generic
+from typing import Hashable
 from typing import Iterable
-from typing import Iterator
+from typing import NamedTuple
 from typing import TypedDict
+from typing import TypeVar
 from uuid import uuid4
 
 import mariadb  # type: ignore
@@ -22,6 +25,9 @@ from models.gene_neighbourhood_dao import GeneNeighbourhoodDAO
 from models.homolog_dao import HomologDAO
 from models.orthologs_dao import OrthologsDAO
 from models.tree_node_tooltip_data_dao import TreeNodeTooltipData
+from utils.mariadb_connection import fetch_concurrently
+from utils.tree_view_data_cache import TreeViewDataCache
+from utils.tree_view_data_cache import TreeViewDataEntry
 
 ContigID = str
 ProteinID = int
@@ -30,6 +36,39 @@ MainContigGeneID = int
 SeedGene = GeneNeighbourhoodDAO
 MappedTreeTooltipData = dict[ProteinID, TreeNodeTooltipData]
 HexColor = str
+TooltipKey = tuple[GeneID, Optional[GeneID], Optional[GeneID]]  # gene, homolog, ortholog
+T = TypeVar("T")
+
+TREE_VIEW_DATA_CACHE = TreeViewDataCache()
+# Start of the tooltips of the faces that only refer to their html, as
+# "tooltip-ref:<layout name>/<tooltip id>" (the gui asks for it on hover).
+TOOLTIP_REF_PREFIX: str = "tooltip-ref:"
+
+
+class InternTable(Generic[T]):
+    """
+    Distinct records, each kept once and referred to by its index.
+    """
+
+    def __init__(self) -> None:
+        self.records: list[T] = []
+        self.indices: dict[Hashable, int] = {}
+
+    def intern(self, key: Hashable, record: T) -> int:
+        """
+        Returns the index of the record with the given key, adding it if new.
+        """
+        index: int | None = self.indices.get(key)
+        if index is None:
+            index = self.indices[key] = len(self.records)
+            self.records.append(record)
+        return index
+
+    def __getitem__(self, index: int) -> T:
+        return self.records[index]
+
+    def __len__(self) -> int:
+        return len(self.records)
 
 
 class CustomLayout:
@@ -42,10 +81,23 @@ class CustomLayout:
 
 
 class GeneOrderTreeLayout(CustomLayout):
+    """
+    Layout with the neighbourhood of the gene of every leaf, as arrows.
+
+    It only keeps compact records of the genes (see GeneRecord). Their
+    faces are made when a leaf is styled, which only happens when it is
+    going to be drawn. The records refer to interned styles and tooltips,
+    shared by all the faces, and the faces only refer to their tooltip,
+    whose html is made when asked for (see get_tooltip).
+    """
+
     def __init__(
         self,
         name,
-        args: dict[ProteinID, list[GetFaceArgGene]],
+        args: dict[ProteinID, list[GeneRecord]],
+        genes: dict[GeneID, GeneNeighbourhoodDAO],
+        styles: InternTable[FaceColorsAndStrokes],
+        tooltips: InternTable[TooltipKey],
         ts=None,
         ns=None,
         aligned_faces=False,
@@ -63,6 +115,9 @@ class GeneOrderTreeLayout(CustomLayout):
         self.ts = ts
         self.ns = ns
         self.args = args
+        self.genes = genes  # to make the tooltips
+        self.styles = styles
+        self.tooltips = tooltips
 
     def set_tree_style(self, tree: Tree, style: TreeStyle):
         if self.aligned_faces:
@@ -78,9 +133,42 @@ class GeneOrderTreeLayout(CustomLayout):
         if not node.is_leaf:
             return
         node_protein_id: int = self.get_protein_id_from_node_name(node.name)
-        neighbours: list[GetFaceArgGene] = self.args[node_protein_id]
+        neighbours: list[GeneRecord] = self.args[node_protein_id]
         for column_idx, node_gene in enumerate(neighbours):
-            node.add_face(node_gene.face, position="aligned", column=column_idx)
+            node.add_face(
+                self.make_face(node_gene), position="aligned", column=column_idx
+            )
+
+    def make_face(self, record: GeneRecord) -> ArrowFace:
+        """
+        Returns a new face for the gene of the given record.
+
+        Every node gets its own faces, because a face keeps the node it is
+        drawn for, and the layout can be shared by several trees (see
+        TreeViewDataCache).
+        """
+        style: FaceColorsAndStrokes = self.styles[record.style]
+        return ArrowFace(
+            width=record.width,
+            height=15,
+            orientation="right" if record.strand != "-" else "left",
+            color=style["bg_color"],
+            stroke_color=style["stroke_color"],
+            stroke_width=style["stroke_width"],
+            tooltip=f"{TOOLTIP_REF_PREFIX}{self.name}/{record.tooltip}",
+            name="ArrowFace",
+            padding_x=2,
+            padding_y=2,
+        )
+
+    def get_tooltip(self, tooltip_id: int) -> str:
+        """
+        Returns the html of the tooltip with the given id.
+        """
+        gene_id, homologous_with, orthologous_with = self.tooltips[tooltip_id]
+        return TreeViewDataService._generate_tooltip_data_html(
+            self.genes[gene_id], homologous_with, orthologous_with
+        )
 
     def get_protein_id_from_node_name(self, node_name: str) -> int:
         """
@@ -99,12 +187,13 @@ class GeneRelationData(TypedDict):
     gene: GeneNeighbourhoodDAO
 
 
-@dataclass
-class GetFaceArgGene:
-    gene_id: int
+class GeneRecord(NamedTuple):
     start: int
     end: int
-    face: ArrowFace
+    width: int  # of its arrow
+    strand: str
+    style: int  # index of its colors and strokes in the styles of the layout
+    tooltip: int  # index of its tooltip in the tooltips of the layout
 
 
 @dataclass
@@ -134,7 +223,7 @@ class TreeViewData(TypedDict):
     tree_node_tooltip_data: MappedTreeTooltipData
 
 
-TreeLayoutNSCallback = Callable[[dict[ProteinID, list[GetFaceArgGene]]], None]
+TreeLayoutNSCallback = Callable[[dict[ProteinID, list[GeneRecord]]], None]
 
 
 class HomologyColorData(TypedDict):
@@ -175,7 +264,6 @@ class TreeViewDataService:
     )
 
     @classmethod
-    @lru_cache(maxsize=None)
     def generate_data_from_tree(
         cls,
         db_connection: mariadb.Connection,
@@ -184,15 +272,57 @@ class TreeViewDataService:
         tree_seed_protein_id: int,
         tree_newick: str,
     ) -> TreeViewData:
+        """
+        Returns the data to view the tree, with a new id and name.
+
+        The layouts and tooltips are only built from the database the
+        first time, and then taken from TREE_VIEW_DATA_CACHE.
+        """
+        key = TREE_VIEW_DATA_CACHE.make_key(tree_id, phylome_id)
+        entry: TreeViewDataEntry | None = TREE_VIEW_DATA_CACHE.get(key)
+        if entry is None or entry.newick != tree_newick:
+            entry = cls.build_tree_view_data_entry(
+                db_connection, tree_id, phylome_id, tree_seed_protein_id, tree_newick
+            )
+            TREE_VIEW_DATA_CACHE.put(key, entry)
+
         uuid4_int_id: int = uuid4().int >> 64
-        tree_name: str = f"tree-{uuid4_int_id}"
+        tree_view_data: TreeViewData = {
+            "id": uuid4_int_id,
+            "name": f"tree-{uuid4_int_id}",
+            "tree": Tree(entry.newick),  # its own, since the view may modify it
+            # Copies, so every tree has its own layouts (but shares their args).
+            "layouts": [copy(layout) for layout in entry.layouts],
+            "include_props": None,
+            "exclude_props": None,
+            "tree_node_tooltip_data": entry.tree_node_tooltip_data,
+        }
+        return tree_view_data
 
+    @classmethod
+    def build_tree_view_data_entry(
+        cls,
+        db_connection: mariadb.Connection,
+        tree_id: int,
+        phylome_id: int,
+        tree_seed_protein_id: int,
+        tree_newick: str,
+    ) -> TreeViewDataEntry:
         tree = Tree(tree_newick)
         if not tree:
             raise ValueError
 
-        neighbourhoods: list[GeneNeighbourhoodDAO] = list(
-            GeneNeighbourhoodDAO.get_by_tree_id(db_connection, tree_id)
+        # Both only need the tree, so they are fetched at the same time.
+        neighbourhoods: list[GeneNeighbourhoodDAO]
+        tree_node_tooltip_data: list[TreeNodeTooltipData]
+        neighbourhoods, tree_node_tooltip_data = fetch_concurrently(
+            db_connection,
+            lambda connection: list(
+                GeneNeighbourhoodDAO.get_by_tree_id(connection, tree_id)
+            ),
+            lambda connection: list(
+                TreeNodeTooltipData.get_by_tree_id(connection, tree_id)
+            ),
         )
 
         grouped_genes_by_contig: dict[MainContigGeneID, list[GeneNeighbourhoodDAO]] = {
@@ -211,15 +341,21 @@ class TreeViewDataService:
             gene.gene_id for gene in neighbourhoods if gene.gene_id not in seed_gene_ids
         ]
 
-        homologous_genes = tuple(
-            HomologDAO.get_homologs_for_seed_genes(
-                db_connection, seed_gene_ids, target_gene_ids, phylome_id
-            )
-        )
-        orthologous_genes = tuple(
-            OrthologsDAO.get_orthologs_for_seed_genes(
-                db_connection, seed_gene_ids, target_gene_ids, phylome_id
-            )
+        # Both need the genes of the neighbourhoods, but not each other.
+        homologous_genes: tuple[HomologDAO, ...]
+        orthologous_genes: tuple[OrthologsDAO, ...]
+        homologous_genes, orthologous_genes = fetch_concurrently(
+            db_connection,
+            lambda connection: tuple(
+                HomologDAO.get_homologs_for_seed_genes(
+                    connection, seed_gene_ids, target_gene_ids, phylome_id
+                )
+            ),
+            lambda connection: tuple(
+                OrthologsDAO.get_orthologs_for_seed_genes(
+                    connection, seed_gene_ids, target_gene_ids, phylome_id
+                )
+            ),
         )
         homolog_target_to_seed_map: dict[GeneID, GeneID] = {
             gene.homolog_gene_id: gene.seed_gene_id for gene in homologous_genes
@@ -242,25 +378,17 @@ class TreeViewDataService:
                 ortholog_target_to_seed_map,
             )
         )
-        tree_node_tooltip_data: Iterator[TreeNodeTooltipData] = (
-            TreeNodeTooltipData.get_by_tree_id(db_connection, tree_id)
-        )
         mapped_tree_node_tooltip_data: dict[ProteinID, TreeNodeTooltipData] = {
             data.protein_id: data for data in tree_node_tooltip_data
         }
         gene_order_tree_layout = cls.generate_gene_order_tree_layout(
             tree, relationship_map
         )
-        tree_view_data: TreeViewData = {
-            "id": uuid4_int_id,
-            "name": tree_name,
-            "tree": tree,
-            "layouts": [gene_order_tree_layout],
-            "include_props": None,
-            "exclude_props": None,
-            "tree_node_tooltip_data": mapped_tree_node_tooltip_data,
-        }
-        return tree_view_data
+        return TreeViewDataEntry(
+            newick=tree_newick,
+            layouts=[gene_order_tree_layout],
+            tree_node_tooltip_data=mapped_tree_node_tooltip_data,
+        )
 
     @classmethod
     def _pop_seed_neighbourhood(
@@ -355,13 +483,15 @@ class TreeViewDataService:
             )
         )
 
+        # Index the genes by their protein, so each leaf only visits its own.
+        genes_by_protein_id: dict[ProteinID, list[GeneNeighbourhoodDAO]] = {}
+        for gene in target_neighbourhoods:
+            genes_by_protein_id.setdefault(gene.protein_id, []).append(gene)
+
         for target_protein_id in leaf_protein_ids:
-            for gene in target_neighbourhoods:
+            for gene in genes_by_protein_id.get(target_protein_id, ()):
                 leaf_gene_id: GeneID = gene.gene_id
-                gene_protein_id: ProteinID = gene.protein_id
                 main_contig_gene_id: MainContigGeneID = gene.main_contig_gene_id
-                if target_protein_id != gene_protein_id:
-                    continue
 
                 if leaf_gene_id in relationship_map[seed_gene.protein_id]:
                     relationship_map.setdefault(
@@ -450,7 +580,10 @@ class TreeViewDataService:
         tree: Tree,
         relationship_map: dict[ProteinID, dict[GeneID, GeneRelationData]],
     ) -> CustomLayout:
-        get_face_args: dict[ProteinID, list[GetFaceArgGene]] = {}
+        get_face_args: dict[ProteinID, list[GeneRecord]] = {}
+        genes: dict[GeneID, GeneNeighbourhoodDAO] = {}
+        styles: InternTable[FaceColorsAndStrokes] = InternTable()
+        tooltips: InternTable[TooltipKey] = InternTable()
 
         for node in tree.traverse():
             if not node.is_leaf:
@@ -468,36 +601,37 @@ class TreeViewDataService:
 
             for gene_id, gene_relation_data in gene_neighbourhood.items():
                 neighbour_gene = gene_relation_data["gene"]
-                homologs_with_gene_id = gene_relation_data["homologous_with"]
-                orthologs_with_gene_id = gene_relation_data["orthologous_with"]
                 cls._check_and_set_strand(neighbour_gene)
-                tooltip: str = cls._generate_tooltip_data_html(
-                    neighbour_gene, homologs_with_gene_id, orthologs_with_gene_id
-                )
-                orientation = "right" if neighbour_gene.strand != "-" else "left"
-                selected_color = gene_relation_data["assigned_color"]
-                selected_stroke_color = gene_relation_data["stroke_color"]
-                selected_stroke_width = gene_relation_data["stroke_width"]
-                face = ArrowFace(
-                    width=cls._scale_radius(
-                        total_gene_data_size, neighbour_gene.end - neighbour_gene.start
-                    ),
-                    height=15,
-                    orientation=orientation,
-                    color=selected_color,
-                    stroke_color=selected_stroke_color,
-                    stroke_width=selected_stroke_width,
-                    tooltip=tooltip,
-                    name="ArrowFace",
-                    padding_x=2,
-                    padding_y=2,
+                genes[gene_id] = neighbour_gene
+
+                bg_color: HexColor | None = gene_relation_data["assigned_color"]
+                stroke_color: HexColor | None = gene_relation_data["stroke_color"]
+                stroke_width: str | None = gene_relation_data["stroke_width"]
+                if bg_color is None or stroke_color is None or stroke_width is None:
+                    raise ValueError(f"The gene {gene_id} has no colors assigned.")
+                style: FaceColorsAndStrokes = {
+                    "bg_color": bg_color,
+                    "stroke_color": stroke_color,
+                    "stroke_width": stroke_width,
+                }
+                # The same gene can be in the neighbourhood of several leaves.
+                tooltip_key: TooltipKey = (
+                    gene_id,
+                    gene_relation_data["homologous_with"],
+                    gene_relation_data["orthologous_with"],
                 )
+
                 get_face_args[current_protein_id].append(
-                    GetFaceArgGene(
-                        gene_id=gene_id,
-                        face=face,
+                    GeneRecord(
                         start=neighbour_gene.start,
                         end=neighbour_gene.end,
+                        width=cls._scale_radius(
+                            total_gene_data_size,
+                            neighbour_gene.end - neighbour_gene.start,
+                        ),
+                        strand=neighbour_gene.strand,
+                        style=styles.intern(tuple(style.values()), style),
+                        tooltip=tooltips.intern(tooltip_key, tooltip_key),
                     )
                 )
 
@@ -507,6 +641,9 @@ class TreeViewDataService:
         layout = GeneOrderTreeLayout(
             name="MyTreeLayout",
             args=get_face_args,
+            genes=genes,
+            styles=styles,
+            tooltips=tooltips,
             aligned_faces=True,
         )
         return layout
@@ -8,7 +8,7 @@ export { collapse_node, remove_collapsed };
 
 // Mark node as collapsed and show it in the corresponding menu.
 function collapse_node(node_id) {
-    const id = node_id.toString();  // [1,0,1] -> "1,0,1"
+    const id = node_id.toString();  // "@57" (or [1,0,1] -> "1,0,1")
 
     view.collapsed_ids[id] = {};
 
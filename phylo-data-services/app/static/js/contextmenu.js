@@ -60,7 +60,10 @@ async function add_node_options(box, name, properties, node_id) {
         delete safe_properties["tooltip"]
 
     add_button("Go to subtree at branch", () => {
-        view.subtree += (view.subtree ? "," : "") + node_id;
+        if (String(node_id).startsWith("@"))
+            view.subtree = node_id;  // handles already point from the root
+        else
+            view.subtree += (view.subtree ? "," : "") + node_id;
         on_tree_change();
     }, "Explore the subtree starting at the current node.",
        "login", false);
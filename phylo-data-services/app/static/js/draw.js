@@ -475,7 +475,7 @@ function create_item(g, item, tl, zoom) {
 
         const b = create_box(box, tl, zx, zy, "", style);
 
-        b.id = "node-" + node_id.join("_");
+        b.id = "node-" + String(node_id).replaceAll(",", "_");
 
         b.classList.add("node");
 
@@ -10,6 +10,7 @@ import { select_by_command, prune_by_selection, remove_selections } from "./sele
 import { activate_node, deactivate_node, update_active_nodes } from "./active.js";
 import { update } from "./draw.js";
 import { on_box_contextmenu } from "./contextmenu.js";
+import { api } from "./api.js";
 
 export { init_events, notify_parent, get_event_zoom };
 
@@ -199,7 +200,7 @@ function on_mousedown(event) {
     // so the order in which to do the contains() tests matters.
 }
 
-function update_tooltip(event, delay=500) {
+async function update_tooltip(event, delay=500) {
 
     if (!event.target.getAttribute)
         return
@@ -219,8 +220,12 @@ function update_tooltip(event, delay=500) {
     const style = tooltip.style;
     const data = event.target.getAttribute("data-tooltip");
     if (data) {
-        view.tooltip.target = event.target;
-        tooltip.innerHTML = data;
+        const target = event.target;
+        view.tooltip.target = target;
+        const html = await get_tooltip_html(data);
+        if (view.tooltip.target !== target)
+            return;  // the pointer went somewhere else while asking for it
+        tooltip.innerHTML = html;
         style.display = "block";
         const bbox = event.target.getBoundingClientRect();
         style.left = bbox.x + bbox.width/2 + "px";
@@ -230,6 +235,20 @@ function update_tooltip(event, delay=500) {
         view.tooltip.timeout = setTimeout(() => style.display = "none", delay);
 }
 
+// Return the html of a tooltip, asking the server for it if the element
+// only refers to it (like the faces of the gene-order layout).
+async function get_tooltip_html(data) {
+    const prefix = "tooltip-ref:";  // as TOOLTIP_REF_PREFIX in the server
+    if (!data.startsWith(prefix))
+        return data;
+
+    const tid = get_tid().split(",")[0];
+    const url = `/trees/${tid}/tooltips/${data.slice(prefix.length)}`;
+    if (!(url in view.tooltip.htmls))
+        view.tooltip.htmls[url] = await api(url);
+    return view.tooltip.htmls[url];
+}
+
 // Mouse move -- move tree view if dragging, update position coordinates.
 function on_mousemove(event) {
     const point = {x: event.pageX, y: event.pageY};
@@ -31,7 +31,7 @@ const view = {
     tree: null,  // string with the current tree name
     tree_size: {width: 0, height: 0},
     ultrametric: false,
-    subtree: "",  // node id of the current subtree; looks like "0,1,0,0,1"
+    subtree: "",  // node id of the current subtree; looks like "@57" or "0,1,0,0,1"
     sorting: {
         sort: () => sort(),
         key: "(dy, dx, name)",
@@ -56,6 +56,7 @@ const view = {
         fixed: false,
         target: undefined,
         timeout: undefined,
+        htmls: {},  // of the tooltips asked to the server, by their url
     },
     aligned: {
         x: -10,
@@ -228,21 +229,21 @@ async function main() {
 
     view.layouts = await api(`/layouts`); // init layouts
 
-    await set_query_string_values();
+    const metadata = await set_query_string_values();
 
-    view.ultrametric = await api(`/trees/${get_tid()}/ultrametric`);
+    view.ultrametric = metadata.ultrametric;
 
-    reset_node_count();
+    reset_node_count(metadata.nodecount);
 
     init_menus(Object.keys(trees));
     // menus.open();
 
-    await reset_layouts();
+    await reset_layouts(metadata.layouts);
 
     init_events();
 
-    get_searches();
-    get_selections();
+    get_searches(metadata.searches);
+    get_selections(metadata.selected);
     get_active_nodes();
 
     setTimeout(async () => {
@@ -293,7 +294,13 @@ function get_tid() {
 // Perform an action on a tree (among the available in the API as PUT calls).
 async function tree_command(command, params=undefined) {
     try {
-        await api_put(`/trees/${get_tid()}/${command}`, params);
+        const result = await api_put(`/trees/${get_tid()}/${command}`, params);
+
+        const commands_modifying_topology = [
+            "set_outgroup", "move", "remove", "sort"];
+
+        if (commands_modifying_topology.includes(command))
+            await on_topology_change(result.subtree);
 
         const commands_modifying_size = [
             "set_outgroup", "remove", "update_props", "edit",
@@ -312,6 +319,19 @@ async function tree_command(command, params=undefined) {
 }
 
 
+// What happens when the topology of the tree changes. The node handles
+// (like "@57") are positions of the nodes in the tree, so the ones we have
+// point to other nodes now.
+async function on_topology_change(subtree) {
+    if (subtree !== view.subtree) {
+        view.subtree = subtree;  // the new node id of the same subtree
+        menus.subtree.refresh();
+    }
+    remove_collapsed();
+    await get_active_nodes();  // with their new handles
+}
+
+
 // What happens when the user selects a new tree in the menu.
 async function on_tree_change() {
     if (!menus.pane)
@@ -321,19 +341,20 @@ async function on_tree_change() {
     remove_searches();
     remove_selections();
     remove_collapsed();
-    view.tree_size = await api(`/trees/${get_tid()}/size`);
-    view.min_size = await api(`/trees/${get_tid()}/collapse_size`);
+    const metadata = await get_tree_metadata();
+    view.tree_size = metadata.size;
+    view.min_size = metadata.collapse_size;
 
     // Get searches and selections if any are stored in backend
     if (Object.keys(view.searches).length === 0)
-        get_searches();
+        get_searches(metadata.searches);
     if (Object.keys(view.selected).length === 0)
-        get_selections();
+        get_selections(metadata.selected);
     if (Object.keys(view.active.nodes.nodes).length === 0)
         get_active_nodes();
 
-    reset_node_count();
-    await reset_layouts();
+    reset_node_count(metadata.nodecount);
+    await reset_layouts(metadata.layouts);
     reset_zoom();
     reset_position();
     draw_minimap();
@@ -434,9 +455,11 @@ async function set_query_string_values() {
         });
     }
 
-    await set_consistent_values();
+    return await set_consistent_values();
 }
 
+// Set values that depend on the tree (and drawer) to view, and return
+// the metadata of the tree, as given by get_tree_metadata().
 async function set_consistent_values() {
     if (view.tree === null)
         view.tree = Object.keys(trees)[0];  // select default tree
@@ -447,14 +470,12 @@ async function set_consistent_values() {
         view.tree = name;
     }
 
-    view.tree_size = await api(`/trees/${get_tid()}/size`);
-    view.min_size = await api(`/trees/${get_tid()}/collapse_size`);
+    const metadata = await get_tree_metadata();
+    view.tree_size = metadata.size;
+    view.min_size = metadata.collapse_size;
 
-    let drawer_info;
-    try {
-        drawer_info = await api(`/drawers/${view.drawer.name}/${get_tid()}`);
-    }
-    catch (ex) {
+    let drawer_info = metadata.drawer;
+    if (drawer_info === null) {
         Swal.fire({
             html: `Cannot find drawer ${escape_html(view.drawer.name)}<br><br>
                    Opening a default drawer.`,
@@ -483,6 +504,17 @@ async function set_consistent_values() {
 
     reset_zoom(view.zoom.x === null, view.zoom.y === null, view.zoom.a === null);
     reset_position(view.tl.x === null, view.tl.y === null);
+
+    return metadata;
+}
+
+
+// Return name, size, node count, layouts, searches, etc. of the current
+// tree, and info on the current drawer (null if it is not valid for it),
+// all in one request.
+async function get_tree_metadata() {
+    const qs = `drawer=${encodeURIComponent(view.drawer.name)}`;
+    return await api(`/trees/${get_tid()}/metadata?${qs}`);
 }
 
 
@@ -497,11 +529,10 @@ function show_minimap(show) {
 }
 
 
-function reset_node_count() {
-    api(`/trees/${get_tid()}/nodecount`).then(n => {
-        view.tnodes = n.tnodes;
-        view.tleaves = n.tleaves;
-    });
+async function reset_node_count(nodecount=null) {
+    const n = nodecount || await api(`/trees/${get_tid()}/nodecount`);
+    view.tnodes = n.tnodes;
+    view.tleaves = n.tleaves;
 }
 
 
@@ -515,8 +546,8 @@ function get_active_layouts() {
     }, []);
 }
 
-async function reset_layouts() {
-    view.layouts = await api(`/layouts/${get_tid()}`);
+async function reset_layouts(layouts=null) {
+    view.layouts = layouts || await api(`/layouts/${get_tid()}`);
     update_folder_layouts()
 }
 
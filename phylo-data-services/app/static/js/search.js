@@ -196,9 +196,11 @@ function colorize_searches() {
 }
 
 // Get searches from api and fill view.searches
-async function get_searches() {
-    const searches = await api(`/trees/${get_tid()}/searches`);
-    Object.entries(searches.searches).forEach(([text, res]) => store_search(text, res));
+// Store the searches saved in the backend (or the given ones, if we have them).
+async function get_searches(searches=null) {
+    if (searches === null)
+        searches = (await api(`/trees/${get_tid()}/searches`)).searches;
+    Object.entries(searches).forEach(([text, res]) => store_search(text, res));
 }
 
 // Empty view.searches.
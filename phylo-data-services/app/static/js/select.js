@@ -227,9 +227,11 @@ function colorize_selections() {
 
 
 // Get selections from api and fill view.selections
-async function get_selections() {
-    const selected = await api(`/trees/${get_tid()}/all_selections`);
-    Object.entries(selected.selected)
+// Store the selections saved in the backend (or the given ones, if we have them).
+async function get_selections(selected=null) {
+    if (selected === null)
+        selected = (await api(`/trees/${get_tid()}/all_selections`)).selected;
+    Object.entries(selected)
         .forEach(([name, res]) => store_selection(name, res));
 }
 
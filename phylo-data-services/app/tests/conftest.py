@@ -20,3 +20,28 @@ def set_up_env(monkeypatch):
     monkeypatch.setenv("EMAIL_USER_ADMIN","")
     monkeypatch.setenv("FULLNAME_USER_ADMIN","")
     yield
+
+
+@pytest.fixture
+def global_tree_cache():
+    # The controllers import GLOBAL_TREE_CACHE, so it is reset instead of replaced.
+    from utils.tree_store import MemoryTreeStore
+    from utils.tree_viewer import GLOBAL_TREE_CACHE
+
+    store = GLOBAL_TREE_CACHE.store
+    GLOBAL_TREE_CACHE.store = MemoryTreeStore()
+    GLOBAL_TREE_CACHE.trees.clear()
+    yield GLOBAL_TREE_CACHE
+    GLOBAL_TREE_CACHE.trees.clear()
+    GLOBAL_TREE_CACHE.store = store
+
+
+@pytest.fixture
+def tree_view_data_cache(monkeypatch):
+    # The service looks it up in its module, so a fresh one can replace it.
+    from services import tree_view_data_service
+    from utils.tree_view_data_cache import TreeViewDataCache
+
+    cache = TreeViewDataCache()
+    monkeypatch.setattr(tree_view_data_service, "TREE_VIEW_DATA_CACHE", cache)
+    return cache
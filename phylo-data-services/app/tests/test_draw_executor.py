@@ -0,0 +1,141 @@
+import asyncio
+from threading import Event
+
+import pytest
+from fastapi import HTTPException
+from utils.draw_executor import DrawExecutor
+
+
+def wait_and_return(release, value):
+    release.wait(5)
+    return value
+
+
+async def start_draws(executor, key, release, *values):
+    """Return the tasks of draws of the values, which wait for release."""
+    tasks = [
+        asyncio.ensure_future(executor.run(key, wait_and_return, release, value))
+        for value in values
+    ]
+    await asyncio.sleep(0)  # so they are submitted
+    return tasks
+
+
+def test_identical_draws_are_drawn_once():
+    async def draw():
+        executor = DrawExecutor(max_workers=2, max_pending=8)
+        release = Event()
+        tasks = await start_draws(executor, "key", release, "first", "second")
+        release.set()
+        return await asyncio.gather(*tasks), executor
+
+    results, executor = asyncio.run(draw())
+
+    assert results == ["first", "first"]  # the second shared the first one
+    assert executor.stats.submitted == 1
+    assert executor.stats.coalesced == 1
+    assert executor.pending == 0
+    assert executor.in_flight == {}
+
+
+def test_draws_without_key_are_not_coalesced():
+    async def draw():
+        executor = DrawExecutor(max_workers=2, max_pending=8)
+        release = Event()
+        tasks = await start_draws(executor, None, release, "first", "second")
+        release.set()
+        return await asyncio.gather(*tasks), executor
+
+    results, executor = asyncio.run(draw())
+
+    assert results == ["first", "second"]
+    assert executor.stats.submitted == 2
+    assert executor.stats.coalesced == 0
+
+
+def test_draws_over_the_pending_limit_are_rejected():
+    async def draw():
+        executor = DrawExecutor(max_workers=1, max_pending=2)
+        release = Event()
+        tasks = await start_draws(executor, "key", release, "first")
+        tasks += await start_draws(executor, None, release, "second")
+
+        with pytest.raises(HTTPException) as error:
+            await executor.run(None, lambda: "third")
+
+        # An identical draw can still share a pending one.
+        coalesced = asyncio.ensure_future(executor.run("key", lambda: "fourth"))
+        await asyncio.sleep(0)  # so it joins the first one before it ends
+        release.set()
+        return error.value, await asyncio.gather(*tasks, coalesced), executor
+
+    error, results, executor = asyncio.run(draw())
+
+    assert error.status_code == 503
+    assert error.headers == {"Retry-After": "1"}
+    assert results == ["first", "second", "first"]
+    assert executor.stats.rejected == 1
+    assert executor.pending == 0
+
+
+def test_failed_draws_raise_and_free_their_place():
+    def fail():
+        raise ValueError("cannot draw")
+
+    async def draw():
+        executor = DrawExecutor(max_workers=1, max_pending=1)
+        with pytest.raises(ValueError, match="cannot draw"):
+            await executor.run("key", fail)
+        return await executor.run("key", lambda: "drawn"), executor
+
+    result, executor = asyncio.run(draw())
+
+    assert result == "drawn"
+    assert executor.pending == 0
+
+
+def test_cancelling_a_coalesced_draw_does_not_cancel_the_others():
+    async def draw():
+        executor = DrawExecutor(max_workers=1, max_pending=8)
+        busy, release = Event(), Event()
+        busy_task = asyncio.ensure_future(
+            executor.run(None, wait_and_return, busy, "busy")
+        )
+        tasks = await start_draws(executor, "key", release, "first", "second")
+
+        tasks[0].cancel()  # while the draw is still queued
+        await asyncio.sleep(0)
+        busy.set()
+        release.set()
+        await busy_task
+        return await tasks[1], executor
+
+    result, executor = asyncio.run(draw())
+
+    assert result == "first"
+    assert executor.pending == 0
+    assert executor.waiters == {}
+
+
+def test_a_queued_draw_is_cancelled_when_nobody_waits_for_it():
+    async def draw():
+        executor = DrawExecutor(max_workers=1, max_pending=8)
+        busy, release = Event(), Event()
+        busy_task = asyncio.ensure_future(
+            executor.run(None, wait_and_return, busy, "busy")
+        )
+        tasks = await start_draws(executor, "key", release, "first", "second")
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        pending = executor.pending  # before the busy draw ends
+        busy.set()
+        await busy_task
+        return pending, executor
+
+    pending, executor = asyncio.run(draw())
+
+    assert pending == 1  # only the busy draw
+    assert executor.in_flight == {}
+    assert executor.waiters == {}
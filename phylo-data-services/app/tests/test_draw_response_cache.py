@@ -0,0 +1,72 @@
+from utils.draw_response_cache import DrawResponse
+from utils.draw_response_cache import DrawResponseCache
+
+
+def make_key(tid=1, version=1, subtree="[]", **args):
+    return DrawResponseCache.make_key(
+        tid, version, {"zx": "10", **args, "subtree": subtree}, compress=False
+    )
+
+
+def test_equivalent_draw_args_give_the_same_key():
+    assert make_key(zx="10", layouts='["b", "a"]') == make_key(
+        zx="10.0", layouts='["a", "b"]'
+    )
+
+
+def test_responses_of_other_versions_are_not_returned():
+    cache = DrawResponseCache()
+    cache.put(make_key(version=1), DrawResponse(b"version 1"))
+
+    assert cache.get(make_key(version=1)) == DrawResponse(b"version 1")
+    assert cache.get(make_key(version=2)) is None
+
+
+def test_responses_of_other_subtrees_are_not_returned():
+    cache = DrawResponseCache()
+    cache.put(make_key(subtree="[]"), DrawResponse(b"tree"))
+    cache.put(make_key(subtree="[0]"), DrawResponse(b"subtree"))
+
+    assert cache.get(make_key(subtree="[0]")) == DrawResponse(b"subtree")
+    assert cache.get(make_key(subtree="[1]")) is None
+
+
+def test_invalidate_removes_only_the_responses_of_the_tree():
+    cache = DrawResponseCache()
+    cache.put(make_key(tid=1, version=1), DrawResponse(b"1"))
+    cache.put(make_key(tid=1, version=2), DrawResponse(b"22"))
+    cache.put(make_key(tid=2), DrawResponse(b"333"))
+
+    cache.invalidate(1)
+
+    assert cache.get(make_key(tid=1, version=1)) is None
+    assert cache.get(make_key(tid=1, version=2)) is None
+    assert cache.get(make_key(tid=2)) == DrawResponse(b"333")
+    assert cache.resident_bytes == 3
+
+
+def test_least_recently_used_responses_are_evicted():
+    cache = DrawResponseCache(max_entries=2, max_bytes=5)
+    cache.put(make_key(version=1), DrawResponse(b"11"))
+    cache.put(make_key(version=2), DrawResponse(b"22"))
+    cache.get(make_key(version=1))
+
+    cache.put(make_key(version=3), DrawResponse(b"33"))  # over max_entries
+
+    assert cache.get(make_key(version=2)) is None
+    assert cache.get(make_key(version=1)) is not None
+
+    cache.put(make_key(version=4), DrawResponse(b"4444"))  # over max_bytes
+
+    assert list(cache.entries.values()) == [DrawResponse(b"4444")]
+    assert cache.stats.evictions == 3
+
+
+def test_responses_over_the_byte_limit_are_not_cached():
+    cache = DrawResponseCache(max_bytes=5)
+    cache.put(make_key(version=1), DrawResponse(b"1"))
+
+    cache.put(make_key(version=2), DrawResponse(b"too big"))
+
+    assert cache.get(make_key(version=2)) is None
+    assert cache.get(make_key(version=1)) is not None
@@ -0,0 +1,120 @@
+import pytest
+from ete4 import Tree
+from utils.eval_search import EVAL_FUNCTIONS
+from utils.eval_search import EVAL_NODE_VALUES
+from utils.eval_search import EvalSearch
+
+NEWICK = "((a:1,b:2)0.9:0.5,(c:0.5,(d:0,e:4)0.5:1)0.8:2):0;"
+
+# Expressions that are evaluated with the columns.
+COLUMNAR_EXPRESSIONS = [
+    "dist > 1",
+    "d >= 1 and is_leaf",
+    "not is_leaf or dist < 1",
+    "1 < dist <= 4",
+    "-dist + 3 == 1",
+    "abs(get(p, 'x', 0)) > 1",
+    "get(p, 'x', 1.5) != 1.5 or dx > 0",
+    "dist is None",
+    "support is not None and dist * 2 - 1 > support",  # no support in leaves
+    "not is_leaf and p['x'] > 0",  # missing props, not evaluated by "and"
+    "is_leaf or p['x'] <= 0",  # missing props, not evaluated by "or"
+    "size[0] >= dy * pi",
+    "True",
+    "0",
+]
+
+# Expressions with missing values, which are evaluated with the columns
+# until they find that python would fail (or not), and then node by node.
+MISSING_VALUES_EXPRESSIONS = [
+    "p['x'] > 0",
+    "dist > 0",
+    "d + 1 > 0",
+    "dist > 0 or is_leaf",
+    "is_leaf and p['x'] > 0",
+    "get(props, 'x') == 0",
+]
+
+# Expressions that are evaluated node by node.
+FALLBACK_EXPRESSIONS = [
+    "name in ['a', 'd']",
+    "'x' in p",
+    "'x' in props and p['x'] > 0",
+    "len(children) == 2",
+    "startswith(name or '', 'a')",
+    "(dist or 0) > 1",
+    "name == 'a'",
+    "dist // 2 > 0",
+]
+
+
+def plain_eval(expression, node):
+    context = dict(EVAL_FUNCTIONS)
+    for name, get_value in EVAL_NODE_VALUES.items():
+        context[name] = get_value(node)
+    return eval(expression, {"__builtins__": {}}, context)
+
+
+def outcome(function):
+    """Return what calling function() gives, or the type of its error."""
+    try:
+        return function()
+    except Exception as e:
+        return type(e)
+
+
+@pytest.fixture
+def nodes():
+    tree = Tree(NEWICK)
+    tree.add_props(x=1)  # numeric props (not just text) in the internal nodes
+    tree.children[0].add_props(x=1.5, y=3)
+    tree.children[1].add_props(x=0)
+    tree.children[1].children[1].add_props(x=-2)
+    return list(tree.traverse())
+
+
+@pytest.fixture
+def nodes_with_missing_values(nodes):
+    nodes[0].del_prop("x")
+    nodes[0].dist = None  # like it is in the root of most trees
+    return nodes
+
+
+@pytest.mark.parametrize("expression", COLUMNAR_EXPRESSIONS)
+def test_columnar_search_gives_the_results_of_eval(nodes, expression, monkeypatch):
+    search = EvalSearch(expression)
+    expected = [node for node in nodes if plain_eval(expression, node)]
+
+    def fail(node):
+        raise AssertionError("evaluated node by node")
+
+    monkeypatch.setattr(EvalSearch, "__call__", fail)
+
+    assert search.columnar is not None
+    assert search.search(nodes) == expected
+
+
+@pytest.mark.parametrize("expression", MISSING_VALUES_EXPRESSIONS)
+def test_search_with_missing_values_gives_the_outcome_of_eval(
+    nodes_with_missing_values, expression
+):
+    nodes = nodes_with_missing_values
+    search = EvalSearch(expression)
+
+    assert search.columnar is not None
+    assert outcome(lambda: search.search(nodes)) == outcome(
+        lambda: [node for node in nodes if plain_eval(expression, node)]
+    )
+
+
+@pytest.mark.parametrize("expression", FALLBACK_EXPRESSIONS)
+def test_fallback_search_gives_the_results_of_eval(nodes, expression):
+    search = EvalSearch(expression)
+
+    assert outcome(lambda: search.search(nodes)) == outcome(
+        lambda: [node for node in nodes if plain_eval(expression, node)]
+    )
+
+
+def test_search_of_no_nodes_finds_nothing():
+    assert EvalSearch("dist > 1").search([]) == []
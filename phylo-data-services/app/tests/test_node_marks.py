@@ -0,0 +1,124 @@
+from copy import deepcopy
+
+import pytest
+from ete4 import Tree
+from ete4.smartview.renderer.drawer import NodeMarks
+from utils import tree_viewer
+from utils.tree_viewer import get_parents
+
+
+def expected_index(marks):
+    """Return the results_of and parents_of that marks should have."""
+    results_of, parents_of = {}, {}
+    for text, (results, parents) in marks.items():
+        for node in results:
+            results_of.setdefault(node, {})[text] = None
+        for node in parents:
+            parents_of.setdefault(node, {})[text] = None
+    return results_of, parents_of
+
+
+def assert_indexed(marks):
+    results_of, parents_of = expected_index(marks)
+    assert marks.results_of == results_of
+    assert marks.parents_of == parents_of
+
+
+@pytest.fixture
+def tree():
+    return Tree("((a,b),(c,(d,e)));")
+
+
+def test_stored_and_removed_marks_are_indexed(tree):
+    a, b, c = tree["a"], tree["b"], tree["c"]
+    marks = NodeMarks()
+
+    marks["x"] = ({a, b}, get_parents([a, b]))
+    marks["y"] = ({a}, get_parents([a]))
+    assert list(marks.results_of[a]) == ["x", "y"]
+    assert_indexed(marks)
+
+    marks["x"] = ({c}, get_parents([c]))  # replaces the old results
+    assert b not in marks.results_of
+    assert_indexed(marks)
+
+    marks.pop("y")
+    assert a not in marks.results_of
+    assert_indexed(marks)
+
+    del marks["x"]
+    assert marks.results_of == marks.parents_of == {}
+
+
+def test_added_and_discarded_results_are_indexed(tree):
+    a, b, c = tree["a"], tree["b"], tree["c"]
+    marks = NodeMarks()
+
+    marks.add("x", [a], get_parents([a]))
+    marks.add("x", [b, a], get_parents([b]))
+    assert marks["x"][1][tree.children[0]] == 2  # the parent of a and b
+    assert_indexed(marks)
+
+    marks.add("y", [c], get_parents([c]))
+    marks.discard("x", [a], get_parents([a]))
+    assert a not in marks.results_of
+    assert tree.children[0] in marks.parents_of  # still the parent of b
+    assert_indexed(marks)
+
+    marks.discard("x", [b], get_parents([b]))  # the last one
+    assert "x" not in marks
+    assert list(marks.results_of) == [c]
+    assert_indexed(marks)
+
+
+def test_copies_of_marks_are_indexed(tree):
+    a, c = tree["a"], tree["c"]
+    marks = NodeMarks(x=({a}, get_parents([a])))
+    marks.update(y=({c}, get_parents([c])))
+
+    copy = deepcopy((tree, marks))[1]
+
+    assert type(copy) is NodeMarks
+    assert [node.name for node in copy.results_of] == ["a", "c"]
+    assert_indexed(copy)
+
+    marks.clear()
+    assert marks.results_of == marks.parents_of == {}
+
+
+def test_selections_of_a_tree_are_indexed(global_tree_cache):
+    tree_viewer.add_tree(
+        {
+            "id": 1,
+            "name": "tree",
+            "newick": "((a,b),(c,(d,e)));",
+            "tree_node_tooltip_data": {},
+        }
+    )
+    tree_data = tree_viewer.get_tree_data(1)
+    selected = tree_data.selected
+
+    tree_viewer.store_selection("1,0,0", {"text": "x"})  # a
+    tree_viewer.store_selection("1,0,1", {"text": "x"})  # b
+    tree_viewer.store_selection("1,0,1", {"text": "y"})
+    assert tree_viewer.get_selections("1,0,1") == ["x", "y"]
+    assert_indexed(selected)
+
+    tree_viewer.unselect_node("1,0,1", {"text": ""})  # from all selections
+    assert tree_viewer.get_selections("1,0,1") == []
+    assert tree_viewer.get_selections("1,0,0") == ["x"]
+    assert_indexed(selected)
+
+    tree_viewer.change_selection_name(1, {"name": "x", "newname": "z"})
+    assert tree_viewer.get_selections("1,0,0") == ["z"]
+    assert_indexed(selected)
+
+    tree_viewer.store_search("1", {"text": "c"})
+    tree_viewer.search_to_selection(1, {"text": "c"})
+    assert tree_viewer.get_selections("1,1,0") == ["c"]
+    assert tree_data.searches.results_of == {}
+    assert_indexed(selected)
+
+    tree_viewer.remove_selection(1, {"text": "z"})
+    assert tree_viewer.get_selections("1,0,0") == []
+    assert_indexed(selected)
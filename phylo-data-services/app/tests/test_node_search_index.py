@@ -0,0 +1,110 @@
+import re
+
+import pytest
+from ete4 import Tree
+from utils import tree_viewer
+from utils.node_search_index import get_literal_prefix
+from utils.node_search_index import NodeSearchIndex
+from utils.tree_viewer import TreeData
+
+NEWICK = (
+    "((Phy0001_9606,Phy0002_9606)Inner,"
+    "((phy0003_10090,PHY0010_9606),(Phy0100_10090,Phy0101_7227,)),"
+    "(AnotherPhy,Phy00));"
+)
+
+TEXTS = ["", "Phy", "phy", "PHY", "Phy00", "9606", "_", "Phy0001_9606", "nothing"]
+
+PATTERNS = [
+    "^Phy00",
+    "^Phy00.*_9606",
+    "^Phy0?1",
+    "^phy",
+    "Phy",
+    "_9606$",
+    "^(Phy|PHY)",
+    "^Phy0001|^Another",
+    "^Phy0{2}1",
+    "^$",
+]
+
+
+@pytest.fixture
+def tree():
+    return Tree(NEWICK, parser=1)
+
+
+def names(nodes):
+    return [node.name or "" for node in nodes]
+
+
+@pytest.mark.parametrize("text", TEXTS)
+@pytest.mark.parametrize("ignore_case", [False, True])
+def test_search_text_finds_what_a_traversal_finds(tree, text, ignore_case):
+    index = NodeSearchIndex(tree)
+
+    def matches(node):
+        name = node.name or ""
+        return text in (name.lower() if ignore_case else name)
+
+    found = index.get_nodes(index.search_text(text, ignore_case), tree)
+
+    assert found == [node for node in tree.traverse("preorder") if matches(node)]
+
+
+@pytest.mark.parametrize("pattern", PATTERNS)
+def test_search_regex_finds_what_a_traversal_finds(tree, pattern):
+    index = NodeSearchIndex(tree)
+    regex = re.compile(pattern)
+
+    found = index.get_nodes(index.search_regex(pattern), tree)
+
+    assert sorted(names(found)) == sorted(
+        names(node for node in tree.traverse() if regex.search(node.name or ""))
+    )
+
+
+def test_subtree_nodes_are_the_ones_of_a_traversal(tree):
+    index = NodeSearchIndex(tree)
+
+    for node in tree.traverse():
+        assert index.get_subtree_nodes(node) == list(node.traverse("preorder"))
+        assert index.get_nodes(range(len(index.nodes)), node) == list(
+            node.traverse("preorder")
+        )
+
+
+@pytest.mark.parametrize(
+    "pattern, prefix",
+    [
+        ("^Phy00", "Phy00"),
+        ("^Phy00.*_9606", "Phy00"),
+        ("^Phy0?1", "Phy"),
+        ("^Phy0{2}", "Phy"),
+        ("^Phy|^Other", ""),
+        ("Phy", ""),
+    ],
+)
+def test_literal_prefix(pattern, prefix):
+    assert get_literal_prefix(pattern) == prefix
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "Phy00",
+        "phy",
+        "/r ^Phy00.*_9606",
+        "/r 9606$",
+        "/t (\"startswith(name, 'Phy')\", \"is_leaf\")",
+        "/t (\"not is_leaf\", \"\")",
+    ],
+)
+def test_search_nodes_in_subtrees_finds_what_a_traversal_finds(tree, text):
+    tree_data = TreeData(tree=tree)
+    func = tree_viewer.get_search_function(text)
+
+    for node in tree.traverse():
+        assert tree_viewer.search_nodes(tree_data, node, text, func) == [
+            n for n in node.traverse("preorder") if func(n)
+        ]
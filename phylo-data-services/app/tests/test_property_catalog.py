@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+from ete4 import Tree
+from utils.node_search_index import NodeSearchIndex
+from utils.property_catalog import PropertyCatalog
+
+NEWICK = "((a:1,b:2)0.9:0.5,(c:0.5,(d:0,e:4)0.5:1)0.8:2);"
+
+
+@pytest.fixture
+def tree():
+    tree = Tree(NEWICK)
+    tree["a"].add_props(score=3, label="x")
+    tree["b"].add_props(score=1.5)
+    tree["d"].add_props(score="7")
+    tree["e"].add_props(score=-2, _hidden=1)
+    tree.children[1].add_props(score="not a number")  # only in a leaf it fails
+    return tree
+
+
+def get_range(index, node):
+    start = index.positions[id(node)]
+    return start, index.ends[start]
+
+
+def leaf_values(node, pname):
+    """Return the values of the property in the leaves, like a traversal."""
+    return [float(leaf.props[pname]) for leaf in node if pname in leaf.props]
+
+
+def test_names_are_the_ones_of_all_the_nodes(tree):
+    index = NodeSearchIndex(tree)
+    catalog = PropertyCatalog(index.nodes)
+
+    for node in tree.traverse():
+        assert set(catalog.get_names(*get_range(index, node))) == {
+            pname for n in node.traverse() for pname in n.props
+        }
+
+
+@pytest.mark.parametrize("pname", ["dist", "score", "support"])
+def test_stats_are_the_ones_of_the_leaves(tree, pname):
+    index = NodeSearchIndex(tree)
+    catalog = PropertyCatalog(index.nodes)
+
+    for node in tree.traverse():
+        values = leaf_values(node, pname)
+        if not values:
+            with pytest.raises(ValueError, match="no node has the given property"):
+                catalog.get_stats(pname, *get_range(index, node))
+            continue
+
+        stats = catalog.get_stats(pname, *get_range(index, node))
+
+        assert stats["n"] == len(values)
+        assert stats["min"] == min(values)
+        assert stats["max"] == max(values)
+        assert stats["mean"] == pytest.approx(np.mean(values))
+        assert stats["var"] == pytest.approx(np.var(values))
+
+
+def test_percentiles_and_histograms_are_the_ones_of_the_leaves(tree):
+    index = NodeSearchIndex(tree)
+    catalog = PropertyCatalog(index.nodes)
+    values = leaf_values(tree, "score")
+    counts, edges = np.histogram(values, bins=3)
+
+    assert catalog.get_percentiles("score", 0, len(index.nodes), (0, 50, 100)) == {
+        "0": min(values),
+        "50": float(np.percentile(values, 50)),
+        "100": max(values),
+    }
+    assert catalog.get_histogram("score", 0, len(index.nodes), 3) == {
+        "counts": counts.tolist(),
+        "edges": edges.tolist(),
+    }
+
+
+def test_values_that_are_not_numbers_fail_only_in_leaves(tree):
+    tree["c"].add_props(score="bad")
+    index = NodeSearchIndex(tree)
+    catalog = PropertyCatalog(index.nodes)
+
+    with pytest.raises(ValueError, match="could not convert"):
+        catalog.get_stats("score", *get_range(index, tree))
+
+    subtree = tree.children[1].children[1]  # with the leaves d and e
+    assert catalog.get_stats("score", *get_range(index, subtree))["n"] == 2
+
+
+def test_only_the_most_recent_results_are_cached(tree, monkeypatch):
+    monkeypatch.setattr(PropertyCatalog, "max_results", 2)
+    index = NodeSearchIndex(tree)
+    catalog = PropertyCatalog(index.nodes)
+    end = len(index.nodes)
+
+    stats = catalog.get_stats("score", 0, end)
+    catalog.get_stats("dist", 0, end)
+    assert catalog.get_stats("score", 0, end) is stats  # cached
+    catalog.get_histogram("score", 0, end, 2)  # evicts the stats of dist
+
+    assert list(catalog.results) == [
+        ("stats", "score", 0, end),
+        ("histogram", "score", 0, end, 2),
+    ]
@@ -0,0 +1,141 @@
+from threading import Barrier
+from threading import Event
+from threading import Thread
+from time import sleep
+
+import pytest
+from utils.read_write_lock import ReadWriteLock
+
+
+def start(target):
+    thread = Thread(target=target, daemon=True)
+    thread.start()
+    return thread
+
+
+def wait_for_writer(lock):
+    for _ in range(200):
+        if lock.waiting_writers > 0:
+            return
+        sleep(0.005)
+    raise AssertionError("the writer never waited")
+
+
+def test_many_readers_hold_the_lock_at_once():
+    lock = ReadWriteLock()
+    all_reading = Barrier(3, timeout=5)
+
+    def read():
+        with lock.read():
+            all_reading.wait()  # fails unless the 3 are reading at once
+
+    threads = [start(read) for _ in range(3)]
+    for thread in threads:
+        thread.join(5)
+
+    assert not all_reading.broken
+    assert not lock.in_use()
+
+
+def test_writer_waits_for_the_readers():
+    lock = ReadWriteLock()
+    events = []
+
+    def write():
+        with lock.write():
+            events.append("write")
+
+    with lock.read():
+        writer = start(write)
+        wait_for_writer(lock)
+        events.append("read")
+    writer.join(5)
+
+    assert events == ["read", "write"]
+
+
+def test_readers_wait_for_the_writer():
+    lock = ReadWriteLock()
+    events = []
+
+    def read():
+        with lock.read():
+            events.append("read")
+
+    with lock.write():
+        reader = start(read)
+        sleep(0.05)
+        events.append("write")
+    reader.join(5)
+
+    assert events == ["write", "read"]
+
+
+def test_new_readers_wait_for_a_waiting_writer():
+    lock = ReadWriteLock()
+    events = []
+    reading = Event()
+
+    def write():
+        with lock.write():
+            events.append("write")
+
+    def read():
+        reading.set()
+        with lock.read():
+            events.append("new read")
+
+    with lock.read():
+        writer = start(write)
+        wait_for_writer(lock)
+        reader = start(read)
+        reading.wait(5)
+        sleep(0.05)
+        events.append("first read")
+    writer.join(5)
+    reader.join(5)
+
+    assert events == ["first read", "write", "new read"]
+
+
+def test_writer_can_take_the_lock_again():
+    lock = ReadWriteLock()
+
+    with lock.write():
+        with lock.write():
+            with lock.read():
+                assert lock.writer_depth == 2
+        assert lock.in_use()
+
+    assert not lock.in_use()
+
+
+def test_reader_can_take_the_lock_again_with_a_writer_waiting():
+    lock = ReadWriteLock()
+    writer_done = Event()
+
+    def write():
+        with lock.write():
+            writer_done.set()
+
+    with lock.read():
+        writer = start(write)
+        wait_for_writer(lock)
+        with lock.read():  # would deadlock if it waited for the writer
+            assert not writer_done.is_set()
+    writer.join(5)
+
+    assert writer_done.is_set()
+    assert not lock.in_use()
+
+
+def test_reader_cannot_upgrade_to_writer():
+    lock = ReadWriteLock()
+
+    with lock.read():
+        with pytest.raises(RuntimeError):
+            with lock.write():
+                pass
+
+    with lock.write():  # still usable
+        pass
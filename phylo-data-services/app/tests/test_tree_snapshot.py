@@ -0,0 +1,99 @@
+import struct
+import zlib
+from datetime import datetime
+
+import pytest
+from ete4 import Tree
+from utils import tree_snapshot
+from utils.tree_snapshot import SnapshotError
+
+
+def make_tree():
+    tree = Tree("((a:1[&&NHX:color=red],b:2)0.9:0.5,(c,d:4):3);")
+    tree["a"].props["count"] = 3
+    tree["a"].props["scores"] = [1.5, None, "x"]
+    return tree
+
+
+def get_nodes(tree):
+    return [(node.props, len(node.children)) for node in tree.traverse("preorder")]
+
+
+def test_snapshot_round_trip():
+    tree = make_tree()
+    metadata = {"name": "tree", "timestamp": datetime(2024, 1, 1), "layouts": []}
+
+    loaded, loaded_metadata = tree_snapshot.loads(tree_snapshot.dumps(tree, metadata))
+
+    assert get_nodes(loaded) == get_nodes(tree)
+    assert loaded_metadata == metadata
+
+
+@pytest.mark.parametrize(
+    "value",
+    [(1, 2), {1: "a"}, {"key": (1, 2)}, [{"nested": (3,)}], {1, 2}],
+)
+def test_snapshot_keeps_props_that_json_would_change(value):
+    tree = make_tree()
+    tree["b"].props["value"] = value
+
+    loaded, _ = tree_snapshot.loads(tree_snapshot.dumps(tree, {}))
+
+    assert loaded["b"].props["value"] == value
+    assert type(loaded["b"].props["value"]) is type(value)
+    assert get_nodes(loaded) == get_nodes(tree)
+
+
+def test_snapshot_saves_the_given_dists():
+    tree = make_tree()
+
+    loaded, _ = tree_snapshot.loads(
+        tree_snapshot.dumps(tree, {}, saved_dists={tree["a"]: 10})
+    )
+
+    assert loaded["a"].dist == 10
+    assert loaded["b"].dist == 2
+
+
+def test_snapshot_summary():
+    snapshot = tree_snapshot.dumps(make_tree(), {"name": "tree", "layouts": []})
+
+    assert tree_snapshot.read_summary(snapshot) == {"name": "tree"}
+
+
+def test_snapshot_with_other_version_is_rejected():
+    snapshot = bytearray(tree_snapshot.dumps(make_tree(), {}))
+    struct.pack_into("<H", snapshot, 8, tree_snapshot.SNAPSHOT_VERSION + 1)
+
+    with pytest.raises(SnapshotError, match="version"):
+        tree_snapshot.loads(snapshot)
+
+
+def test_snapshot_with_bad_magic_is_rejected():
+    snapshot = b"NOTSNAP\0" + tree_snapshot.dumps(make_tree(), {})[8:]
+
+    with pytest.raises(SnapshotError, match="Not a tree snapshot"):
+        tree_snapshot.loads(snapshot)
+
+
+def test_corrupted_snapshot_is_rejected():
+    snapshot = bytearray(tree_snapshot.dumps(make_tree(), {}))
+    snapshot[-20] ^= 0xFF
+
+    with pytest.raises(SnapshotError, match="checksum"):
+        tree_snapshot.loads(snapshot)
+
+
+def test_snapshot_checksum_covers_all_sections():
+    snapshot = tree_snapshot.dumps(make_tree(), {})
+    _, _, nsections, crc = struct.unpack_from("<8sHHI", snapshot)
+
+    assert zlib.crc32(snapshot[16 + 8 * nsections :]) == crc
+
+
+@pytest.mark.parametrize("size", [0, 5, 16, 20, -1])
+def test_truncated_snapshot_is_rejected(size):
+    snapshot = tree_snapshot.dumps(make_tree(), {})
+
+    with pytest.raises(SnapshotError, match="Truncated"):
+        tree_snapshot.loads(snapshot[:size])
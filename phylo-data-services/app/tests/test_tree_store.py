@@ -0,0 +1,130 @@
+import os
+from time import time
+
+import pytest
+from utils.tree_store import DiskTreeStore
+from utils.tree_store import MemoryTreeStore
+from utils.tree_store import TreeStore
+
+
+@pytest.fixture(params=["disk", "memory"])
+def store(request, tmp_path):
+    if request.param == "disk":
+        return DiskTreeStore(tmp_path)
+    return MemoryTreeStore()
+
+
+def load_bytes(store, tid, original=False):
+    data = store.load(tid, original)
+    if data is None:
+        return None
+    try:
+        return bytes(data)
+    finally:
+        if hasattr(data, "close"):
+            data.close()
+
+
+def test_incomplete_stores_cannot_be_created():
+    class IncompleteTreeStore(TreeStore):
+        def save(self, tid, data, original=False):
+            return 1
+
+    with pytest.raises(TypeError):
+        IncompleteTreeStore()
+
+
+def test_store_saves_and_loads_trees(store):
+    store.save(1, b"tree 1")
+    store.save(2, b"tree 2")
+
+    assert load_bytes(store, 1) == b"tree 1"
+    assert store.exists(2)
+    assert sorted(store.tree_ids()) == [1, 2]
+    assert store.load(3) is None
+    assert not store.exists(3)
+
+
+def test_store_keeps_the_original_tree_apart(store):
+    store.save(1, b"original", original=True)
+    store.save(1, b"original")
+    store.save(1, b"modified")
+
+    assert load_bytes(store, 1) == b"modified"
+    assert load_bytes(store, 1, original=True) == b"original"
+    assert store.tree_ids() == [1]
+
+    store.delete(1)
+
+    assert store.load(1) is None
+    assert store.load(1, original=True) is None
+
+
+def test_store_stamp_changes_only_when_saved(store):
+    assert store.stamp(1) is None
+
+    stamp = store.save(1, b"tree")
+    assert store.stamp(1) == stamp
+
+    store.touch(1)
+    store.load(1)
+    assert store.stamp(1) == stamp
+
+    assert store.save(1, b"tree") != stamp
+
+
+def test_store_removes_stale_trees(store):
+    store.save(1, b"tree 1")
+    store.save(2, b"tree 2")
+
+    assert store.remove_stale(max_idle_seconds=60) == []
+    assert sorted(store.remove_stale(max_idle_seconds=-1)) == [1, 2]
+    assert store.tree_ids() == []
+
+
+def test_disk_store_touch_keeps_trees_from_being_stale(tmp_path):
+    store = DiskTreeStore(tmp_path)
+    store.save(1, b"tree 1")
+    store.save(2, b"tree 2")
+    an_hour_ago = time() - 3600
+    for tid in (1, 2):
+        os.utime(store.path(tid), (an_hour_ago, an_hour_ago))
+
+    store.touch(1)
+
+    assert store.remove_stale(max_idle_seconds=60) == [2]
+    assert store.tree_ids() == [1]
+
+
+def test_disk_store_replaces_files_atomically(tmp_path):
+    store = DiskTreeStore(tmp_path)
+    store.save(1, b"old tree")
+    loaded = store.load(1)
+
+    store.save(1, b"new tree")
+
+    # The mapping of the old file is still valid, and nothing else is left.
+    assert bytes(loaded) == b"old tree"
+    loaded.close()
+    assert load_bytes(store, 1) == b"new tree"
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["1.tree"]
+
+
+def test_disk_store_ignores_other_files(tmp_path):
+    store = DiskTreeStore(tmp_path)
+    (tmp_path / "notes.tree").write_bytes(b"not a tree")
+    store.save(1, b"tree")
+
+    assert store.tree_ids() == [1]
+    assert store.remove_stale(max_idle_seconds=-1) == [1]
+    assert (tmp_path / "notes.tree").exists()
+
+
+def test_disk_store_closes_the_loaded_trees(tmp_path):
+    store = DiskTreeStore(tmp_path)
+    store.save(1, b"tree")
+
+    with store.loading(1) as loaded:
+        assert bytes(loaded) == b"tree"
+
+    assert loaded.closed
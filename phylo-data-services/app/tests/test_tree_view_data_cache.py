@@ -0,0 +1,109 @@
+from unittest.mock import patch
+
+from ete4.smartview import TreeLayout
+from services.tree_view_data_service import TreeViewDataService
+from utils.tree_view_data_cache import TOOLTIP_ESTIMATED_BYTES
+from utils.tree_view_data_cache import TreeViewDataCache
+from utils.tree_view_data_cache import TreeViewDataEntry
+
+NEWICK = "((Phy0000001_X:1,Phy0000002_X:1):1,Phy0000003_X:1);"
+
+
+def make_entry(newick="(a,b);", ntooltips=1):
+    return TreeViewDataEntry(
+        newick=newick,
+        layouts=[],
+        tree_node_tooltip_data={pid: None for pid in range(ntooltips)},
+    )
+
+
+def test_get_returns_the_entry_put_and_counts_hits_and_misses():
+    cache = TreeViewDataCache()
+    entry = make_entry()
+    cache.put(cache.make_key(1, 1), entry)
+
+    assert cache.get(cache.make_key(1, 1)) is entry
+    assert cache.get(cache.make_key(1, 2)) is None
+    assert cache.get_stats()["hits"] == 1
+    assert cache.get_stats()["misses"] == 1
+
+
+def test_put_evicts_the_least_recently_used_beyond_max_entries():
+    cache = TreeViewDataCache(max_entries=2)
+    cache.put("a", make_entry())
+    cache.put("b", make_entry())
+    cache.get("a")  # so "b" is the least recently used
+
+    cache.put("c", make_entry())
+
+    assert list(cache.entries) == ["a", "c"]
+    assert cache.get_stats()["evictions"] == 1
+
+
+def test_put_evicts_the_least_recently_used_beyond_max_bytes():
+    entry_bytes = len("(a,b);") + TOOLTIP_ESTIMATED_BYTES
+    cache = TreeViewDataCache(max_bytes=2 * entry_bytes)
+    cache.put("a", make_entry())
+    cache.put("b", make_entry())
+
+    cache.put("c", make_entry())
+
+    assert list(cache.entries) == ["b", "c"]
+    assert cache.resident_bytes == 2 * entry_bytes
+    assert cache.get_stats()["evictions"] == 1
+
+
+def test_put_skips_entries_bigger_than_max_bytes():
+    cache = TreeViewDataCache(max_bytes=TOOLTIP_ESTIMATED_BYTES)
+    cache.put("a", make_entry(ntooltips=0))
+
+    cache.put("b", make_entry(ntooltips=1))
+
+    assert list(cache.entries) == ["a"]
+    assert cache.resident_bytes == len("(a,b);")
+
+
+def test_put_replaces_the_entry_of_the_same_key():
+    cache = TreeViewDataCache()
+    cache.put("a", make_entry(ntooltips=1))
+
+    cache.put("a", make_entry(ntooltips=2))
+
+    assert len(cache.entries) == 1
+    assert cache.resident_bytes == len("(a,b);") + 2 * TOOLTIP_ESTIMATED_BYTES
+
+
+def build_entry(db_connection, tree_id, phylome_id, seed_protein_id, newick):
+    return TreeViewDataEntry(
+        newick=newick, layouts=[TreeLayout("layout")], tree_node_tooltip_data={}
+    )
+
+
+def test_generate_data_from_tree_uses_cache(tree_view_data_cache):
+    with patch.object(
+        TreeViewDataService, "build_tree_view_data_entry", side_effect=build_entry
+    ) as build:
+        first = TreeViewDataService.generate_data_from_tree(None, 7, 1, 1, NEWICK)
+        second = TreeViewDataService.generate_data_from_tree(None, 7, 1, 1, NEWICK)
+
+    assert build.call_count == 1
+    assert tree_view_data_cache.get_stats()["hits"] == 1
+    assert first["id"] != second["id"]
+    assert first["tree"] is not second["tree"]
+    assert first["layouts"][0] is not second["layouts"][0]
+
+
+def test_generate_data_from_tree_rebuilds_when_the_newick_changes(
+    tree_view_data_cache,
+):
+    newick = "((Phy0000001_X:1,Phy0000004_X:1):1,Phy0000003_X:1);"
+    with patch.object(
+        TreeViewDataService, "build_tree_view_data_entry", side_effect=build_entry
+    ) as build:
+        TreeViewDataService.generate_data_from_tree(None, 7, 1, 1, NEWICK)
+        data = TreeViewDataService.generate_data_from_tree(None, 7, 1, 1, newick)
+
+    assert build.call_count == 2
+    assert "Phy0000004_X" in data["tree"].leaf_names()
+    key = tree_view_data_cache.make_key(7, 1)
+    assert tree_view_data_cache.entries[key].newick == newick
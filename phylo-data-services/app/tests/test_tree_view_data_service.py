@@ -0,0 +1,234 @@
+from contextlib import nullcontext
+from datetime import datetime
+from threading import Barrier
+from unittest.mock import patch
+
+import mariadb  # type: ignore
+import pytest
+from ete4 import Tree
+from models.gene_neighbourhood_dao import GeneNeighbourhoodDAO
+from services.tree_view_data_service import TOOLTIP_REF_PREFIX
+from services.tree_view_data_service import TreeViewDataService
+from utils import mariadb_connection
+
+
+def make_gene(gene_id, main_contig_gene_id, protein_id, start=0, end=10):
+    return GeneNeighbourhoodDAO(
+        gene_id=gene_id,
+        main_contig_gene_id=main_contig_gene_id,
+        external_gene_id=f"ext-{gene_id}",
+        contig_id="contig",
+        gene_name=f"gene-{gene_id}",
+        source="source",
+        start=start,
+        end=end,
+        relative_contig_gene_order=0,
+        strand="+",
+        timestamp=datetime(2024, 1, 1),
+        genome_id=1,
+        protein_id=protein_id,
+    )
+
+
+@pytest.fixture
+def seed_gene():
+    return make_gene(10, 10, protein_id=1)
+
+
+@pytest.fixture
+def neighbourhoods():
+    # The seed (protein 1) and two leaves (proteins 2 and 3) with 2 neighbours each.
+    return [
+        make_gene(10, 10, protein_id=1),
+        make_gene(11, 10, protein_id=101, start=20, end=30),
+        make_gene(12, 10, protein_id=102, start=40, end=50),
+        make_gene(20, 20, protein_id=2),
+        make_gene(21, 20, protein_id=201, start=20, end=30),
+        make_gene(22, 20, protein_id=202, start=40, end=50),
+        make_gene(30, 30, protein_id=3),
+        make_gene(31, 30, protein_id=301, start=20, end=30),
+        make_gene(32, 30, protein_id=302, start=40, end=50),
+    ]
+
+
+def get_relationship_map(leaf_protein_ids, seed_gene, neighbourhoods, homologs, orthologs):
+    grouped_genes_by_contig = {}
+    for gene in neighbourhoods:
+        grouped_genes_by_contig.setdefault(gene.main_contig_gene_id, []).append(gene)
+    target_neighbourhoods = [gene for gene in neighbourhoods if gene.gene_id != seed_gene.gene_id]
+    return TreeViewDataService.get_gene_order_homology_relationship_map(
+        leaf_protein_ids,
+        seed_gene,
+        grouped_genes_by_contig,
+        target_neighbourhoods,
+        homologs,
+        orthologs,
+    )
+
+
+def test_get_protein_id_from_node_name():
+    assert TreeViewDataService.get_protein_id_from_node_name("Phy0000042_9606") == 42
+
+
+def test_relationship_map_seed_neighbourhood(seed_gene, neighbourhoods):
+    relationship_map = get_relationship_map([1], seed_gene, neighbourhoods, {}, {})
+
+    assert list(relationship_map) == [1]
+    assert list(relationship_map[1]) == [10, 11, 12]
+    assert relationship_map[1][10]["assigned_color"] == TreeViewDataService.seed_gene_color
+    assert relationship_map[1][11]["assigned_color"] == TreeViewDataService.homology_colors[1]
+    assert relationship_map[1][12]["assigned_color"] == TreeViewDataService.homology_colors[2]
+
+
+def test_relationship_map_leaf_relations(seed_gene, neighbourhoods):
+    relationship_map = get_relationship_map(
+        [1, 2, 3], seed_gene, neighbourhoods, {21: 11, 31: 12}, {22: 12}
+    )
+
+    assert list(relationship_map) == [1, 2, 3]
+    assert list(relationship_map[2]) == [20, 21, 22]
+    assert list(relationship_map[3]) == [30, 31, 32]
+
+    leaf_gene = relationship_map[2][20]
+    assert leaf_gene["homologous_with"] is None
+    assert leaf_gene["orthologous_with"] is None
+    assert leaf_gene["assigned_color"] == TreeViewDataService.none_gene_color
+    assert leaf_gene["gene"].gene_id == 20
+
+    homolog = relationship_map[2][21]
+    assert homolog["homologous_with"] == 11
+    assert homolog["assigned_color"] == TreeViewDataService.homology_colors[1]
+    assert homolog["stroke_width"] == TreeViewDataService.homologous_stroke_width
+
+    ortholog = relationship_map[2][22]
+    assert ortholog["orthologous_with"] == 12
+    assert ortholog["assigned_color"] == TreeViewDataService.none_gene_color
+    assert ortholog["stroke_color"] == TreeViewDataService.orthologous_stroke_color
+
+    assert relationship_map[3][31]["assigned_color"] == TreeViewDataService.homology_colors[2]
+
+
+def test_relationship_map_leaves_without_genes(seed_gene, neighbourhoods):
+    relationship_map = get_relationship_map([1, 2, 4], seed_gene, neighbourhoods, {}, {})
+
+    assert list(relationship_map) == [1, 2]
+
+
+@pytest.fixture
+def pooled_connection():
+    with patch(
+        "utils.mariadb_connection.get_pooled_mariadb_connection",
+        return_value=nullcontext(),
+    ):
+        yield
+
+
+def test_gene_order_layout_makes_faces_when_styling(seed_gene, neighbourhoods):
+    tree = Tree("((Phy0000001_X:1,Phy0000002_X:1):1,Phy0000003_X:1);")
+    relationship_map = get_relationship_map(
+        [1, 2, 3], seed_gene, neighbourhoods, {21: 11}, {}
+    )
+    layout = TreeViewDataService.generate_gene_order_tree_layout(tree, relationship_map)
+
+    assert [layout.tooltips[record.tooltip][0] for record in layout.args[2]] == [
+        20,
+        21,
+        22,
+    ]
+    assert sorted(layout.genes) == [10, 11, 12, 20, 21, 22, 30, 31, 32]
+    assert len(layout.styles) < len(layout.genes)  # shared by the genes
+
+    leaf = tree["Phy0000002_X"]
+    assert not leaf.faces.aligned
+    layout.set_node_style(leaf)
+    faces = [leaf.faces.aligned[column][0] for column in range(3)]
+    assert [face.name for face in faces] == ["ArrowFace"] * 3
+    assert faces[1].color == TreeViewDataService.homology_colors[1]
+
+
+def test_gene_order_layout_interns_tooltips(seed_gene, neighbourhoods):
+    tree = Tree("((Phy0000001_X:1,Phy0000002_X:1):1,Phy0000003_X:1);")
+    relationship_map = get_relationship_map([1, 2, 3], seed_gene, neighbourhoods, {}, {})
+    # The gene 21 is in the neighbourhood of the protein 3 too.
+    relationship_map[3][21] = relationship_map[2][21]
+    layout = TreeViewDataService.generate_gene_order_tree_layout(tree, relationship_map)
+
+    record = layout.args[2][1]
+    assert record.tooltip in [other.tooltip for other in layout.args[3]]
+    assert len(layout.tooltips) == len(layout.genes)
+
+    leaf = tree["Phy0000002_X"]
+    layout.set_node_style(leaf)
+    face = leaf.faces.aligned[1][0]
+    assert face.tooltip == f"{TOOLTIP_REF_PREFIX}MyTreeLayout/{record.tooltip}"
+    assert "<strong>Gene ID:</strong> 21" in layout.get_tooltip(record.tooltip)
+
+
+def test_generate_data_from_tree_fetches_concurrently(
+    neighbourhoods, pooled_connection, tree_view_data_cache
+):
+    newick = "((Phy0000001_X:1,Phy0000002_X:1):1,Phy0000003_X:1);"
+    # Every pair of queries waits for the other one, so it would fail if
+    # they were run one after the other.
+    barrier = Barrier(2, timeout=5)
+
+    def fetch(result):
+        def wait_and_fetch(*_):
+            barrier.wait()
+            return iter(result)
+
+        return wait_and_fetch
+
+    with patch.object(
+        GeneNeighbourhoodDAO, "get_by_tree_id", side_effect=fetch(neighbourhoods)
+    ), patch(
+        "services.tree_view_data_service.HomologDAO.get_homologs_for_seed_genes",
+        side_effect=fetch(()),
+    ), patch(
+        "services.tree_view_data_service.OrthologsDAO.get_orthologs_for_seed_genes",
+        side_effect=fetch(()),
+    ), patch(
+        "services.tree_view_data_service.TreeNodeTooltipData.get_by_tree_id",
+        side_effect=fetch(()),
+    ):
+        data = TreeViewDataService.generate_data_from_tree(None, 8, 1, 1, newick)
+
+    assert sorted(data["layouts"][0].args) == [1, 2, 3]
+
+
+class ExhaustedPool:
+    def get_connection(self):
+        raise mariadb.PoolError("no connections left")
+
+
+class SingleConnection:
+    def close(self):
+        pass
+
+
+def test_fetches_beyond_the_pool_run_at_once_on_their_own_connections(monkeypatch):
+    nfetches = mariadb_connection.DB_POOL_SIZE + 1  # the pooled ones
+    opened = []
+
+    def open_connection():
+        opened.append(SingleConnection())
+        return opened[-1]
+
+    monkeypatch.setattr(mariadb_connection, "get_connection_pool", ExhaustedPool)
+    monkeypatch.setattr(
+        mariadb_connection, "get_single_mariadb_connection", open_connection
+    )
+    # Every fetch waits for all the others, so it would fail if they
+    # waited for free connections or threads.
+    barrier = Barrier(nfetches, timeout=5)
+
+    def fetch(connection):
+        barrier.wait()
+        return connection
+
+    results = mariadb_connection.fetch_concurrently(
+        None, lambda connection: connection, *[fetch] * nfetches
+    )
+
+    assert results[0] is None
+    assert sorted(map(id, results[1:])) == sorted(map(id, opened))
@@ -0,0 +1,372 @@
+from threading import Lock
+from time import sleep
+
+import pytest
+from ete4 import Tree
+from ete4.core import operations as ops
+from fastapi import HTTPException
+from models.tree_node_tooltip_data_dao import TreeNodeTooltipData
+from utils import tree_viewer
+from utils.tree_store import MemoryTreeStore
+from utils.tree_viewer import GlobalTreeCache
+from utils.tree_viewer import TreeData
+
+
+def make_tooltip(protein_id):
+    return TreeNodeTooltipData(
+        protein_id=protein_id,
+        external_protein_id=f"ext-{protein_id}",
+        description="description",
+        gene_id=protein_id,
+        external_gene_id=f"gene-{protein_id}",
+        contig_id="contig",
+        gene_name="gene",
+        source="source",
+        genome_id=1,
+        external_genome_id="genome",
+        taxid=9606,
+        name="Homo sapiens",
+    )
+
+
+def make_tree_data(newick="((a:1,b:2):1,c:3);"):
+    tree = Tree(newick)
+    ops.update_sizes_all(tree)
+    tree_data = TreeData(tree=tree, name="tree", estimated_bytes=0)
+    tree_data.saved_version = tree_data.version
+    return tree_data
+
+
+def add_tree(tid, newick="((a:1,b:2):1,c:3);"):
+    tree_viewer.add_tree(
+        {"id": tid, "name": f"tree {tid}", "newick": newick, "tree_node_tooltip_data": {}}
+    )
+    tree_viewer.wait_for_tree_store(tid)
+
+
+def test_cache_evicts_the_least_recently_used_tree():
+    cache = GlobalTreeCache(store=MemoryTreeStore(), max_trees=2, max_bytes=10**9)
+    for tid in (1, 2):
+        cache.put(tid, make_tree_data())
+
+    cache.get(1)  # now 2 is the least recently used
+    cache.put(3, make_tree_data())
+
+    assert [tid for tid, _ in cache.cached_trees()] == [1, 3]
+    assert cache.stats.evictions == 1
+
+
+def test_cache_evicts_until_under_the_byte_limit():
+    cache = GlobalTreeCache(store=MemoryTreeStore(), max_trees=100)
+    for tid in (1, 2, 3):
+        cache.put(tid, make_tree_data())
+    tree_bytes = cache.trees[1].estimated_bytes
+    cache.max_bytes = 2 * tree_bytes
+
+    cache.enforce_limits()
+
+    assert [tid for tid, _ in cache.cached_trees()] == [2, 3]
+    assert cache.resident_bytes() <= cache.max_bytes
+
+
+def test_cache_keeps_the_most_recently_used_tree_over_the_byte_limit():
+    cache = GlobalTreeCache(store=MemoryTreeStore(), max_bytes=1)
+    cache.put(1, make_tree_data())
+    cache.put(2, make_tree_data())
+
+    assert [tid for tid, _ in cache.cached_trees()] == [2]
+
+
+def test_cache_does_not_evict_unsaved_trees():
+    cache = GlobalTreeCache(store=MemoryTreeStore(), max_trees=1)
+    modified = make_tree_data()
+    modified.version += 1  # as if changed after it was saved
+    cache.put(1, modified)
+    cache.put(2, make_tree_data())
+
+    assert [tid for tid, _ in cache.cached_trees()] == [1, 2]
+
+    cache.save_modified()
+    cache.enforce_limits()
+
+    assert [tid for tid, _ in cache.cached_trees()] == [2]
+    assert cache.store.exists(1)
+
+
+def test_cache_evicts_unsaved_trees_that_cannot_be_serialized():
+    cache = GlobalTreeCache(store=MemoryTreeStore(), max_trees=1)
+    unpicklable = make_tree_data()
+    unpicklable.tree.add_prop("lock", Lock())
+    unpicklable.version += 1  # as if changed after it was saved
+    cache.put(1, unpicklable)
+    cache.put(2, make_tree_data())
+
+    assert not cache.save(1, unpicklable)
+    assert not cache.save(1, unpicklable)  # not tried again
+    assert cache.stats.save_failures == 1
+
+    cache.enforce_limits()
+
+    assert [tid for tid, _ in cache.cached_trees()] == [2]
+    assert cache.stats.lost_changes == 1
+
+
+class FailingTreeStore(MemoryTreeStore):
+    def save(self, tid, data, original=False):
+        raise OSError("no space left")
+
+
+def test_cache_expires_unsaved_trees_that_failed_to_be_written():
+    cache = GlobalTreeCache(store=FailingTreeStore(), max_idle_seconds=0)
+    modified = make_tree_data()
+    modified.version += 1
+    cache.put(1, modified)
+
+    cache.save_modified()
+    cache.save_modified()  # not tried again
+    modified.timer -= 1
+    cache.remove_stale_tree_caches()
+
+    assert cache.cached_trees() == []
+    assert cache.stats.save_failures == 1
+    assert cache.stats.expirations == 1
+    assert cache.stats.lost_changes == 1
+
+
+def test_tree_reloaded_after_eviction_keeps_its_changes(global_tree_cache):
+    add_tree(1)
+    tree_viewer.store_search("1", {"text": "a"})
+    tree_viewer.store_selection("1,0", {"text": "first"})
+    tree_data = tree_viewer.get_tree_data(1)
+    node = tree_data.tree["a"].up
+    tree_data.nodestyles[node] = {"fgcolor": "red"}
+    tree_viewer.mark_tree_modified(tree_data)
+
+    assert global_tree_cache.save(1, tree_data)
+    global_tree_cache.pop(1)  # as if evicted
+
+    reloaded = tree_viewer.get_tree_data(1)
+    assert reloaded is not tree_data
+    assert [n.name for n in reloaded.searches["a"][0]] == ["a"]
+    assert list(reloaded.selected["first"][0]) == [reloaded.tree["a"].up]
+    assert list(reloaded.nodestyles.items()) == [
+        (reloaded.tree["a"].up, {"fgcolor": "red"})
+    ]
+
+
+def test_tree_reloaded_after_eviction_keeps_its_original_dists(global_tree_cache):
+    add_tree(1)
+    tree_data = tree_viewer.get_tree_data(1)
+    tree_viewer.set_ultrametric(tree_data, True)
+    tree_viewer.mark_tree_modified(tree_data)
+    global_tree_cache.save(1, tree_data)
+    global_tree_cache.pop(1)
+
+    reloaded = tree_viewer.get_tree_data(1)
+    assert reloaded.ultrametric
+    tree_viewer.set_ultrametric(reloaded, False)
+    assert [n.dist for n in reloaded.tree.traverse("preorder")][1:] == [1, 1, 2, 3]
+
+
+def test_reload_tree_restores_the_original_tree(global_tree_cache):
+    add_tree(1)
+    tree_viewer.store_search("1", {"text": "a"})
+    tree_data = tree_viewer.get_tree_data(1)
+    global_tree_cache.save(1, tree_data)
+
+    tree_viewer.reload_tree(1)
+
+    reloaded = tree_viewer.get_tree_data(1)
+    assert reloaded is not tree_data
+    assert not reloaded.searches
+
+
+def test_trees_are_listed_from_the_store(global_tree_cache):
+    add_tree(1)
+    add_tree(2)
+    global_tree_cache.pop(2)  # as if in another worker
+
+    assert global_tree_cache.tree_names() == {1: "tree 1", 2: "tree 2"}
+
+
+def test_tree_saved_by_another_worker_is_reloaded(global_tree_cache):
+    add_tree(1)
+    tree_data = tree_viewer.get_tree_data(1)
+
+    # Another worker stores a search and saves the tree.
+    other = tree_viewer.tree_data_from_snapshot(global_tree_cache.store.load(1))
+    tree_viewer.mark_tree_modified(other)
+    other.searches["a"] = ({other.tree["a"]}, {})
+    global_tree_cache.store.save(1, tree_viewer.tree_data_to_snapshot(other))
+
+    reloaded = tree_viewer.get_tree_data(1)
+    assert reloaded is not tree_data
+    assert [n.name for n in reloaded.searches["a"][0]] == ["a"]
+
+
+def test_modified_trees_are_saved_in_the_background(global_tree_cache):
+    global_tree_cache.eviction_interval = 3600
+    global_tree_cache.start_background_eviction()
+    add_tree(1)
+    stamp = global_tree_cache.store.stamp(1)
+
+    tree_viewer.store_search("1", {"text": "a"})
+
+    for _ in range(100):
+        if global_tree_cache.store.stamp(1) != stamp:
+            break
+        sleep(0.05)
+    snapshot = global_tree_cache.store.load(1)
+    assert list(tree_viewer.tree_data_from_snapshot(snapshot).searches) == ["a"]
+
+
+def test_tooltip_index_has_the_tooltips_by_node_name():
+    tree_data = make_tree_data("((Phy1_9606,Phy7_9606),(PHY2_10090,other));")
+    tree_data.tree_node_tooltip_data = {
+        1: make_tooltip(1),
+        2: make_tooltip(2),
+        3: make_tooltip(3),
+    }
+
+    index = tree_viewer.build_tooltip_index(tree_data)
+
+    assert sorted(index) == ["PHY2_10090", "Phy1_9606"]  # no data for Phy7
+    assert index["Phy1_9606"] == {
+        "node_id": "Phy1_9606",
+        **make_tooltip(1).model_dump(),
+    }
+
+
+def test_tooltip_index_gets_renamed_nodes():
+    tree_data = make_tree_data("(Phy1_9606,other);")
+    tree_data.tree_node_tooltip_data = {1: make_tooltip(1), 2: make_tooltip(2)}
+    tree_viewer.build_tooltip_index(tree_data)
+
+    tree_viewer.index_node_tooltip(tree_data, "Phy2_9606")
+    tree_viewer.index_node_tooltip(tree_data, "Phyx_9606")
+    tree_viewer.index_node_tooltip(tree_data, None)
+
+    assert sorted(tree_data.tooltip_index) == ["Phy1_9606", "Phy2_9606"]
+
+
+def test_copies_of_a_tree_share_its_lock():
+    cache = GlobalTreeCache(store=MemoryTreeStore())
+    tree_data = make_tree_data()
+    cache.put(1, tree_data)
+    cache.pop(1)  # as if evicted
+
+    reloaded = make_tree_data()
+    cache.put(1, reloaded)
+
+    assert reloaded.lock is tree_data.lock
+
+    cache.delete(1)
+    cache.put(1, make_tree_data())
+
+    assert cache.get(1).lock is not tree_data.lock
+
+
+def test_cache_does_not_evict_trees_in_use():
+    cache = GlobalTreeCache(store=MemoryTreeStore(), max_trees=1)
+    in_use = make_tree_data()
+    cache.put(1, in_use)
+
+    with in_use.lock.read():
+        cache.put(2, make_tree_data())
+        assert [tid for tid, _ in cache.cached_trees()] == [1, 2]
+
+    cache.enforce_limits()
+
+    assert [tid for tid, _ in cache.cached_trees()] == [2]
+
+
+@pytest.mark.parametrize(
+    "tree_id, expected",
+    [
+        (7, (7, [])),
+        ("7", (7, [])),
+        ("7,1,0", (7, [1, 0])),
+        ("7,@3", (7, ["@3"])),
+        ("7,@03,1", (7, ["@3", 1])),  # handles are normalized
+        ("7,0,@2,1", (7, [0, "@2", 1])),
+        (None, None),
+    ],
+)
+def test_tree_ids_have_paths_and_handles(tree_id, expected):
+    assert tree_viewer.get_tid(tree_id) == expected
+
+
+@pytest.mark.parametrize("tree_id", ["x", "7,x", "7,@", "7,@x", "7,@-1", "7,@1.5"])
+def test_invalid_tree_ids_are_rejected(tree_id):
+    with pytest.raises(HTTPException) as error:
+        tree_viewer.get_tid(tree_id)
+
+    assert error.value.status_code == 400
+
+
+@pytest.mark.parametrize(
+    "node_id, expected",
+    [
+        ("", []),
+        ("1,0", [1, 0]),
+        ("@5", ["@5"]),
+        ("@5,1", ["@5", 1]),
+        ([1, "0"], [1, 0]),
+        (["@5", 1], ["@5", 1]),
+        (2, [2]),
+    ],
+)
+def test_node_ids_have_paths_and_handles(node_id, expected):
+    assert tree_viewer.get_node_steps(node_id) == expected
+
+
+@pytest.mark.parametrize("node_id", ["x", "1,x", "@", "@x", ["@-1"]])
+def test_invalid_node_ids_are_rejected(node_id):
+    with pytest.raises(HTTPException) as error:
+        tree_viewer.get_node_steps(node_id)
+
+    assert error.value.status_code == 400
+
+
+def test_nodes_are_found_by_path_and_by_handle():
+    tree_data = make_tree_data("((a,b),(c,(d,e)));")
+    tree = tree_data.tree
+    get_node = tree_viewer.get_node
+
+    for position, node in enumerate(tree.traverse("preorder")):
+        handle = tree_viewer.get_node_handle(tree_data, node)
+        assert handle == f"@{position}"
+        assert get_node(tree_data, [handle]) is node
+        assert get_node(tree_data, [1, 0, handle]) is node  # the last one counts
+        assert get_node(tree_data, list(node.id)) is node  # its path
+
+    assert get_node(tree_data, []) is tree
+    assert get_node(tree_data, ["@6", 1]) is tree["e"]  # handle and then path
+    assert get_node(tree_data, [1, "@1", 0]) is tree["a"]
+
+
+@pytest.mark.parametrize("node_id", [["@9"], ["@100"], [5], [0, 0, 0], ["@3", 0]])
+def test_nodes_out_of_the_tree_are_not_found(node_id):
+    tree_data = make_tree_data("((a,b),(c,(d,e)));")
+
+    with pytest.raises(IndexError):
+        tree_viewer.get_node(tree_data, node_id)
+
+
+def test_subtree_id_follows_its_node_after_a_topology_change():
+    tree_data = make_tree_data("((a,b),(c,(d,e)));")
+    tree = tree_data.tree
+    node = tree["c"].up
+    assert tree_viewer.get_node_handle(tree_data, node) == "@4"
+
+    ops.move(node, -1)  # now the first child of the root
+    tree_viewer.mark_tree_modified(tree_data, reindex=True)
+
+    assert tree_viewer.get_subtree_id(tree_data, node) == "@1"
+    assert tree_viewer.get_node(tree_data, ["@1"]) is node
+    assert tree_viewer.get_subtree_id(tree_data, tree) == ""
+
+    ops.remove(node)
+    tree_viewer.mark_tree_modified(tree_data, reindex=True)
+
+    assert tree_viewer.get_subtree_id(tree_data, node) == ""
@@ -0,0 +1,258 @@
+import json
+
+import pytest
+from controllers import drawers_controller
+from controllers import ete_smartview_controller
+from controllers import layouts_controller
+from controllers import trees_controller
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from models.tree_node_tooltip_data_dao import TreeNodeTooltipData
+from utils import tree_viewer
+from utils.tree_viewer import DRAW_EXECUTOR
+from utils.tree_viewer import DRAW_RESPONSE_CACHE
+
+
+# Big enough to draw every node of the test trees.
+WHOLE_TREE_VIEWPORT = {"zx": "100", "zy": "100", "w": "1000", "h": "1000"}
+
+
+def make_tooltip(protein_id):
+    return TreeNodeTooltipData(
+        protein_id=protein_id,
+        external_protein_id=f"ext-{protein_id}",
+        description="description",
+        gene_id=protein_id,
+        external_gene_id=f"gene-{protein_id}",
+        contig_id="contig",
+        gene_name="gene",
+        source="source",
+        genome_id=1,
+        external_genome_id="genome",
+        taxid=9606,
+        name="Homo sapiens",
+    )
+
+
+@pytest.fixture
+def client(global_tree_cache):
+    app = FastAPI()
+    app.include_router(trees_controller.router)
+    app.include_router(ete_smartview_controller.router)
+    app.include_router(drawers_controller.router)
+    app.include_router(layouts_controller.router)
+    DRAW_RESPONSE_CACHE.clear()
+    return TestClient(app)
+
+
+def add_tree(tid, newick="((Phy1_9606:1,Phy2_9606:2):1,Phy3_9606:3);"):
+    tree_viewer.add_tree(
+        {
+            "id": tid,
+            "name": f"tree {tid}",
+            "newick": newick,
+            "tree_node_tooltip_data": {pid: make_tooltip(pid) for pid in (1, 2, 3)},
+        }
+    )
+    tree_viewer.wait_for_tree_store(tid)
+
+
+def draw_cache_hits(client, path):
+    hits = DRAW_RESPONSE_CACHE.stats.hits
+    response = client.get(path)
+    assert response.status_code == 200
+    return DRAW_RESPONSE_CACHE.stats.hits - hits
+
+
+def test_draw_is_cached_until_the_tree_changes(client):
+    add_tree(1)
+
+    assert draw_cache_hits(client, "/trees/1/draw") == 0
+    assert draw_cache_hits(client, "/trees/1/draw") == 1
+
+    client.get("/trees/1/search", params={"text": "Phy1_9606"})
+
+    assert draw_cache_hits(client, "/trees/1/draw") == 0
+    assert draw_cache_hits(client, "/trees/1/draw") == 1
+
+
+def test_draws_after_an_edit_do_not_join_the_draws_from_before(client, monkeypatch):
+    add_tree(1)
+    keys = []
+    run = DRAW_EXECUTOR.run
+
+    def record_and_run(key, *args):
+        keys.append(key)
+        return run(key, *args)
+
+    monkeypatch.setattr(DRAW_EXECUTOR, "run", record_and_run)
+
+    client.get("/trees/1/draw")
+    client.put("/trees/1/rename", json=["0,0", "renamed"])
+    client.get("/trees/1/draw")
+
+    assert len(keys) == 2
+    assert keys[0] != keys[1]
+
+
+def test_draws_of_subtrees_are_cached_apart(client):
+    add_tree(1)
+    client.get("/trees/1/draw")
+
+    assert draw_cache_hits(client, "/trees/1,0/draw") == 0
+    assert draw_cache_hits(client, "/trees/1,0/draw") == 1
+    assert (
+        client.get("/trees/1,0/draw").json() != client.get("/trees/1/draw").json()
+    )
+
+
+def parse_ndjson(content):
+    return [json.loads(line) for line in content.decode().splitlines()]
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_streamed_draw_has_the_graphics_of_the_draw(
+    client, global_tree_cache, monkeypatch, compress
+):
+    monkeypatch.setattr(global_tree_cache, "compress", compress)
+    monkeypatch.setattr(trees_controller, "DRAW_STREAM_CHUNK_SIZE", 1)  # many chunks
+    add_tree(1)
+    for path in ["/trees/1/draw", "/trees/1,0/draw"]:
+        graphics = client.get(path, params=WHOLE_TREE_VIEWPORT).json()
+        for _ in range(2):  # drawn, and then cached
+            response = client.get(path, params={**WHOLE_TREE_VIEWPORT, "stream": "1"})
+            assert response.status_code == 200
+            assert response.headers["content-type"] == "application/x-ndjson"
+            assert parse_ndjson(response.content) == graphics
+
+
+def test_streamed_draw_counts_against_the_pending_draws(client, monkeypatch):
+    add_tree(1)
+    monkeypatch.setattr(DRAW_EXECUTOR, "max_pending", 0)
+
+    assert client.get("/trees/1/draw", params={"stream": "1"}).status_code == 503
+
+
+def test_streamed_draw_of_unknown_tree_fails_with_its_status(client):
+    assert client.get("/trees/1/draw", params={"stream": "1"}).status_code == 404
+
+
+def test_draw_has_the_tooltips_of_the_proteins(client):
+    add_tree(1, "((Phy1_9606:1,other:2):1,Phy3_9606:3);")
+    client.put("/trees/1/rename", json=["0,1", "Phy2_9606"])
+
+    nodeboxes = {
+        graphic[2]: graphic[3]
+        for graphic in client.get("/trees/1/draw", params=WHOLE_TREE_VIEWPORT).json()
+        if graphic[0] == "nodebox" and graphic[2]
+    }
+
+    assert nodeboxes["Phy1_9606"] == {
+        "node_id": "Phy1_9606",
+        **make_tooltip(1).model_dump(),
+    }
+    assert nodeboxes["Phy2_9606"]["protein_id"] == 2
+    assert nodeboxes["Phy3_9606"]["protein_id"] == 3
+
+
+def test_node_styles_are_restored_in_a_new_style_epoch(client):
+    add_tree(1, "((Phy1_9606:1,Phy2_9606:2):1,Phy3_9606:3);")
+    client.put(
+        "/trees/1,0/update_nodestyle",
+        json={"bgcolor": "#ff0000", "fgcolor": "#00ff00", "extend_to_descendants": True},
+    )
+    client.put("/trees/1,1/update_nodestyle", json={"size": "5"})
+    tree = tree_viewer.get_tree_data(1).tree
+
+    def get_styles():
+        client.get("/trees/1/draw", params=WHOLE_TREE_VIEWPORT)  # styles all nodes
+        return [
+            (node.name, *[node.sm_style[prop] for prop in ("bgcolor", "fgcolor", "size")])
+            for node in tree.traverse("preorder")
+        ]
+
+    styles = get_styles()
+    tree_data = tree_viewer.get_tree_data(1)
+    tree_viewer.reinitialize_tree_style(tree_data)  # like a change of layouts
+    tree_viewer.mark_tree_modified(tree_data)
+
+    assert get_styles() == styles
+    assert {node._initialized for node in tree.traverse()} == {tree_data.style_epoch}
+    bgcolor, fgcolor, size = styles[0][1:]  # the root is not styled
+    assert [style[1:] for style in styles[1:]] == [
+        ("#ff0000", "#00ff00", size),
+        ("#ff0000", "#00ff00", size),  # extended to the descendants
+        ("#ff0000", "#00ff00", size),
+        (bgcolor, fgcolor, 5),
+    ]
+
+
+@pytest.mark.parametrize("tree_id", ["1", "1,0"])
+def test_metadata_has_what_the_endpoints_return(client, tree_id):
+    add_tree(1)
+    client.get("/trees/1/search", params={"text": "Phy1_9606"})
+    client.get("/trees/1,1/select", params={"text": "selection"})
+
+    def get(path):
+        response = client.get(path)
+        assert response.status_code == 200
+        return response.json()
+
+    metadata = get(f"/trees/{tree_id}/metadata?drawer=RectFaces")
+
+    assert metadata == {
+        "name": get(f"/trees/{tree_id}/name"),
+        "size": get(f"/trees/{tree_id}/size"),
+        "nodecount": get(f"/trees/{tree_id}/nodecount"),
+        "ultrametric": get(f"/trees/{tree_id}/ultrametric"),
+        "collapse_size": get(f"/trees/{tree_id}/collapse_size"),
+        "layouts": get(f"/layouts/{tree_id}"),
+        "drawer": get(f"/drawers/RectFaces/{tree_id}"),
+        "selected": get(f"/trees/{tree_id}/all_selections")["selected"],
+        "searches": get(f"/trees/{tree_id}/searches")["searches"],
+    }
+    assert metadata["searches"] == {"Phy1_9606": {"nresults": 1, "nparents": 2}}
+
+
+@pytest.mark.parametrize("drawer", ["NotADrawer", None])
+def test_metadata_without_a_valid_drawer_has_no_drawer(client, drawer):
+    add_tree(1)
+    params = {"drawer": drawer} if drawer else {}
+
+    response = client.get("/trees/1/metadata", params=params)
+
+    assert response.status_code == 200
+    assert response.json()["drawer"] is None
+    if drawer:
+        assert client.get(f"/drawers/{drawer}/1").status_code == 400
+
+
+
+def test_topology_changes_return_the_new_id_of_the_subtree(client):
+    add_tree(1, "((Phy1_9606:1,Phy2_9606:2):1,(Phy3_9606:3,(d:1,e:1):1):1);")
+    tree = tree_viewer.get_tree_data(1).tree
+    node = tree["Phy3_9606"].up
+
+    response = client.put("/trees/1,@4/move", json=["", -1])  # the subtree itself
+
+    assert response.json() == {"message": "ok", "subtree": "@1"}
+    assert tree.children[0] is node
+    assert client.get("/trees/1,@1/name").status_code == 200
+
+    response = client.put("/trees/1,@1/sort", json=[[], "dy", True])
+
+    assert response.json() == {"message": "ok", "subtree": "@1"}
+
+    tree_viewer.get_tree_data(1).ultrametric = True  # else it cannot remove
+    response = client.put("/trees/1,@1/remove", json="")  # the subtree itself
+
+    assert response.json() == {"message": "ok", "subtree": ""}
+
+
+@pytest.mark.parametrize(
+    "tree_id, status_code", [("1,@99", 404), ("1,5", 404), ("1,@x", 400)]
+)
+def test_unknown_and_invalid_node_ids_fail(client, tree_id, status_code):
+    add_tree(1)
+
+    assert client.get(f"/trees/{tree_id}/size").status_code == status_code
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+from collections import OrderedDict
+from dataclasses import dataclass
+from threading import Lock
+from typing import Callable
+from typing import Generic
+from typing import Hashable
+from typing import Optional
+from typing import TypeVar
+
+V = TypeVar("V")
+
+
+@dataclass
+class BoundedLRUCacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+
+class BoundedLRUCache(Generic[V]):
+    """LRU cache bounded by its number of entries and by their total size.
+
+    The size of every value, in bytes, is given by get_size() when it is
+    put in the cache, and kept until it leaves it.
+    """
+
+    def __init__(
+        self, get_size: Callable[[V], int], max_entries: int, max_bytes: int
+    ) -> None:
+        self.get_size: Callable[[V], int] = get_size
+        self.max_entries: int = max_entries
+        self.max_bytes: int = max_bytes
+        self.entries: OrderedDict[Hashable, V] = OrderedDict()
+        self.sizes: dict[Hashable, int] = {}
+        self.resident_bytes: int = 0
+        self.stats: BoundedLRUCacheStats = BoundedLRUCacheStats()
+        self.lock: Lock = Lock()
+
+    def get(self, key: Hashable) -> Optional[V]:
+        with self.lock:
+            value: Optional[V] = self.entries.get(key)
+            if value is None:
+                self.stats.misses += 1
+                return None
+            self.stats.hits += 1
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: V) -> None:
+        size: int = self.get_size(value)
+        if size > self.max_bytes:
+            return  # it would evict everything else, and itself
+
+        with self.lock:
+            self.pop(key)
+            self.entries[key] = value
+            self.sizes[key] = size
+            self.resident_bytes += size
+
+            while (
+                len(self.entries) > self.max_entries
+                or self.resident_bytes > self.max_bytes
+            ):
+                self.pop(next(iter(self.entries)))
+                self.stats.evictions += 1
+
+    def remove(self, matches: Callable[[Hashable], bool]) -> None:
+        """Remove the entries whose key matches."""
+        with self.lock:
+            for key in [key for key in self.entries if matches(key)]:
+                self.pop(key)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.sizes.clear()
+            self.resident_bytes = 0
+
+    def pop(self, key: Hashable) -> None:
+        # Called with the lock held.
+        if self.entries.pop(key, None) is not None:
+            self.resident_bytes -= self.sizes.pop(key)
+
+    def get_stats(self) -> dict[str, int]:
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "resident_bytes": self.resident_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.stats.hits,
+                "misses": self.stats.misses,
+                "evictions": self.stats.evictions,
+            }
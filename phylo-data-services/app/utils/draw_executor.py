@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+import asyncio
+import os
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from threading import RLock
+from typing import Any
+from typing import Callable
+from typing import Hashable
+from typing import Optional
+
+from fastapi import HTTPException
+
+
+@dataclass
+class DrawExecutorStats:
+    submitted: int = 0
+    coalesced: int = 0
+    rejected: int = 0
+
+
+class DrawExecutor:
+    """Run the drawing of trees in its own bounded pool of threads.
+
+    Drawing is kept apart from FastAPI's default threadpool, so a few
+    expensive draws cannot take all the threads that the other requests
+    need. Identical requests that arrive while one is being drawn share
+    its result, and when too many draws are pending new ones are
+    rejected with a 503 instead of queueing without limit.
+    """
+
+    def __init__(
+        self, max_workers: Optional[int] = None, max_pending: Optional[int] = None
+    ) -> None:
+        self.max_workers: int = (
+            max_workers
+            if max_workers is not None
+            else int(os.environ.get("DRAW_MAX_WORKERS", 4))
+        )
+        self.max_pending: int = (
+            max_pending
+            if max_pending is not None
+            else int(os.environ.get("DRAW_MAX_PENDING", 32))
+        )
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="draw"
+        )
+        self.in_flight: dict[Hashable, Future] = {}
+        self.waiters: dict[Future, int] = {}  # callers of run() waiting for it
+        self.pending: int = 0
+        self.stats: DrawExecutorStats = DrawExecutorStats()
+        self.lock: RLock = RLock()
+
+    async def run(self, key: Optional[Hashable], fn: Callable, *args: Any) -> Any:
+        """Return the result of fn(*args), computed in the draw threads.
+
+        Calls with the same key (if not None) that overlap in time are
+        computed only once. Cancelling one of them (like when its client
+        disconnects) does not cancel the computation for the others, and
+        it is only cancelled (if it did not start yet) when nobody waits.
+        """
+        with self.lock:
+            future: Future = self.submit(key, fn, *args)
+            self.waiters[future] = self.waiters.get(future, 0) + 1
+        try:
+            # Shielded, since cancelling the wrapper would cancel the future.
+            return await asyncio.shield(asyncio.wrap_future(future))
+        finally:
+            with self.lock:
+                self.waiters[future] -= 1
+                if self.waiters[future] == 0:
+                    del self.waiters[future]
+                    future.cancel()  # does nothing if it is running or done
+
+    def submit(self, key: Optional[Hashable], fn: Callable, *args: Any) -> Future:
+        """Return the future of fn(*args), computed in the draw threads.
+
+        Like run(), but it does not wait for the result. Raise an
+        HTTPException with status 503 if too many draws are pending.
+        """
+        with self.lock:
+            future: Optional[Future] = (
+                self.in_flight.get(key) if key is not None else None
+            )
+            if future is not None:
+                self.stats.coalesced += 1
+            else:
+                if self.pending >= self.max_pending:
+                    self.stats.rejected += 1
+                    raise HTTPException(
+                        status_code=503,
+                        detail="Too many trees being drawn. Try again later.",
+                        headers={"Retry-After": "1"},
+                    )
+                self.pending += 1
+                self.stats.submitted += 1
+                future = self.executor.submit(fn, *args)
+                if key is not None:
+                    self.in_flight[key] = future
+                future.add_done_callback(lambda _: self.done(key))
+
+        return future
+
+    def done(self, key: Optional[Hashable]) -> None:
+        with self.lock:
+            self.pending -= 1
+            if key is not None:
+                self.in_flight.pop(key, None)
+
+    def get_stats(self) -> dict[str, int]:
+        with self.lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "pending": self.pending,
+                "submitted": self.stats.submitted,
+                "coalesced": self.stats.coalesced,
+                "rejected": self.stats.rejected,
+            }
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+import json
+import os
+from dataclasses import dataclass
+from typing import Any
+from typing import Hashable
+from typing import Optional
+
+from utils.bounded_lru_cache import BoundedLRUCache
+
+# Draw arguments with numeric values, normalized so "1", "1.0" and "1.00"
+# are the same key.
+NUMERIC_DRAW_ARGS: frozenset[str] = frozenset(
+    ["x", "y", "w", "h", "panel", "zx", "zy", "za", "min_size", "rmin", "amin", "amax"]
+)
+
+# Draw arguments with a json list as value, where the order does not matter.
+LIST_DRAW_ARGS: frozenset[str] = frozenset(["layouts", "collapsed_ids"])
+
+
+@dataclass
+class DrawResponse:
+    content: bytes
+    content_encoding: Optional[str] = None
+    media_type: str = "application/json"
+
+
+def normalize_draw_args(args: dict[str, str]) -> tuple[tuple[str, Any], ...]:
+    """Return a hashable version of the draw arguments, in a canonical form."""
+    normalized: list[tuple[str, Any]] = []
+    for key, value in args.items():
+        normalized_value: Any = value
+        if key in NUMERIC_DRAW_ARGS:
+            try:
+                normalized_value = float(value)
+            except ValueError:
+                pass
+        elif key in LIST_DRAW_ARGS:
+            try:
+                values: Any = json.loads(value)
+                if isinstance(values, list):
+                    normalized_value = tuple(sorted(str(v) for v in values))
+            except ValueError:
+                pass
+        normalized.append((key, normalized_value))
+    return tuple(sorted(normalized))
+
+
+class DrawResponseCache(BoundedLRUCache[DrawResponse]):
+    """LRU cache of the (already encoded and compressed) draw responses.
+
+    Keys must include the version of the tree, so responses of a tree
+    that was modified afterwards are never returned (and are eventually
+    evicted).
+    """
+
+    def __init__(
+        self, max_entries: Optional[int] = None, max_bytes: Optional[int] = None
+    ) -> None:
+        super().__init__(
+            lambda response: len(response.content),
+            (
+                max_entries
+                if max_entries is not None
+                else int(os.environ.get("DRAW_CACHE_MAX_ENTRIES", 2048))
+            ),
+            (
+                max_bytes
+                if max_bytes is not None
+                else int(os.environ.get("DRAW_CACHE_MAX_BYTES", 256 * 1024**2))
+            ),
+        )
+
+    @staticmethod
+    def make_key(
+        tid: int, version: int, args: dict[str, str], compress: bool
+    ) -> tuple[Hashable, ...]:
+        return (tid, version, compress, normalize_draw_args(args))
+
+    def invalidate(self, tid: int) -> None:
+        """Remove all the responses of the given tree."""
+        self.remove(lambda key: key[0] == tid)  # type: ignore
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+"""
+Searches of nodes with python expressions (the "/e" command).
+
+An expression like "is_leaf and dist > 0.1" is compiled and checked once.
+Then it is evaluated either node by node, or, for the common comparison
+and boolean forms over numeric values, all at once with numpy over the
+columns of values (dist, support, size, numeric props...) of the nodes.
+
+Both ways give the same results. Wherever the columns cannot tell what
+python would do (like with a missing dist, that python cannot compare
+with a number), the search falls back to evaluating node by node, so
+even the errors are the same.
+"""
+import ast
+import operator
+import re
+from math import pi
+from types import CodeType
+from typing import Any
+from typing import Callable
+from typing import Optional
+
+import numpy as np
+from ete4 import Tree  # type: ignore
+from fastapi import HTTPException
+
+# Values of the node that can be used in the expressions.
+EVAL_NODE_VALUES: dict[str, Callable[[Tree], Any]] = {
+    "node": lambda node: node,
+    "parent": lambda node: node.up,
+    "up": lambda node: node.up,
+    "name": lambda node: node.name,
+    "is_leaf": lambda node: node.is_leaf,
+    "length": lambda node: node.dist,
+    "dist": lambda node: node.dist,
+    "d": lambda node: node.dist,
+    "support": lambda node: node.support,
+    "props": lambda node: node.props,
+    "p": lambda node: node.props,
+    "children": lambda node: node.children,
+    "ch": lambda node: node.children,
+    "size": lambda node: node.size,
+    "dx": lambda node: node.size[0],
+    "dy": lambda node: node.size[1],
+}
+
+# Functions and constants that can be used in the expressions.
+EVAL_FUNCTIONS: dict[str, Any] = {
+    "get": dict.get,
+    "regex": re.search,
+    "startswith": str.startswith,
+    "endswith": str.endswith,
+    "upper": str.upper,
+    "lower": str.lower,
+    "split": str.split,
+    "any": any,
+    "all": all,
+    "len": len,
+    "sum": sum,
+    "abs": abs,
+    "float": float,
+    "pi": pi,
+}
+
+COMPARISONS: dict[type, Callable] = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+}
+
+ARITHMETIC: dict[type, Callable] = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+}
+
+
+class NotVectorizable(Exception):
+    pass
+
+
+# A column with a value for each node, and a mask of the nodes where the
+# value may not be what python gives (so it must be evaluated in python).
+Column = tuple[np.ndarray, np.ndarray]
+
+
+class Columns:
+    """Columns of values of the given nodes, made when first needed."""
+
+    def __init__(self, nodes: list[Tree]) -> None:
+        self.nodes: list[Tree] = nodes
+        self.cache: dict[Any, Column] = {}
+
+    def no_errors(self) -> np.ndarray:
+        return np.zeros(len(self.nodes), dtype=bool)
+
+    def values(self, key: Any, get_value: Callable[[Tree], Any]) -> Column:
+        """Return the numeric values and where they are None (missing)."""
+        if key not in self.cache:
+            values: list[Any] = [get_value(node) for node in self.nodes]
+            missing: np.ndarray = np.fromiter(
+                (value is None for value in values), dtype=bool, count=len(values)
+            )
+            if any(
+                type(value) not in (int, float, bool)
+                for value in values
+                if value is not None
+            ):
+                raise NotVectorizable("not numeric values")
+            self.cache[key] = (
+                np.array(
+                    [np.nan if value is None else value for value in values],
+                    dtype=float,
+                ),
+                missing,
+            )
+        return self.cache[key]
+
+
+class EvalSearch:
+    """Node predicate for an expression, compiled and validated only once."""
+
+    def __init__(self, expression: str) -> None:
+        try:
+            self.code: CodeType = compile(expression, "<string>", "eval")
+        except SyntaxError as e:
+            raise HTTPException(status_code=400, detail=f"compiling expression: {e}")
+
+        for name in self.code.co_names:
+            if name not in EVAL_NODE_VALUES and name not in EVAL_FUNCTIONS:
+                raise HTTPException(
+                    status_code=400,
+                    detail="invalid use of %r during evaluation" % name,
+                )
+
+        # Only the values of the node that the expression uses are computed.
+        self.node_values: list[tuple[str, Callable[[Tree], Any]]] = [
+            (name, EVAL_NODE_VALUES[name])
+            for name in self.code.co_names
+            if name in EVAL_NODE_VALUES
+        ]
+
+        self.columnar: Optional[Callable[[Columns], Column]]
+        try:
+            self.columnar = compile_columnar(ast.parse(expression, mode="eval").body)
+        except NotVectorizable:
+            self.columnar = None
+
+    def __call__(self, node: Tree) -> Any:
+        context: dict[str, Any] = dict(EVAL_FUNCTIONS)
+        for name, get_value in self.node_values:
+            context[name] = get_value(node)
+        return eval(self.code, {"__builtins__": {}}, context)
+
+    def search(self, nodes: list[Tree]) -> list[Tree]:
+        """Return the given nodes for which the expression is true."""
+        if self.columnar is not None and nodes:
+            try:
+                values, errors = self.columnar(Columns(nodes))
+                if not errors.any():
+                    matches: np.ndarray = truth(values)
+                    return [nodes[i] for i in np.flatnonzero(matches)]
+            except NotVectorizable:
+                pass  # like props with text values
+
+        return [node for node in nodes if self(node)]
+
+
+def truth(values: np.ndarray) -> np.ndarray:
+    """Return the truth value of each value, like bool() would."""
+    return values if values.dtype == bool else values != 0
+
+
+def compile_columnar(expr: ast.expr) -> Callable[[Columns], Column]:
+    """Return a function that evaluates the expression over columns.
+
+    Raise NotVectorizable for expressions that it cannot handle.
+    """
+    if isinstance(expr, ast.Constant):
+        value: Any = expr.value
+        if not isinstance(value, (int, float)):  # bool is an int too
+            raise NotVectorizable("not a numeric constant")
+        constant: float = float(value)
+        return lambda columns: (
+            np.full(len(columns.nodes), constant),
+            columns.no_errors(),
+        )
+
+    elif isinstance(expr, ast.Name):
+        return compile_columnar_name(expr.id)
+
+    elif isinstance(expr, ast.Subscript):
+        return compile_columnar_subscript(expr)
+
+    elif isinstance(expr, ast.Call):
+        return compile_columnar_call(expr)
+
+    elif isinstance(expr, ast.UnaryOp):
+        if isinstance(expr.op, ast.Not):
+            operand: Callable[[Columns], Column] = compile_columnar(expr.operand)
+            return lambda columns: negate(operand(columns))
+        elif isinstance(expr.op, ast.USub):
+            number: Callable[[Columns], Column] = compile_numeric(expr.operand)
+            return lambda columns: numeric_op(operator.neg, number(columns))
+        raise NotVectorizable("unsupported unary operator")
+
+    elif isinstance(expr, ast.BinOp):
+        if type(expr.op) not in ARITHMETIC:
+            raise NotVectorizable("unsupported binary operator")
+        op: Callable = ARITHMETIC[type(expr.op)]
+        left: Callable[[Columns], Column] = compile_numeric(expr.left)
+        right: Callable[[Columns], Column] = compile_numeric(expr.right)
+        return lambda columns: numeric_op(op, left(columns), right(columns))
+
+    elif isinstance(expr, ast.BoolOp):
+        operands: list[Callable[[Columns], Column]] = [
+            compile_columnar(value) for value in expr.values
+        ]
+        is_and: bool = isinstance(expr.op, ast.And)
+        return lambda columns: bool_op(is_and, [f(columns) for f in operands])
+
+    elif isinstance(expr, ast.Compare):
+        return compile_columnar_compare(expr)
+
+    raise NotVectorizable(f"unsupported expression {type(expr).__name__}")
+
+
+def compile_numeric(expr: ast.expr) -> Callable[[Columns], Column]:
+    """Return a function that evaluates the expression as numbers."""
+    if isinstance(expr, ast.BoolOp):
+        # In python "a or b" gives a or b (not True or False), which we
+        # do not follow in the columns.
+        raise NotVectorizable("boolean operation used as a number")
+
+    compiled: Callable[[Columns], Column] = compile_columnar(expr)
+
+    def numeric(columns: Columns) -> Column:
+        values, errors = compiled(columns)
+        return values.astype(float), errors
+
+    return numeric
+
+
+# Names with a numeric value for each node: name -> (column key, getter).
+COLUMNAR_NAMES: dict[str, tuple[Any, Callable[[Tree], Any]]] = {
+    "is_leaf": ("is_leaf", lambda node: node.is_leaf),
+    "dist": ("dist", lambda node: node.dist),
+    "d": ("dist", lambda node: node.dist),
+    "length": ("dist", lambda node: node.dist),
+    "support": ("support", lambda node: node.support),
+    "dx": (("size", 0), lambda node: node.size[0]),
+    "dy": (("size", 1), lambda node: node.size[1]),
+}
+
+
+def compile_columnar_name(name: str) -> Callable[[Columns], Column]:
+    if name in COLUMNAR_NAMES:
+        key, get_value = COLUMNAR_NAMES[name]
+        return lambda columns: columns.values(key, get_value)
+    elif name == "pi":
+        return lambda columns: (np.full(len(columns.nodes), pi), columns.no_errors())
+    raise NotVectorizable(f"unsupported name {name}")
+
+
+def compile_columnar_subscript(expr: ast.Subscript) -> Callable[[Columns], Column]:
+    # size[0], size[1], p["prop"], props["prop"]
+    if not isinstance(expr.value, ast.Name) or not isinstance(
+        expr.slice, ast.Constant
+    ):
+        raise NotVectorizable("unsupported subscript")
+
+    name: str = expr.value.id
+    key: Any = expr.slice.value
+    if name == "size" and key in [0, 1]:
+        return lambda columns: columns.values(
+            ("size", key), lambda node: node.size[key]
+        )
+    elif name in ["p", "props"] and type(key) == str:
+        # Python raises KeyError for missing props, and they are missing
+        # values here, so they are evaluated in python too.
+        return lambda columns: columns.values(
+            ("props", key), lambda node: node.props.get(key)
+        )
+    raise NotVectorizable("unsupported subscript")
+
+
+def compile_columnar_call(expr: ast.Call) -> Callable[[Columns], Column]:
+    if not isinstance(expr.func, ast.Name) or expr.keywords:
+        raise NotVectorizable("unsupported call")
+
+    function: str = expr.func.id
+    if function == "abs" and len(expr.args) == 1:
+        operand: Callable[[Columns], Column] = compile_numeric(expr.args[0])
+        return lambda columns: numeric_op(np.abs, operand(columns))
+
+    elif function == "get" and len(expr.args) in [2, 3]:
+        # get(p, "prop") or get(p, "prop", default)
+        mapping, key, *default_arg = expr.args
+        if (
+            not isinstance(mapping, ast.Name)
+            or mapping.id not in ["p", "props"]
+            or not isinstance(key, ast.Constant)
+            or type(key.value) != str
+        ):
+            raise NotVectorizable("unsupported call to get")
+        prop: str = key.value
+        default: Any = None
+        if default_arg:
+            if not isinstance(default_arg[0], ast.Constant):
+                raise NotVectorizable("unsupported default value")
+            default = default_arg[0].value
+            if default is not None and type(default) not in (int, float, bool):
+                raise NotVectorizable("not a numeric default value")
+        return lambda columns: columns.values(
+            ("props", prop, default), lambda node: node.props.get(prop, default)
+        )
+
+    raise NotVectorizable("unsupported call")
+
+
+def compile_columnar_compare(expr: ast.Compare) -> Callable[[Columns], Column]:
+    # "x is None" and "x is not None"
+    if len(expr.ops) == 1 and isinstance(expr.ops[0], (ast.Is, ast.IsNot)):
+        comparator: ast.expr = expr.comparators[0]
+        if not isinstance(comparator, ast.Constant) or comparator.value is not None:
+            raise NotVectorizable("unsupported use of 'is'")
+        if not isinstance(expr.left, ast.Name) or expr.left.id not in COLUMNAR_NAMES:
+            raise NotVectorizable("unsupported use of 'is'")
+        key, get_value = COLUMNAR_NAMES[expr.left.id]
+        is_not: bool = isinstance(expr.ops[0], ast.IsNot)
+        return lambda columns: is_none(columns.values(key, get_value), is_not)
+
+    if any(type(op) not in COMPARISONS for op in expr.ops):
+        raise NotVectorizable("unsupported comparison")
+
+    ops: list[Callable] = [COMPARISONS[type(op)] for op in expr.ops]
+    operands: list[Callable[[Columns], Column]] = [
+        compile_numeric(e) for e in [expr.left] + expr.comparators
+    ]
+
+    def compare(columns: Columns) -> Column:
+        # a < b < c  ->  a < b and b < c  (and c is not evaluated if a >= b)
+        left: Column = operands[0](columns)
+        result: Optional[Column] = None
+        for op, operand in zip(ops, operands[1:]):
+            right: Column = operand(columns)
+            step: Column = numeric_op(op, left, right)
+            result = step if result is None else bool_op(True, [result, step])
+            left = right
+        return result  # type: ignore
+
+    return compare
+
+
+def is_none(column: Column, is_not: bool) -> Column:
+    _, missing = column
+    return (~missing if is_not else missing), np.zeros_like(missing)
+
+
+def negate(column: Column) -> Column:
+    values, errors = column
+    return ~truth(values), errors
+
+
+def numeric_op(op: Callable, *operands: Column) -> Column:
+    errors: np.ndarray = operands[0][1].copy()
+    for _, operand_errors in operands[1:]:
+        errors |= operand_errors
+    with np.errstate(invalid="ignore", over="ignore"):
+        values: np.ndarray = op(*(values for values, _ in operands))
+    return values, errors
+
+
+def bool_op(is_and: bool, operands: list[Column]) -> Column:
+    """Return the result of "and" or "or" with all the operands.
+
+    Like in python, an operand is not evaluated (and so cannot make an
+    error) if the result is already decided by the previous ones.
+    """
+    values, errors = operands[0]
+    result: np.ndarray = truth(values)
+    errors = errors.copy()
+    for values, operand_errors in operands[1:]:
+        evaluated: np.ndarray = result if is_and else ~result
+        errors |= evaluated & operand_errors
+        result = (result & truth(values)) if is_and else (result | truth(values))
+    return result, errors
@@ -1,9 +1,30 @@
 #!/usr/bin/env python3
 import os
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from threading import Lock
+from typing import Any
+from typing import Callable
 from typing import Generator
+from typing import Iterator
+from typing import Optional
 
 import mariadb  # type: ignore
 
+# Connections kept open to run queries at the same time (see fetch_concurrently).
+DB_POOL_SIZE: int = int(os.environ.get("DB_POOL_SIZE", 8))
+CONNECTION_POOL: Optional[mariadb.ConnectionPool] = None
+CONNECTION_POOL_LOCK: Lock = Lock()
+# Threads running the fetches of all the requests. There are more than
+# pooled connections, so when the pool runs out the fetches open their own
+# connections (see get_pooled_mariadb_connection), and only beyond that
+# many fetches at once do they wait in the queue of the executor.
+DB_FETCH_WORKERS: int = int(os.environ.get("DB_FETCH_WORKERS", 4 * DB_POOL_SIZE))
+DB_FETCH_EXECUTOR: ThreadPoolExecutor = ThreadPoolExecutor(
+    max_workers=DB_FETCH_WORKERS, thread_name_prefix="db-fetch"
+)
+
 
 class MariadbSession:
     @staticmethod
@@ -29,3 +50,62 @@ def get_single_mariadb_connection() -> mariadb.Connection:
         database=os.environ["DB_DATABASE"],
         password=os.environ["DB_PASS"],
     )
+
+
+def get_connection_pool() -> mariadb.ConnectionPool:
+    """Return the pool of connections, creating it the first time."""
+    global CONNECTION_POOL
+    with CONNECTION_POOL_LOCK:
+        if CONNECTION_POOL is None:
+            CONNECTION_POOL = mariadb.ConnectionPool(
+                pool_name="phylo-data-services",
+                pool_size=DB_POOL_SIZE,
+                host=os.environ["DB_HOST"],
+                port=int(os.environ["DB_PORT"]),
+                user=os.environ["DB_USER"],
+                database=os.environ["DB_DATABASE"],
+                password=os.environ["DB_PASS"],
+            )
+        return CONNECTION_POOL
+
+
+@contextmanager
+def get_pooled_mariadb_connection() -> Iterator[mariadb.Connection]:
+    """Yield a connection of the pool, and give it back to it afterwards.
+
+    If all the connections of the pool are in use, a new one is opened
+    (and closed afterwards) instead of waiting.
+    """
+    connection: Optional[mariadb.Connection]
+    try:
+        connection = get_connection_pool().get_connection()
+    except mariadb.PoolError:
+        connection = None
+    if connection is None:
+        connection = get_single_mariadb_connection()
+    try:
+        yield connection
+    finally:
+        connection.close()  # a connection of the pool goes back to it
+
+
+def fetch_concurrently(
+    connection: mariadb.Connection, *fetches: Callable[[mariadb.Connection], Any]
+) -> list[Any]:
+    """Return the results of the fetches, run at the same time.
+
+    Every fetch is a function that queries the connection it is given.
+    The first one runs on the given connection and the rest on
+    connections of the pool, so the time is the one of the slowest.
+    They must consume their cursors, since their connections are given
+    back to the pool as soon as they return.
+    """
+    def fetch_pooled(fetch: Callable[[mariadb.Connection], Any]) -> Any:
+        with get_pooled_mariadb_connection() as pooled_connection:
+            return fetch(pooled_connection)
+
+    futures: list[Future] = [
+        DB_FETCH_EXECUTOR.submit(fetch_pooled, fetch) for fetch in fetches[1:]
+    ]
+    results: list[Any] = [fetches[0](connection)] if fetches else []
+    return results + [future.result() for future in futures]
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+import re
+from bisect import bisect_left
+from bisect import bisect_right
+from typing import Iterable
+from typing import Optional
+
+from ete4 import Tree  # type: ignore
+
+# Goes between the names in the joined buffers. Searched texts containing
+# it are checked name by name instead.
+NAME_SEPARATOR: str = "\0"
+
+REGEX_SPECIAL_CHARS: frozenset[str] = frozenset(".^$*+?{}[]\\|()")
+REGEX_OPTIONAL_CHARS: frozenset[str] = frozenset("*?{")
+
+
+class NodeSearchIndex:
+    """Index of the node names of a tree, to search them without traversing it.
+
+    The names are kept in preorder and joined in a single string (and in
+    a lowercased one), so searching a text is a few calls to str.find().
+    They are also kept sorted, so a regular expression anchored at the
+    start (like "^Phy000") only has to check the names with its prefix.
+
+    The index keeps references to the nodes, so it must be rebuilt when
+    the tree changes its topology or names.
+    """
+
+    def __init__(self, tree: Tree) -> None:
+        self.nodes: list[Tree] = []
+        self.names: list[str] = []
+        self.positions: dict[int, int] = {}  # id(node) -> position in preorder
+        parents: list[int] = []
+        for position, node in enumerate(tree.traverse("preorder")):
+            self.positions[id(node)] = position
+            parents.append(self.positions[id(node.up)] if position > 0 else -1)
+            self.nodes.append(node)
+            self.names.append(str(node.props.get("name", "")))
+
+        # Descendants of the node at position i are in [i + 1, ends[i]).
+        self.ends: list[int] = list(range(1, len(self.nodes) + 1))
+        for position in range(len(self.nodes) - 1, 0, -1):
+            parent: int = parents[position]
+            self.ends[parent] = max(self.ends[parent], self.ends[position])
+
+        self.buffer: str
+        self.starts: list[int]
+        self.buffer, self.starts = join_names(self.names)
+        self.lower_names: list[str] = [name.lower() for name in self.names]
+        self.lower_buffer: str
+        self.lower_starts: list[int]
+        self.lower_buffer, self.lower_starts = join_names(self.lower_names)
+
+        self.sorted_names: Optional[list[str]] = None  # built when needed
+        self.sorted_positions: Optional[list[int]] = None
+
+    def search_text(self, text: str, ignore_case: bool = False) -> list[int]:
+        """Return the positions of the nodes with the given text in their names."""
+        names: list[str] = self.lower_names if ignore_case else self.names
+        if not text:
+            return list(range(len(names)))
+        if NAME_SEPARATOR in text:
+            return [i for i, name in enumerate(names) if text in name]
+
+        buffer: str = self.lower_buffer if ignore_case else self.buffer
+        starts: list[int] = self.lower_starts if ignore_case else self.starts
+
+        positions: list[int] = []
+        offset: int = buffer.find(text)
+        while offset != -1:
+            position: int = bisect_right(starts, offset) - 1
+            positions.append(position)
+            if position + 1 == len(starts):
+                break
+            offset = buffer.find(text, starts[position + 1])  # next name on
+        return positions
+
+    def search_regex(self, pattern: str) -> list[int]:
+        """Return the positions of the nodes with names matching the pattern."""
+        regex: re.Pattern = re.compile(pattern)  # once, not for every node
+
+        prefix: str = get_literal_prefix(pattern)
+        if not prefix:
+            return [i for i, name in enumerate(self.names) if regex.search(name)]
+
+        if self.sorted_names is None or self.sorted_positions is None:
+            order: list[int] = sorted(
+                range(len(self.names)), key=self.names.__getitem__
+            )
+            self.sorted_names = [self.names[i] for i in order]
+            self.sorted_positions = order
+
+        positions: list[int] = []
+        i: int = bisect_left(self.sorted_names, prefix)
+        while i < len(self.sorted_names) and self.sorted_names[i].startswith(prefix):
+            if regex.search(self.sorted_names[i]):
+                positions.append(self.sorted_positions[i])
+            i += 1
+        return positions
+
+    def get_subtree_nodes(self, tree: Tree) -> list[Tree]:
+        """Return all the nodes of the (sub)tree, in preorder."""
+        start: int = self.positions[id(tree)]
+        return self.nodes[start : self.ends[start]]
+
+    def get_nodes(self, positions: Iterable[int], tree: Tree) -> list[Tree]:
+        """Return the nodes at the given positions that are in the (sub)tree."""
+        start: int = self.positions[id(tree)]
+        end: int = self.ends[start]
+        return [self.nodes[i] for i in positions if start <= i < end]
+
+
+def join_names(names: list[str]) -> tuple[str, list[int]]:
+    """Return the names joined by the separator, and where each one starts."""
+    starts: list[int] = []
+    offset: int = 0
+    for name in names:
+        starts.append(offset)
+        offset += len(name) + len(NAME_SEPARATOR)
+    return NAME_SEPARATOR.join(names), starts
+
+
+def get_literal_prefix(pattern: str) -> str:
+    """Return the text that all the names matching the pattern start with.
+
+    Only patterns anchored with "^" (and without alternatives) have one,
+    like "^Phy00" or "^Phy00.*_9606", which both give "Phy00".
+    """
+    if not pattern.startswith("^") or "|" in pattern:
+        return ""
+
+    prefix: str = ""
+    for char in pattern[1:]:
+        if char in REGEX_SPECIAL_CHARS:
+            if char in REGEX_OPTIONAL_CHARS:
+                prefix = prefix[:-1]  # the last char may not be there
+            break
+        prefix += char
+    return prefix
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+from bisect import bisect_left
+from collections import OrderedDict
+from dataclasses import dataclass
+from dataclasses import field
+from threading import Lock
+from typing import Any
+from typing import Callable
+from typing import Hashable
+from typing import Optional
+
+import numpy as np
+from ete4 import Tree  # type: ignore
+
+
+@dataclass
+class PropertyColumn:
+    """Values of a property for all the nodes (in preorder) that have it."""
+
+    positions: np.ndarray  # preorder positions of the nodes with the property
+    values: np.ndarray  # as floats (nan if not a number)
+    leaves: np.ndarray  # True for the values of leaves
+    # Positions of the leaves with values that are not numbers, and why.
+    invalid_positions: list[int] = field(default_factory=list)
+    invalid_errors: list[str] = field(default_factory=list)
+
+
+class PropertyCatalog:
+    """Catalog of the properties of the nodes of a tree, built in one pass.
+
+    For every property it keeps which nodes have it and their values as
+    a numpy array, so the statistics of a property in any subtree are
+    computed without traversing it. The nodes are referred to by their
+    preorder position, as in the search index, and a subtree is the
+    range of positions [start, end).
+
+    The names of the properties are the ones of all the nodes, but the
+    statistics are (as they always were) only about the leaves.
+
+    The most recent results are cached too, so the catalog must be dropped
+    when the properties or the topology of the tree change.
+    """
+
+    max_results: int = 256  # cached stats, percentiles and histograms
+
+    def __init__(self, nodes: list[Tree]) -> None:
+        positions: dict[str, list[int]] = {}
+        values: dict[str, list[float]] = {}
+        leaves: dict[str, list[bool]] = {}
+        columns: dict[str, PropertyColumn] = {}
+        for position, node in enumerate(nodes):
+            is_leaf: bool = node.is_leaf
+            for pname, value in node.props.items():
+                if pname not in columns:
+                    columns[pname] = PropertyColumn(
+                        np.empty(0), np.empty(0), np.empty(0, dtype=bool)
+                    )
+                    positions[pname] = []
+                    values[pname] = []
+                    leaves[pname] = []
+                column: PropertyColumn = columns[pname]
+                try:
+                    number: float = float(value)
+                except (ValueError, TypeError) as e:
+                    if is_leaf:
+                        column.invalid_positions.append(position)
+                        column.invalid_errors.append(str(e))
+                    number = np.nan
+                positions[pname].append(position)
+                values[pname].append(number)
+                leaves[pname].append(is_leaf)
+
+        for pname, column in columns.items():
+            column.positions = np.array(positions[pname], dtype=np.int64)
+            column.values = np.array(values[pname], dtype=np.float64)
+            column.leaves = np.array(leaves[pname], dtype=bool)
+
+        self.columns: dict[str, PropertyColumn] = columns
+        # Cached stats and histograms, the least recently used first.
+        self.results: OrderedDict[Hashable, Any] = OrderedDict()
+        self.results_lock: Lock = Lock()  # several readers may use them at once
+
+    def get_names(self, start: int, end: int) -> list[str]:
+        """Return the names of the properties of the nodes in [start, end)."""
+        names: list[str] = []
+        for pname, column in self.columns.items():
+            first, last = self.get_bounds(column, start, end)
+            if first < last:
+                names.append(pname)
+        return names
+
+    def get_values(self, pname: str, start: int, end: int) -> np.ndarray:
+        """Return the numeric values of a property for the leaves in [start, end).
+
+        Raise ValueError if some of them is not a number, or if no leaf
+        has the property.
+        """
+        column: Optional[PropertyColumn] = self.columns.get(pname)
+        if column is None:
+            raise ValueError("no node has the given property")
+
+        i: int = bisect_left(column.invalid_positions, start)
+        if i < len(column.invalid_positions) and column.invalid_positions[i] < end:
+            raise ValueError(column.invalid_errors[i])
+
+        first: int
+        last: int
+        first, last = self.get_bounds(column, start, end)
+        values: np.ndarray = column.values[first:last][column.leaves[first:last]]
+        if len(values) == 0:
+            raise ValueError("no node has the given property")
+        return values
+
+    def get_result(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """Return the cached result with the given key, computing it if needed."""
+        with self.results_lock:
+            if key in self.results:
+                self.results.move_to_end(key)
+                return self.results[key]
+
+        result: Any = compute()
+
+        with self.results_lock:
+            self.results[key] = result
+            while len(self.results) > self.max_results:
+                self.results.popitem(last=False)
+        return result
+
+    def get_stats(self, pname: str, start: int, end: int) -> dict[str, float]:
+        """Return the number, min, max, mean and variance of a property."""
+
+        def compute() -> dict[str, float]:
+            values: np.ndarray = self.get_values(pname, start, end)
+            return {
+                "n": len(values),
+                "min": float(values.min()),
+                "max": float(values.max()),
+                "mean": float(values.mean()),
+                "var": float(values.var()),
+            }
+
+        return self.get_result(("stats", pname, start, end), compute)
+
+    def get_percentiles(
+        self, pname: str, start: int, end: int, qs: tuple[float, ...]
+    ) -> dict[str, float]:
+        """Return the given percentiles (from 0 to 100) of a property."""
+
+        def compute() -> dict[str, float]:
+            values: np.ndarray = self.get_values(pname, start, end)
+            percentiles: np.ndarray = np.percentile(values, qs)
+            return {f"{q:g}": float(p) for q, p in zip(qs, percentiles)}
+
+        return self.get_result(("percentiles", pname, start, end, qs), compute)
+
+    def get_histogram(
+        self, pname: str, start: int, end: int, bins: int
+    ) -> dict[str, list]:
+        """Return the counts of a property in bins of equal width, and their edges."""
+
+        def compute() -> dict[str, list]:
+            values: np.ndarray = self.get_values(pname, start, end)
+            counts: np.ndarray
+            edges: np.ndarray
+            counts, edges = np.histogram(values, bins=bins)
+            return {"counts": counts.tolist(), "edges": edges.tolist()}
+
+        return self.get_result(("histogram", pname, start, end, bins), compute)
+
+    @staticmethod
+    def get_bounds(column: PropertyColumn, start: int, end: int) -> tuple[int, int]:
+        """Return where the positions in [start, end) are in the column."""
+        bounds: np.ndarray = np.searchsorted(column.positions, [start, end])
+        return int(bounds[0]), int(bounds[1])
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+from contextlib import contextmanager
+from threading import Condition
+from threading import get_ident
+from typing import Iterator
+from typing import Optional
+
+
+class ReadWriteLock:
+    """Lock that can be held by many readers, or by a single writer.
+
+    Writers have preference: once a writer is waiting, new readers wait
+    too, so a steady flow of draws cannot starve an edit of the tree.
+
+    The lock can be taken again by the thread holding it (the writer for
+    reading or writing, a reader for reading), so functions that use the
+    tree can call each other. A reader cannot upgrade to a writer: that
+    would deadlock, so it raises a RuntimeError instead.
+    """
+
+    def __init__(self) -> None:
+        self.condition: Condition = Condition()
+        self.readers: dict[int, int] = {}  # thread -> times holding it
+        self.writer: Optional[int] = None  # thread holding the write lock
+        self.writer_depth: int = 0
+        self.waiting_writers: int = 0
+
+    @contextmanager
+    def read(self) -> Iterator[None]:
+        thread: int = get_ident()
+        if self.writer == thread:  # already holding it for writing
+            yield
+            return
+
+        with self.condition:
+            if thread not in self.readers:  # else it is already reading
+                while self.writer is not None or self.waiting_writers > 0:
+                    self.condition.wait()
+            self.readers[thread] = self.readers.get(thread, 0) + 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.readers[thread] -= 1
+                if self.readers[thread] == 0:
+                    del self.readers[thread]
+                    if not self.readers:
+                        self.condition.notify_all()
+
+    @contextmanager
+    def write(self) -> Iterator[None]:
+        thread: int = get_ident()
+        with self.condition:
+            if self.writer != thread:
+                if thread in self.readers:
+                    raise RuntimeError("cannot write while holding the lock to read")
+                self.waiting_writers += 1
+                try:
+                    while self.writer is not None or self.readers:
+                        self.condition.wait()
+                finally:
+                    self.waiting_writers -= 1
+                self.writer = thread
+            self.writer_depth += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.writer_depth -= 1
+                if self.writer_depth == 0:
+                    self.writer = None
+                    self.condition.notify_all()
+
+    def in_use(self) -> bool:
+        """Return True if the lock is held or waited for."""
+        with self.condition:
+            return bool(self.readers) or self.writer is not None or self.waiting_writers > 0
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Compact binary snapshots of the trees kept in the tree store.
+
+A snapshot is a header followed by a list of sections:
+
+    magic (8 bytes) | version (u16) | number of sections (u16) | crc32 (u32)
+    length of each section (u64 each)
+    sections...
+
+The sections are columns over the nodes in preorder (parent index,
+branch length, support, name, other props), plus the metadata of the
+tree (its name, layouts, tooltip data...) and a small summary of it (its
+name) that can be read alone. The checksum covers all the sections, so
+a truncated or corrupted file is detected before decoding.
+"""
+import _pickle as pickle  # type: ignore
+import gc
+import json
+import struct
+import zlib
+from array import array
+from math import isnan
+from math import nan
+from typing import Any
+from typing import Optional
+
+from ete4 import Tree  # type: ignore
+
+SNAPSHOT_MAGIC: bytes = b"PHYSNAP\0"
+SNAPSHOT_VERSION: int = 2
+# Versions that can be read. Version 1 had no summary section.
+SNAPSHOT_READABLE_VERSIONS: tuple[int, ...] = (1, 2)
+
+_HEADER: struct.Struct = struct.Struct("<8sHHI")
+_SECTION_LENGTH: struct.Struct = struct.Struct("<Q")
+
+# Props stored in their own columns. The rest go to the "extra" section.
+_COLUMN_PROPS: tuple[str, str, str] = ("name", "dist", "support")
+
+# Encodings of the extra props section.
+_EXTRA_PROPS_JSON: bytes = b"J"
+_EXTRA_PROPS_PICKLE: bytes = b"P"
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def dumps(
+    tree: Tree,
+    metadata: dict[str, Any],
+    saved_dists: Optional[dict[Tree, Any]] = None,
+) -> bytes:
+    """Return the snapshot of the given tree and metadata.
+
+    The branch lengths of the nodes in saved_dists are saved from it instead of
+    from their props (like the ones they had before being changed).
+    """
+    parents: array = array("i")
+    dists: array = array("d")
+    supports: array = array("d")
+    names: list[str | None] = []
+    extra_props: dict[str, dict[int, Any]] = {}
+
+    index: dict[int, int] = {}  # id(node) -> position in preorder
+    for position, node in enumerate(tree.traverse("preorder")):
+        index[id(node)] = position
+        parents.append(index[id(node.up)] if position > 0 else -1)
+
+        props: dict = node.props
+        dist: float | None = (
+            saved_dists[node]
+            if saved_dists is not None and node in saved_dists
+            else props.get("dist")
+        )
+        support: float | None = props.get("support")
+        dists.append(nan if dist is None else dist)
+        supports.append(nan if support is None else support)
+        names.append(props.get("name"))
+        for key, value in props.items():
+            if key not in _COLUMN_PROPS:
+                extra_props.setdefault(key, {})[position] = value
+
+    extra: bytes
+    if all(
+        _is_json_exact(value)
+        for values in extra_props.values()
+        for value in values.values()
+    ):
+        extra = _EXTRA_PROPS_JSON + json.dumps(extra_props).encode("utf8")
+    else:  # json would not give back the same values
+        extra = _EXTRA_PROPS_PICKLE + pickle.dumps(extra_props)
+
+    sections: list[bytes] = [
+        parents.tobytes(),
+        dists.tobytes(),
+        supports.tobytes(),
+        json.dumps(names).encode("utf8"),
+        extra,
+        pickle.dumps(metadata),
+        json.dumps({"name": metadata.get("name")}).encode("utf8"),
+    ]
+
+    crc: int = 0
+    for section in sections:
+        crc = zlib.crc32(section, crc)
+
+    header: bytes = _HEADER.pack(
+        SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(sections), crc
+    ) + b"".join(_SECTION_LENGTH.pack(len(section)) for section in sections)
+
+    return header + b"".join(sections)
+
+
+def _is_json_exact(value: Any) -> bool:
+    """Return True if json gives back exactly the same value.
+
+    It would not for tuples (turned into lists), non-string keys (turned
+    into strings, except the positions of the nodes, which are converted
+    back) or anything it cannot encode at all.
+    """
+    if value is None or type(value) in (str, int, float, bool):
+        return True
+    if type(value) is list:
+        return all(_is_json_exact(item) for item in value)
+    if type(value) is dict:
+        return all(
+            type(key) is str and _is_json_exact(item) for key, item in value.items()
+        )
+    return False
+
+
+def loads(buffer: Any) -> tuple[Tree, dict[str, Any]]:
+    """Return the tree and metadata in the given snapshot.
+
+    The buffer can be any bytes-like object, like a memory-mapped file.
+    """
+    view: memoryview = memoryview(buffer)
+    try:
+        return _loads(view)
+    finally:
+        view.release()
+
+
+def read_summary(buffer: Any) -> dict[str, Any]:
+    """Return the summary (like {"name": ...}) in the given snapshot.
+
+    Only the summary is read, so it is much faster than loads(). It is
+    not verified against the checksum.
+    """
+    view: memoryview = memoryview(buffer)
+    try:
+        version: int
+        sections: list[memoryview]
+        version, _, sections = _read_sections(view)
+        if version == 1:
+            return {"name": pickle.loads(sections[5]).get("name")}
+        try:
+            return json.loads(bytes(sections[6]))
+        except ValueError as e:
+            raise SnapshotError(f"Invalid snapshot summary: {e}")
+    finally:
+        view.release()
+
+
+def _read_sections(view: memoryview) -> tuple[int, int, list[memoryview]]:
+    """Return the version, checksum and sections of the snapshot."""
+    if len(view) < _HEADER.size:
+        raise SnapshotError("Truncated snapshot header.")
+
+    magic, version, nsections, crc = _HEADER.unpack_from(view, 0)
+    if magic != SNAPSHOT_MAGIC:
+        raise SnapshotError("Not a tree snapshot.")
+    if version not in SNAPSHOT_READABLE_VERSIONS:
+        raise SnapshotError(f"Unsupported snapshot version {version}.")
+    if nsections < (6 if version == 1 else 7):
+        raise SnapshotError("Snapshot with missing sections.")
+
+    offset: int = _HEADER.size
+    if len(view) < offset + _SECTION_LENGTH.size * nsections:
+        raise SnapshotError("Truncated snapshot header.")
+    lengths: list[int] = []
+    for _ in range(nsections):
+        (length,) = _SECTION_LENGTH.unpack_from(view, offset)
+        lengths.append(length)
+        offset += _SECTION_LENGTH.size
+
+    if offset + sum(lengths) != len(view):
+        raise SnapshotError("Truncated snapshot.")
+
+    sections: list[memoryview] = []
+    for length in lengths:
+        sections.append(view[offset : offset + length])
+        offset += length
+
+    return version, crc, sections
+
+
+def _loads(view: memoryview) -> tuple[Tree, dict[str, Any]]:
+    crc: int
+    sections: list[memoryview]
+    _, crc, sections = _read_sections(view)
+
+    checksum: int = 0
+    for section in sections:
+        checksum = zlib.crc32(section, checksum)
+    if checksum != crc:
+        raise SnapshotError("Snapshot checksum mismatch.")
+
+    parents: array = array("i")
+    parents.frombytes(sections[0])
+    dists: array = array("d")
+    dists.frombytes(sections[1])
+    supports: array = array("d")
+    supports.frombytes(sections[2])
+    names: list[str | None] = json.loads(bytes(sections[3]))
+
+    extra: memoryview = sections[4]
+    extra_props: dict[str, dict[Any, Any]]
+    if extra[:1] == _EXTRA_PROPS_JSON:
+        extra_props = json.loads(bytes(extra[1:]))
+        # Json object keys are strings.
+        extra_props = {
+            key: {int(position): value for position, value in values.items()}
+            for key, values in extra_props.items()
+        }
+    else:
+        extra_props = pickle.loads(extra[1:])
+
+    metadata: dict[str, Any] = pickle.loads(sections[5])
+
+    # Creating many linked nodes triggers the cyclic garbage collector
+    # again and again, which takes most of the time for big trees.
+    gc_was_enabled: bool = gc.isenabled()
+    gc.disable()
+    try:
+        nodes: list[Tree] = _build_nodes(parents, dists, supports, names)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    for key, values in extra_props.items():
+        for position, value in values.items():
+            nodes[position].props[key] = value
+
+    if not nodes:
+        raise SnapshotError("Snapshot without nodes.")
+
+    return nodes[0], metadata
+
+
+def _build_nodes(
+    parents: array, dists: array, supports: array, names: list[str | None]
+) -> list[Tree]:
+    """Return the nodes in preorder, already linked to their parents."""
+    nodes: list[Tree] = []
+    for position, parent in enumerate(parents):
+        props: dict[str, Any] = {}
+        name: str | None = names[position]
+        dist: float = dists[position]
+        support: float = supports[position]
+        if name is not None:
+            props["name"] = name
+        if not isnan(dist):
+            props["dist"] = dist
+        if not isnan(support):
+            props["support"] = support
+
+        node: Tree = Tree(props)
+        if parent >= 0:
+            node.up = nodes[parent]
+            nodes[parent]._children.append(node)
+        nodes.append(node)
+
+    return nodes
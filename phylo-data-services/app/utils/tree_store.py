@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+import mmap
+import os
+from abc import ABC
+from abc import abstractmethod
+from contextlib import contextmanager
+from itertools import count
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from threading import Lock
+from time import time
+from time import time_ns
+from typing import Hashable
+from typing import Iterator
+
+
+class TreeStore(ABC):
+    """Storage shared by all the workers, where the serialized trees live.
+
+    Every worker keeps its own in-memory GlobalTreeCache, and falls back
+    to the store when a tree is not there (because another worker added
+    it, or because it was evicted).
+
+    Besides its current version, the store can keep the tree as it was
+    originally added (with original=True), to restore it.
+
+    Every save gives the tree a new stamp, so a worker can tell if the
+    tree it has in memory was changed (and saved) by another worker.
+    """
+
+    @abstractmethod
+    def save(self, tid: int, data: bytes, original: bool = False) -> Hashable:
+        """Save the serialized tree and return its new stamp."""
+
+    @abstractmethod
+    def load(self, tid: int, original: bool = False) -> bytes | mmap.mmap | None:
+        """Return the serialized tree (a bytes-like object), or None."""
+
+    @contextmanager
+    def loading(
+        self, tid: int, original: bool = False
+    ) -> Iterator[bytes | mmap.mmap | None]:
+        """Yield the serialized tree like load(), and close it afterwards."""
+        data: bytes | mmap.mmap | None = self.load(tid, original)
+        try:
+            yield data
+        finally:
+            if isinstance(data, mmap.mmap):
+                try:
+                    data.close()
+                except BufferError:
+                    pass  # still referenced (by a traceback): closed when freed
+
+    @abstractmethod
+    def exists(self, tid: int) -> bool:
+        """Return True if the tree is saved."""
+
+    @abstractmethod
+    def stamp(self, tid: int) -> Hashable | None:
+        """Return the stamp of the saved tree, or None if it is not saved."""
+
+    @abstractmethod
+    def tree_ids(self) -> list[int]:
+        """Return the ids of all the saved trees."""
+
+    @abstractmethod
+    def delete(self, tid: int) -> None:
+        """Delete the tree (its current and original versions)."""
+
+    @abstractmethod
+    def touch(self, tid: int) -> None:
+        """Mark the tree as recently used."""
+
+    @abstractmethod
+    def remove_stale(self, max_idle_seconds: float) -> list[int]:
+        """Delete the trees not used in max_idle_seconds and return their ids."""
+
+
+class DiskTreeStore(TreeStore):
+    """Store the trees as files in a directory shared by the workers.
+
+    Files are written to a temporary file first and then renamed, so a
+    worker never reads a partially written tree. The stamp of a tree is
+    the inode and modification time of its file, and using it only
+    changes its access time.
+    """
+
+    def __init__(
+        self,
+        directory: str | Path,
+        suffix: str = ".tree",
+        original_suffix: str = ".original",
+    ) -> None:
+        self.directory: Path = Path(directory)
+        self.suffix: str = suffix
+        self.original_suffix: str = original_suffix
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def path(self, tid: int, original: bool = False) -> Path:
+        return self.directory / f"{tid}{self.original_suffix if original else self.suffix}"
+
+    def save(self, tid: int, data: bytes, original: bool = False) -> Hashable:
+        with NamedTemporaryFile(
+            dir=self.directory, prefix=f".{tid}-", delete=False
+        ) as tmp_file:
+            tmp_file.write(data)
+            tmp_file.flush()
+            file_stamp: Hashable = get_file_stamp(os.fstat(tmp_file.fileno()))
+        os.replace(tmp_file.name, self.path(tid, original))
+        return file_stamp
+
+    def load(self, tid: int, original: bool = False) -> mmap.mmap | None:
+        """Return the memory-mapped file of the tree, or None.
+
+        The file is replaced (never modified in place) when saving, so
+        the mapping stays valid even if the tree is saved again. The
+        caller should close it when done.
+        """
+        try:
+            with open(self.path(tid, original), "rb") as tree_file:
+                return mmap.mmap(tree_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):  # ValueError: empty file
+            return None
+
+    def exists(self, tid: int) -> bool:
+        return self.path(tid).exists()
+
+    def stamp(self, tid: int) -> Hashable | None:
+        try:
+            return get_file_stamp(self.path(tid).stat())
+        except FileNotFoundError:
+            return None
+
+    def tree_ids(self) -> list[int]:
+        return [tid for tid, _ in self.tree_paths()]
+
+    def tree_paths(self) -> list[tuple[int, Path]]:
+        tree_paths: list[tuple[int, Path]] = []
+        for path in self.directory.glob(f"*{self.suffix}"):
+            try:
+                tree_paths.append((int(path.name[: -len(self.suffix)]), path))
+            except ValueError:
+                continue  # not one of our files
+        return tree_paths
+
+    def delete(self, tid: int) -> None:
+        self.path(tid).unlink(missing_ok=True)
+        self.path(tid, original=True).unlink(missing_ok=True)
+
+    def touch(self, tid: int) -> None:
+        path: Path = self.path(tid)
+        try:  # only the access time, so the stamp stays the same
+            os.utime(path, ns=(time_ns(), path.stat().st_mtime_ns))
+        except FileNotFoundError:
+            pass
+
+    def remove_stale(self, max_idle_seconds: float) -> list[int]:
+        removed: list[int] = []
+        current_time: float = time()
+        for tid, path in self.tree_paths():
+            try:
+                tree_stat: os.stat_result = path.stat()
+                last_access: float = max(tree_stat.st_atime, tree_stat.st_mtime)
+                if current_time - last_access > max_idle_seconds:
+                    self.delete(tid)
+                    removed.append(tid)
+            except FileNotFoundError:
+                pass  # removed meanwhile by another worker
+        return removed
+
+
+class MemoryTreeStore(TreeStore):
+    """Keep the serialized trees in the memory of the current process.
+
+    Useful as a stand-in for DiskTreeStore in tests.
+    """
+
+    def __init__(self) -> None:
+        self.lock: Lock = Lock()
+        self.data: dict[int, tuple[bytes, float]] = {}
+        self.originals: dict[int, bytes] = {}
+        self.stamps: dict[int, int] = {}
+        self.counter: count = count()
+
+    def save(self, tid: int, data: bytes, original: bool = False) -> Hashable:
+        with self.lock:
+            if original:
+                self.originals[tid] = data
+                return None
+            self.data[tid] = (data, time())
+            self.stamps[tid] = next(self.counter)
+            return self.stamps[tid]
+
+    def load(self, tid: int, original: bool = False) -> bytes | None:
+        with self.lock:
+            if original:
+                return self.originals.get(tid)
+            stored: tuple[bytes, float] | None = self.data.get(tid)
+        return stored[0] if stored is not None else None
+
+    def exists(self, tid: int) -> bool:
+        with self.lock:
+            return tid in self.data
+
+    def stamp(self, tid: int) -> Hashable | None:
+        with self.lock:
+            return self.stamps.get(tid)
+
+    def tree_ids(self) -> list[int]:
+        with self.lock:
+            return list(self.data)
+
+    def delete(self, tid: int) -> None:
+        with self.lock:
+            self.data.pop(tid, None)
+            self.originals.pop(tid, None)
+            self.stamps.pop(tid, None)
+
+    def touch(self, tid: int) -> None:
+        with self.lock:
+            if tid in self.data:
+                self.data[tid] = (self.data[tid][0], time())
+
+    def remove_stale(self, max_idle_seconds: float) -> list[int]:
+        current_time: float = time()
+        with self.lock:
+            removed: list[int] = [
+                tid
+                for tid, (_, last_access) in self.data.items()
+                if current_time - last_access > max_idle_seconds
+            ]
+            for tid in removed:
+                del self.data[tid]
+                self.originals.pop(tid, None)
+                self.stamps.pop(tid, None)
+        return removed
+
+
+def get_file_stamp(file_stat: os.stat_result) -> Hashable:
+    """Return what changes when the file is replaced (but not when read)."""
+    return (file_stat.st_ino, file_stat.st_mtime_ns, file_stat.st_size)
+
+
+def get_default_tree_store() -> TreeStore:
+    """Return the store configured with TREE_CACHE_DIR (/tmp by default)."""
+    return DiskTreeStore(os.environ.get("TREE_CACHE_DIR", "/tmp"))
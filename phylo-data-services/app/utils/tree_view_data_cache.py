@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+import os
+from dataclasses import dataclass
+from typing import Any
+from typing import Hashable
+from typing import Optional
+
+from utils.bounded_lru_cache import BoundedLRUCache
+
+# Rough footprints used to estimate the resident size of an entry.
+GENE_RECORD_ESTIMATED_BYTES: int = 150
+GENE_ESTIMATED_BYTES: int = 600
+TOOLTIP_ESTIMATED_BYTES: int = 800
+
+
+@dataclass
+class TreeViewDataEntry:
+    """What is built from the database to view a tree (except the tree itself)."""
+
+    newick: str  # the tree is rebuilt from it, since every view may modify it
+    layouts: list[Any]
+    tree_node_tooltip_data: dict[int, Any]
+
+
+def estimate_entry_size(entry: TreeViewDataEntry) -> int:
+    """Return a rough estimate of the memory used by the entry, in bytes.
+
+    Like the estimates of the tree cache, it counts objects instead of
+    measuring them.
+    """
+    nrecords: int = 0
+    ngenes: int = 0
+    for layout in entry.layouts:
+        layout_args: Any = getattr(layout, "args", None)
+        if isinstance(layout_args, dict):
+            nrecords += sum(len(records) for records in layout_args.values())
+        ngenes += len(getattr(layout, "genes", ()))
+    return (
+        len(entry.newick)
+        + len(entry.tree_node_tooltip_data) * TOOLTIP_ESTIMATED_BYTES
+        + nrecords * GENE_RECORD_ESTIMATED_BYTES
+        + ngenes * GENE_ESTIMATED_BYTES
+    )
+
+
+class TreeViewDataCache(BoundedLRUCache[TreeViewDataEntry]):
+    """LRU cache of the data built from the database to view a tree.
+
+    The entries are keyed by (tree_id, phylome_id), so opening again a
+    tree does not query the database nor build its gene-order layout.
+    """
+
+    def __init__(
+        self, max_entries: Optional[int] = None, max_bytes: Optional[int] = None
+    ) -> None:
+        super().__init__(
+            estimate_entry_size,
+            (
+                max_entries
+                if max_entries is not None
+                else int(os.environ.get("TREE_VIEW_DATA_CACHE_MAX_ENTRIES", 64))
+            ),
+            (
+                max_bytes
+                if max_bytes is not None
+                else int(os.environ.get("TREE_VIEW_DATA_CACHE_MAX_BYTES", 512 * 1024**2))
+            ),
+        )
+
+    @staticmethod
+    def make_key(tree_id: int, phylome_id: int) -> tuple[Hashable, ...]:
+        return (tree_id, phylome_id)
@@ -5,27 +5,31 @@ import gzip
 import json
 import os
 import re
-import shutil
 import sys
 import tarfile
 import zipfile
 from collections import defaultdict
+from collections import OrderedDict
 from copy import copy
 from copy import deepcopy
 from dataclasses import dataclass
+from dataclasses import field
+from functools import partial
 from datetime import datetime
-from datetime import timedelta
 from importlib import reload as module_reload
 from io import BufferedReader
-from math import inf
+from itertools import count
 from math import pi
 from pathlib import Path
+from threading import Event
+from threading import Lock
+from threading import RLock
 from threading import Thread
 from time import time
 from types import CodeType
 from typing import Any
 from typing import Callable
-from typing import List
+from typing import Hashable
 from typing import Literal
 from typing import NamedTuple
 from typing import Optional
@@ -46,6 +50,20 @@ from fastapi import Request
 
 from models.tree_node_tooltip_data_dao import TreeNodeTooltipData
 from services.tree_view_data_service import GeneOrderTreeLayout, TreeViewData
+from utils import tree_snapshot
+from utils.draw_executor import DrawExecutor
+from utils.draw_response_cache import DrawResponseCache
+from utils.eval_search import EvalSearch
+from utils.node_search_index import NodeSearchIndex
+from utils.property_catalog import PropertyCatalog
+from utils.read_write_lock import ReadWriteLock
+from utils.tree_store import get_default_tree_store
+from utils.tree_store import TreeStore
+
+
+TREE_VERSIONS: count = count()
+
+MAX_HISTOGRAM_BINS: int = 1000
 
 
 @dataclass
@@ -60,11 +78,68 @@ class TreeData:
     timer: Optional[float] = None
     ultrametric: Optional[bool] = False
     initialized: Optional[bool] = False
+    # Nodes initialized (styled by the layouts) in an older epoch are reset
+    # and styled again by the drawer when it reaches them.
+    style_epoch: int = 1
     selected: Optional[dict] = None
     active: Optional[NamedTuple] = None  # active nodes
     searches: Optional[dict] = None
     tree_node_tooltip_data: Optional[dict[int, TreeNodeTooltipData]] = None
+    # Node name -> tooltip data (already serialized) to send as its props.
+    tooltip_index: Optional[dict[str, dict[str, Any]]] = None
     timestamp: Optional[datetime] = None
+    estimated_bytes: int = 0
+    # Changes every time the tree (or anything that is drawn with it, like
+    # searches or selections) is modified. Unique among all the trees.
+    version: int = field(default_factory=lambda: next(TREE_VERSIONS))
+    # Version last written to the store (None if it is not there yet). The
+    # trees with other versions have changes that would be lost if evicted.
+    saved_version: Optional[int] = None
+    # Version that could not be written to the store, and whether the tree
+    # can be serialized at all. Trees that cannot be saved are evicted and
+    # expired anyway (losing their changes), or they would never leave.
+    failed_save_version: Optional[int] = None
+    serializable: bool = True
+    # Stamp in the store of the saved version (see TreeStore).
+    store_stamp: Optional[Hashable] = None
+    # Layouts that the tree was added with, to save it again in the store.
+    added_layouts: list | str = field(default_factory=list, repr=False)
+    # Branch lengths of the nodes before making the tree ultrametric.
+    original_dists: Optional[dict[Tree, Any]] = field(default=None, repr=False)
+    # Held for reading while drawing, and for writing while modifying.
+    lock: ReadWriteLock = field(default_factory=ReadWriteLock, repr=False)
+    # Held by the draws while they style (again) a node, since several draws
+    # of the tree can run at once with the read lock.
+    style_lock: Lock = field(default_factory=Lock, repr=False)
+    # Built on the first search, and dropped when the nodes change.
+    search_index: Optional[NodeSearchIndex] = field(default=None, repr=False)
+    # Built when asked for the properties, and dropped when they change.
+    property_catalog: Optional[PropertyCatalog] = field(default=None, repr=False)
+    # Ladders found when drawing zoomed out, dropped when the sizes change.
+    lod: Optional[drawer_module.LevelsOfDetail] = field(default=None, repr=False)
+    # Where the children of the nodes start, also dropped when the sizes change.
+    children_offsets: Optional[drawer_module.ChildrenOffsets] = field(
+        default=None, repr=False
+    )
+
+
+@dataclass
+class TreeCacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    save_failures: int = 0
+    lost_changes: int = 0  # trees evicted or expired with unsaved changes
+
+
+# Seconds between marking a tree as used in the shared store.
+STORE_TOUCH_INTERVAL: float = 60
+
+# Rough per-object footprints used to estimate the resident size of a tree.
+NODE_ESTIMATED_BYTES: int = 600
+FACE_ESTIMATED_BYTES: int = 1500
+TOOLTIP_ESTIMATED_BYTES: int = 800
 
 
 class GlobalTreeCache:
@@ -76,8 +151,24 @@ class GlobalTreeCache:
         exclude_props: Optional[list | str] = None,
         safe_mode: bool = False,
         compress: bool = False,
+        max_trees: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        max_idle_seconds: Optional[float] = None,
+        eviction_interval: Optional[float] = None,
+        store: Optional[TreeStore] = None,
     ) -> None:
-        """Initialize the global object APP_GLOBAL."""
+        """Initialize the global object APP_GLOBAL.
+
+        The limits not given explicitly are read from the environment
+        (TREE_CACHE_MAX_TREES, TREE_CACHE_MAX_BYTES,
+        TREE_CACHE_MAX_IDLE_SECONDS and TREE_CACHE_EVICTION_INTERVAL).
+
+        The trees are also kept in the given store (a directory shared by
+        all the workers, TREE_CACHE_DIR, by default), so any worker can
+        reload a tree that it does not have in memory. The modified trees
+        are saved to it right away by the background thread, and a worker
+        reloads its copy of a tree when another one saved a newer version.
+        """
         self.default_layouts: list[TreeLayout]
         self.avail_layouts: dict[str, TreeLayout]
 
@@ -85,22 +176,293 @@ class GlobalTreeCache:
 
         self.safe_mode: bool = safe_mode
         self.compress: bool = compress
-        self.trees: dict[int, TreeData] = {}
+
+        self.max_trees: int = (
+            max_trees
+            if max_trees is not None
+            else int(os.environ.get("TREE_CACHE_MAX_TREES", 32))
+        )
+        self.max_bytes: int = (
+            max_bytes
+            if max_bytes is not None
+            else int(os.environ.get("TREE_CACHE_MAX_BYTES", 2 * 1024**3))
+        )
+        self.max_idle_seconds: float = (
+            max_idle_seconds
+            if max_idle_seconds is not None
+            else float(os.environ.get("TREE_CACHE_MAX_IDLE_SECONDS", 3600))
+        )
+        self.eviction_interval: float = (
+            eviction_interval
+            if eviction_interval is not None
+            else float(os.environ.get("TREE_CACHE_EVICTION_INTERVAL", 60))
+        )
+
+        # Ordered from the least to the most recently used tree.
+        self.trees: OrderedDict[int, TreeData] = OrderedDict()
+        self.stats: TreeCacheStats = TreeCacheStats()
+        self.lock: RLock = RLock()
+        self.save_lock: RLock = RLock()
+        self.modified: Event = Event()  # set when a tree has unsaved changes
+        # The lock of each tree, shared by all the copies loaded of it.
+        self.tree_locks: dict[int, ReadWriteLock] = {}
+        self.eviction_thread: Optional[Thread] = None
+        self.store: TreeStore = store if store is not None else get_default_tree_store()
+
+    def get(self, tid: int) -> Optional[TreeData]:
+        """Return the cached tree data and mark it as the most recently used.
+
+        Return None too if another worker saved a newer version of the
+        tree, so it is loaded again. Unsaved changes are kept, though
+        (they will overwrite the other ones), and so is the tree while in
+        use (it is reloaded afterwards).
+        """
+        stamp: Optional[Hashable] = self.store.stamp(tid)
+        with self.lock:
+            tree_data: Optional[TreeData] = self.trees.get(tid)
+            if (
+                tree_data is not None
+                and stamp is not None
+                and stamp != tree_data.store_stamp
+                and is_saved(tree_data)
+                and not tree_data.lock.in_use()
+            ):
+                del self.trees[tid]  # outdated
+                tree_data = None
+            if tree_data is None:
+                self.stats.misses += 1
+                return None
+
+            self.stats.hits += 1
+            self.trees.move_to_end(tid)
+            last_access: Optional[float] = tree_data.timer
+            tree_data.timer = time()
+
+        # Let the other workers know that the tree is still in use.
+        if last_access is None or tree_data.timer - last_access > STORE_TOUCH_INTERVAL:
+            self.store.touch(tid)
+        return tree_data
+
+    def get_version(self, tid: int) -> Optional[int]:
+        """Return the version of the tree in memory (None if not in memory).
+
+        Unlike get(), it does not count as a use of the tree.
+        """
+        with self.lock:
+            tree_data: Optional[TreeData] = self.trees.get(tid)
+            return tree_data.version if tree_data is not None else None
+
+    def put(self, tid: int, tree_data: TreeData) -> None:
+        """Add the tree data to the cache, evicting others if over the limits.
+
+        The tree data gets the lock of the tree, so it is the same for all
+        its copies (like the ones loaded again after an eviction).
+        """
+        tree_data.estimated_bytes = estimate_tree_data_size(tree_data)
+        if tree_data.timer is None:
+            tree_data.timer = time()
+
+        with self.lock:
+            tree_data.lock = self.tree_locks.setdefault(tid, tree_data.lock)
+            self.trees[tid] = tree_data
+            self.trees.move_to_end(tid)
+            self.enforce_limits()
+
+    def pop(self, tid: int) -> Optional[TreeData]:
+        with self.lock:
+            return self.trees.pop(tid, None)
+
+    def delete(self, tid: int) -> None:
+        """Remove the tree from memory and from the store."""
+        self.store.delete(tid)
+        self.forget(tid)
+
+    def forget(self, tid: int) -> None:
+        """Remove the tree from memory, together with its lock."""
+        with self.lock:
+            self.trees.pop(tid, None)
+            self.tree_locks.pop(tid, None)
+
+    def contains(self, tid: int) -> bool:
+        """Return True if the tree is in memory or can be reloaded from the store."""
+        with self.lock:
+            if tid in self.trees:
+                return True
+        return self.store.exists(tid)
+
+    def cached_trees(self) -> list[tuple[int, TreeData]]:
+        """Return a snapshot of the (tid, tree_data) pairs currently in memory."""
+        with self.lock:
+            return list(self.trees.items())
+
+    def tree_names(self) -> dict[int, Optional[str]]:
+        """Return the names of all the trees (of all workers), by tree id."""
+        names: dict[int, Optional[str]] = {
+            tid: tree_data.name for tid, tree_data in self.cached_trees()
+        }
+        for tid in self.store.tree_ids():
+            if tid not in names:
+                with self.store.loading(tid) as snapshot:
+                    if snapshot is None:
+                        continue  # removed meanwhile
+                    try:
+                        names[tid] = tree_snapshot.read_summary(snapshot).get("name")
+                    except tree_snapshot.SnapshotError:
+                        continue
+        return names
+
+    def resident_bytes(self) -> int:
+        with self.lock:
+            return sum(tree_data.estimated_bytes for tree_data in self.trees.values())
+
+    def enforce_limits(self) -> None:
+        """Evict the least recently used trees until the cache fits its limits.
+
+        The most recently used tree is always kept, even if it alone
+        exceeds the memory limit. Evicted trees stay in the store, so
+        they are reloaded from it the next time they are accessed.
+
+        Trees with changes not saved in the store yet are not evicted
+        (their changes would be lost). save_modified() saves them, so
+        they can be evicted afterwards, unless saving them failed. Trees
+        in use are not evicted either (so they are not loaded again while
+        still being changed).
+        """
+        with self.lock:
+            most_recent: Optional[int] = next(reversed(self.trees), None)
+            candidates: list[int] = [
+                tid
+                for tid, tree_data in self.trees.items()
+                if tid != most_recent
+                and can_leave_memory(tree_data)
+                and not tree_data.lock.in_use()
+            ]
+            for tid in candidates:
+                if not (
+                    len(self.trees) > self.max_trees
+                    or self.resident_bytes() > self.max_bytes
+                ):
+                    break
+                self.remove_from_memory(tid)
+                self.stats.evictions += 1
 
     def remove_stale_tree_caches(self) -> None:
+        """Remove the trees that were not accessed in max_idle_seconds.
+
+        Trees idle in this worker are only dropped from its memory, since
+        other workers may still be using them. They are removed from the
+        store once no worker has touched them in max_idle_seconds.
+        """
         keys_to_remove: list[int] = []
-        for key, tree in self.trees.items():
-            if tree.timestamp is None:
-                raise ValueError("Cached tree hasn't got a timestamp!")
-            tree_timestamp: datetime = tree.timestamp
-            current_timestamp: datetime = datetime.now()
-            timestamp_diff: timedelta = current_timestamp - tree_timestamp
-            if timestamp_diff > timedelta(hours=1):
-                keys_to_remove.append(key)
-
-        for key in keys_to_remove:
-            del self.trees[key]
-            Path(f"/tmp/{key}.pickle").unlink()
+        current_time: float = time()
+        with self.lock:
+            for key, tree in self.trees.items():
+                if not can_leave_memory(tree) or tree.lock.in_use():
+                    continue  # kept until saved (see save_modified) and unused
+                last_access: Optional[float] = tree.timer
+                if last_access is None:
+                    if tree.timestamp is None:
+                        raise ValueError("Cached tree hasn't got a timestamp!")
+                    last_access = tree.timestamp.timestamp()
+                if current_time - last_access > self.max_idle_seconds:
+                    keys_to_remove.append(key)
+
+            for key in keys_to_remove:
+                self.remove_from_memory(key)
+                self.stats.expirations += 1
+
+        for key in self.store.remove_stale(self.max_idle_seconds):
+            self.forget(key)
+
+    def remove_from_memory(self, tid: int) -> None:
+        """Remove the tree from memory, reporting if its changes are lost."""
+        with self.lock:
+            tree_data: TreeData = self.trees.pop(tid)
+            if not is_saved(tree_data):
+                print(
+                    f"Tree {tid} removed from memory with unsaved changes (lost).",
+                    file=sys.stderr,
+                )
+                self.stats.lost_changes += 1
+
+    def save(self, tid: int, tree_data: TreeData) -> bool:
+        """Write the tree data to the store if it changed since last saved.
+
+        Return False if it could not be saved. A failure is not retried
+        until the tree changes again (or never, if it cannot be serialized).
+        """
+        with self.save_lock:  # so an older version is never saved last
+            with self.lock:
+                if self.trees.get(tid) is not tree_data:
+                    return False  # removed meanwhile (maybe reloaded)
+            with tree_data.lock.read():  # not modified while serializing
+                version: int = tree_data.version
+                if tree_data.saved_version == version:
+                    return True
+                if not can_be_saved(tree_data):
+                    return False  # it failed already
+                try:
+                    snapshot: bytes = tree_data_to_snapshot(tree_data)
+                except (pickle.PicklingError, TypeError) as e:
+                    print(f"Tree {tid} cannot be serialized. ERROR: {e}", file=sys.stderr)
+                    tree_data.serializable = False
+                    self.stats.save_failures += 1
+                    return False
+
+            try:
+                tree_data.store_stamp = self.store.save(tid, snapshot)
+            except OSError as e:
+                print(f"Tree {tid} not saved to file. ERROR: {e}", file=sys.stderr)
+                tree_data.failed_save_version = version
+                self.stats.save_failures += 1
+                return False
+
+            tree_data.saved_version = version
+            return True
+
+    def save_modified(self) -> None:
+        """Write to the store the trees in memory with unsaved changes."""
+        self.modified.clear()
+        for tid, tree_data in self.cached_trees():
+            if not is_saved(tree_data) and can_be_saved(tree_data):
+                self.save(tid, tree_data)
+
+    def start_background_eviction(self) -> None:
+        """Start a daemon thread that saves the modified trees as soon as
+        they change, and periodically expires and evicts trees."""
+        if self.eviction_thread is not None and self.eviction_thread.is_alive():
+            return
+
+        def evict_periodically() -> None:
+            next_eviction: float = time() + self.eviction_interval
+            while True:
+                self.modified.wait(max(0, next_eviction - time()))
+                try:
+                    self.save_modified()
+                    if time() >= next_eviction:
+                        self.remove_stale_tree_caches()
+                        self.enforce_limits()
+                        next_eviction = time() + self.eviction_interval
+                except Exception as e:
+                    print(f"[ERROR] Tree cache eviction failed: {e}", file=sys.stderr)
+
+        self.eviction_thread = Thread(daemon=True, target=evict_periodically)
+        self.eviction_thread.start()
+
+    def get_stats(self) -> dict[str, int]:
+        with self.lock:
+            return {
+                "trees": len(self.trees),
+                "max_trees": self.max_trees,
+                "resident_bytes": self.resident_bytes(),
+                "max_bytes": self.max_bytes,
+                "hits": self.stats.hits,
+                "misses": self.stats.misses,
+                "evictions": self.stats.evictions,
+                "expirations": self.stats.expirations,
+                "save_failures": self.stats.save_failures,
+                "lost_changes": self.stats.lost_changes,
+            }
 
     def get_layouts(
         self,
@@ -159,10 +521,138 @@ class GlobalTreeCache:
             )
 
 
+def is_saved(tree_data: TreeData) -> bool:  # typed
+    "Return True if the tree data has no changes left to write to the store"
+    return tree_data.saved_version == tree_data.version
+
+
+def can_be_saved(tree_data: TreeData) -> bool:  # typed
+    "Return False if saving the current version of the tree data failed already"
+    return tree_data.serializable and tree_data.failed_save_version != tree_data.version
+
+
+def can_leave_memory(tree_data: TreeData) -> bool:  # typed
+    "Return True if the tree data is saved, or cannot be saved (so it never will)"
+    return is_saved(tree_data) or not can_be_saved(tree_data)
+
+
 GLOBAL_TREE_CACHE = GlobalTreeCache()
+DRAW_RESPONSE_CACHE = DrawResponseCache()
+DRAW_EXECUTOR = DrawExecutor()
 G_THREADS: dict[Any, Any] = {}
 
 
+def mark_tree_modified(
+    tree_data: TreeData, reindex: bool = False, props_changed: bool = False
+) -> None:  # typed
+    """Give a new version to the tree data, so its cached drawings are not used.
+
+    Use reindex=True when the names or the topology of the tree changed,
+    and props_changed=True when only other properties (like dist) did.
+    """
+    tree_data.version = next(TREE_VERSIONS)
+    GLOBAL_TREE_CACHE.modified.set()  # to save it to the store
+    if reindex:
+        tree_data.search_index = None
+    if reindex or props_changed:
+        tree_data.property_catalog = None
+        tree_data.lod = None
+        tree_data.children_offsets = None
+
+
+def get_search_index(tree_data: TreeData) -> NodeSearchIndex:  # typed
+    "Return the search index of the tree, building it if needed"
+    if tree_data.search_index is None:
+        tree_data.search_index = NodeSearchIndex(tree_data.tree)
+    return tree_data.search_index
+
+
+def get_property_catalog(tree_data: TreeData) -> PropertyCatalog:  # typed
+    "Return the property catalog of the tree, building it if needed"
+    if tree_data.property_catalog is None:
+        tree_data.property_catalog = PropertyCatalog(get_search_index(tree_data).nodes)
+    return tree_data.property_catalog
+
+
+def get_levels_of_detail(tree_data: TreeData) -> drawer_module.LevelsOfDetail:  # typed
+    "Return the levels of detail to draw the tree zoomed out, creating them if needed"
+    if tree_data.lod is None:
+        tree_data.lod = drawer_module.LevelsOfDetail()
+    return tree_data.lod
+
+
+def get_children_offsets(tree_data: TreeData) -> drawer_module.ChildrenOffsets:  # typed
+    "Return the offsets of the children of the nodes, creating them if needed"
+    if tree_data.children_offsets is None:
+        tree_data.children_offsets = drawer_module.ChildrenOffsets()
+    return tree_data.children_offsets
+
+
+def get_node(tree_data: TreeData, node_id: list[int | str]) -> Tree:  # typed
+    """Return the node of the tree with the given id.
+
+    The id is a list of steps from the root: child positions, and handles
+    (like "@57", the position of a node in preorder) that jump straight to
+    a node. So only the steps after the last handle are walked. Raise
+    IndexError if there is no such node.
+    """
+    start: int = len(node_id)  # where the steps to walk start
+    while start > 0 and not isinstance(node_id[start - 1], str):
+        start -= 1
+
+    node: Tree = tree_data.tree
+    if start > 0:
+        handle: int = int(node_id[start - 1][1:])  # type: ignore
+        node = get_search_index(tree_data).nodes[handle]
+    for step in node_id[start:]:
+        node = node.children[step]
+    return node
+
+
+def get_node_handle(tree_data: TreeData, node: Tree) -> str:  # typed
+    "Return the handle of the node (like '@57'), to use as its node id"
+    return f"@{get_search_index(tree_data).positions[id(node)]}"
+
+
+def get_subtree_id(tree_data: TreeData, node: Tree) -> str:  # typed
+    """Return the node id of the (sub)tree of the node, after changing the
+    topology of the tree (which renumbers the handles of the nodes).
+
+    It is "" for the whole tree, and also if the node is not in it anymore.
+    """
+    if node is tree_data.tree or node.root is not tree_data.tree:
+        return ""
+    return get_node_handle(tree_data, node)
+
+
+def get_node_steps(node_id: Any) -> list[int | str]:  # typed
+    """Return the steps of a node id given as a list or as a text.
+
+    Example: '1,0' -> [1, 0], '@57' -> ['@57'], [1, 0] -> [1, 0]
+    """
+    parts: list = node_id if isinstance(node_id, list) else str(node_id).split(",")
+    try:
+        return [get_step(str(part)) for part in parts if str(part) != ""]
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"invalid node id {node_id}")
+
+
+def get_step(text: str) -> int | str:  # typed
+    "Return the step (child position, or node handle like '@57') in the text"
+    if text.startswith("@"):
+        if not text[1:].isdecimal():
+            raise ValueError(f"invalid node handle {text}")
+        return f"@{int(text[1:])}"
+    return int(text)
+
+
+def get_subtree_range(tree_data: TreeData, tree: Tree) -> tuple[int, int]:  # typed
+    "Return the range [start, end) of preorder positions of the (sub)tree nodes"
+    search_index: NodeSearchIndex = get_search_index(tree_data)
+    start: int = search_index.positions[id(tree)]
+    return start, search_index.ends[start]
+
+
 def initialize_tree_style(tree_data: TreeData) -> None:  # typed
     global GLOBAL_TREE_CACHE
     # Save aligned_grid_dxs to add them later.
@@ -184,53 +674,134 @@ def initialize_tree_style(tree_data: TreeData) -> None:  # typed
                         layout.set_tree_style(tree, style)
                         # A terrible way of saying something that should be like:
                         #   tree_data.style.update(layout.tree_style)
-        else:
-            return None
     tree_data.initialized = True
 
 
 def load_tree(tree_id: str | int | None) -> Tree:  # typed
-    global GLOBAL_TREE_CACHE
     "Add tree to APP_GLOBAL.trees and initialize it if not there, and return it"
+    _, tree = load_tree_data(tree_id)
+    return tree
+
+
+def load_tree_data(tree_id: str | int | None) -> tuple[TreeData, Tree]:  # typed
+    """Return the tree data and the requested (sub)tree of the given tree id.
+
+    The tree is reloaded from disk if it was evicted from memory.
+    """
+    global GLOBAL_TREE_CACHE
     try:
-        tid_subtree: tuple[int, list[int]] | None = get_tid(tree_id)
+        tid_subtree: tuple[int, list[int | str]] | None = get_tid(tree_id)
         if tid_subtree is not None:
             tid: int
-            subtree: list[int]
+            subtree: list[int | str]
 
             tid, subtree = tid_subtree
-        if tid in GLOBAL_TREE_CACHE.trees:
-            tree_data: Tree = GLOBAL_TREE_CACHE.trees[tid]
-
+        tree_data: TreeData | None = GLOBAL_TREE_CACHE.get(tid)
+        if tree_data is not None:
             # Reinitialize if layouts have to be reapplied
             if not tree_data.initialized:
-                initialize_tree_style(tree_data)
-
-                for node in tree_data.tree[subtree].traverse():
-                    node.is_initialized = False
-                    node._smfaces = None
-                    node._collapsed_faces = None
-                    node._sm_style = None
-                for node, args in tree_data.nodestyles.items():
-                    update_node_style(node, args.copy())
-            tree: Tree = tree_data.tree[subtree]
-            return tree
+                with tree_data.lock.write():
+                    if not tree_data.initialized:  # not done meanwhile
+                        reinitialize_tree_style(tree_data)
+            tree: Tree = get_node(tree_data, subtree)
+            return tree_data, tree
         else:
-            tree_data = GLOBAL_TREE_CACHE.trees[tid] = retrieve_tree_data(tid)  # type: ignore
+            tree_data = retrieve_tree_data(tid)
 
-            if tree_data.ultrametric:
-                ultrametric = tree_data.tree.to_ultrametric()
-                ops.update_sizes_all(tree_data.tree)
+            if tree_data.ultrametric:  # saved with its original dists
+                set_ultrametric(tree_data, True)
 
             initialize_tree_style(tree_data)
+            GLOBAL_TREE_CACHE.put(tid, tree_data)
 
-            tree = tree_data.tree[subtree]
-            return tree
+            tree = get_node(tree_data, subtree)
+            return tree_data, tree
 
     except (AssertionError, IndexError):
         raise HTTPException(status_code=404, detail=f"unknown tree id {tree_id}")
 
 
+def set_ultrametric(tree_data: TreeData, ultrametric: bool) -> None:  # typed
+    """Make the tree ultrametric, or give it back its original branch lengths.
+
+    The original ones are kept when making it ultrametric, so the tree can
+    be changed back without reloading it (and losing its other changes).
+    """
+    tree: Optional[Tree] = tree_data.tree
+    if tree is None:
+        return
+
+    if ultrametric:
+        tree_data.original_dists = {
+            node: node.props.get("dist") for node in tree.traverse()
+        }
+        tree.to_ultrametric()
+    else:
+        for node, dist in (tree_data.original_dists or {}).items():
+            if dist is None:
+                node.props.pop("dist", None)
+            else:
+                node.props["dist"] = dist
+        tree_data.original_dists = None
+
+    ops.update_sizes_all(tree)
+    tree_data.ultrametric = ultrametric
+
+
+def reinitialize_tree_style(tree_data: TreeData) -> None:
+    """Apply the tree style and layouts again.
+
+    The nodes are not traversed here: starting a new style epoch makes the
+    drawer reset them (and restore their node styles) as it draws them.
+    """
+    initialize_tree_style(tree_data)
+    tree_data.style_epoch += 1
+
+
+def restore_node_style(tree_data: TreeData, node: Tree) -> None:  # typed
+    "Apply again to a node that was reset the styles set with update_node_style"
+    if not tree_data.nodestyles:
+        return
+
+    lineage: set[int] = set(id(n) for n in node.lineage())
+    for styled_node, args in tree_data.nodestyles.items():
+        if styled_node is node or (
+            id(styled_node) in lineage and args.get("extend_to_descendants")
+        ):
+            node_args: dict = args.copy()
+            node_args.pop("extend_to_descendants", None)  # only for this node
+            update_node_style(node, node_args)
+
+
+def get_tree_data(tree_id: str | int | None) -> TreeData:  # typed
+    "Return the tree data of the given tree id, reloading it if necessary"
+    tree_data, _ = load_tree_data(tree_id)
+    return tree_data
+
+
+def estimate_tree_data_size(tree_data: TreeData) -> int:  # typed
+    """Return a rough estimate of the memory used by the tree data, in bytes.
+
+    It is meant to be cheap: it uses the number of nodes of the tree and
+    the number of tooltips, instead of measuring every object.
+    """
+    nnodes: int = 0
+    if tree_data.tree is not None:
+        nnodes = sum(1 for _ in tree_data.tree.traverse())
+    ntooltips: int = len(tree_data.tree_node_tooltip_data or {})
+    nfaces: int = 0
+    for layouts in (tree_data.layouts or {}).values():
+        for layout in layouts or []:
+            layout_args: Any = getattr(layout, "args", None)
+            if isinstance(layout_args, dict):
+                nfaces += sum(len(faces) for faces in layout_args.values())
+    return (
+        nnodes * NODE_ESTIMATED_BYTES
+        + ntooltips * TOOLTIP_ESTIMATED_BYTES
+        + nfaces * FACE_ESTIMATED_BYTES
+    )
+
+
 # Loads tree from a newick file
 def load_tree_from_newick(tid: int, nw: str) -> Tree:  # typed
     global GLOBAL_TREE_CACHE
@@ -303,14 +874,25 @@ def retrieve_layouts(
 
 # Retrive the tree data with given tid
 def retrieve_tree_data(tid: int) -> TreeData:  # Typed
-    """Retrieve and return tree data from file.
-    It retrieves all that from a previously saved pickle file in /tmp."""
+    """Retrieve and return tree data from the shared tree store.
+    It retrieves all that from a previously saved snapshot, maybe written
+    by another worker."""
     global GLOBAL_TREE_CACHE
-    # Called when tree has been deleted from memory.
+    # Called when tree has been deleted from memory, or was never in it.
     tree_data: TreeData
+    # Taken before loading, so a newer version saved meanwhile is reloaded.
+    stamp: Optional[Hashable] = GLOBAL_TREE_CACHE.store.stamp(tid)
     try:
-        tree_data = pickle.load(open(f"/tmp/{tid}.pickle", "rb"))
-    except (FileNotFoundError, EOFError, pickle.UnpicklingError) as e:
+        with GLOBAL_TREE_CACHE.store.loading(tid) as serialized:
+            if serialized is None:
+                raise FileNotFoundError(f"Tree {tid} not found in the tree store.")
+            tree_data = tree_data_from_snapshot(serialized)
+    except (
+        FileNotFoundError,
+        EOFError,
+        pickle.UnpicklingError,
+        tree_snapshot.SnapshotError,
+    ) as e:
         print(
             f"Tree {tid} cannot be recovered from disk. Loading placeholder.",
             file=sys.stderr,
@@ -325,13 +907,27 @@ def retrieve_tree_data(tid: int) -> TreeData:  # Typed
     tree_data.style = copy_style(TreeStyle())
     tree_data.layouts = retrieve_layouts(tree_data.layouts)
 
-    tree_data.active = drawer_module.get_empty_active()
+    if tree_data.active is None:
+        tree_data.active = drawer_module.get_empty_active()
     tree_data.timer = time()  # to track if it is active
+    tree_data.saved_version = tree_data.version  # same as in the store
+    tree_data.store_stamp = stamp
 
     return tree_data
 
 
-def get_drawer(tree_id: int, args: dict):
+def reload_tree(tid: int) -> None:
+    """Restore the tree as it was added, discarding all its changes."""
+    global GLOBAL_TREE_CACHE
+    wait_for_tree_store(tid)  # so the original is already in the store
+    with GLOBAL_TREE_CACHE.save_lock:  # see GlobalTreeCache.save()
+        with GLOBAL_TREE_CACHE.store.loading(tid, original=True) as original:
+            if original is not None:
+                GLOBAL_TREE_CACHE.store.save(tid, bytes(original))
+        GLOBAL_TREE_CACHE.pop(tid)  # so it is loaded again from the store
+
+
+def get_drawer(tree_id: str | int, args: dict):
     "Return the drawer initialized as specified in the args"
     global GLOBAL_TREE_CACHE
     valid_keys: list[str] = [
@@ -379,15 +975,16 @@ def get_drawer(tree_id: int, args: dict):
         assert zoom[0] > 0 and zoom[1] > 0 and zoom[2] > 0, "zoom must be > 0"
 
         load_tree(tree_id)  # in case it went out of memory
-        tid_subtree: tuple[int, list[int]] | None = get_tid(tree_id)
+        tid_subtree: tuple[int, list[int | str]] | None = get_tid(tree_id)
         tid: int | None = None
+        subtree: list[int | str] = []
         if tid_subtree is not None:
-            tid, _ = tid_subtree
+            tid, subtree = tid_subtree
 
         if tid is None:
             raise ValueError(f"tid remained with value `None` after reevaulation.")
 
-        tree_data: TreeData = GLOBAL_TREE_CACHE.trees[tid]  # type: ignore
+        tree_data: TreeData = get_tree_data(tid)  # type: ignore
         active_layouts: dict | None = args.get("layouts")
         if active_layouts is not None:
             update_layouts(active_layouts, tid)
@@ -441,29 +1038,33 @@ def get_drawer(tree_id: int, args: dict):
             )
         )
 
-        collapsed_ids: set[tuple[int, ...]] = set(
-            tuple(int(i) for i in node_id.split(",") if i != "")
-            for node_id in json.loads(args.get("collapsed_ids", "[]"))
-        )
-
         ultrametric: bool = args.get("ultrametric") == "1"  # asked for ultrametric?
 
-        if ultrametric and not tree_data.ultrametric:  # change to on
-            if tree_data.tree is not None:
-                tree_data.tree.to_ultrametric()
-            ops.update_sizes_all(tree_data.tree)
-            initialize_tree_style(tree_data)
-            tree_data.ultrametric = ultrametric
-        elif not ultrametric and tree_data.ultrametric:  # change to off
-            GLOBAL_TREE_CACHE.trees.pop(tid, None)  # type: ignore # delete from memory
-            # Forces it to be reloaded from disk next time it is accessed.
+        if ultrametric != tree_data.ultrametric:
+            with tree_data.lock.write():
+                if ultrametric != tree_data.ultrametric:  # not changed meanwhile
+                    set_ultrametric(tree_data, ultrametric)
+                    initialize_tree_style(tree_data)
+                    mark_tree_modified(tree_data, props_changed=True)
+
+        tree: Tree
+        tree_data, tree = load_tree_data(tree_id)
+
+        # The drawer refers to the nodes by their handles, like "@57".
+        collapsed_ids: set[str] = set()
+        for node_id in json.loads(args.get("collapsed_ids", "[]")):
+            try:
+                node: Tree = get_node(tree_data, subtree + get_node_steps(node_id))
+                collapsed_ids.add(get_node_handle(tree_data, node))
+            except IndexError:
+                pass  # not in the tree anymore
 
         active: drawer_module.TreeActive | None | NamedTuple = tree_data.active
         selected: dict | None = tree_data.selected
         searches: dict | None = tree_data.searches
 
         drawer_class = drawer_class(
-            load_tree(tree_id),
+            tree,
             viewport,
             panel,
             zoom,
@@ -476,6 +1077,12 @@ def get_drawer(tree_id: int, args: dict):
             tree_data.style,
             tree_data.include_props,
             tree_data.exclude_props,
+            style_epoch=tree_data.style_epoch,
+            init_node_style=partial(restore_node_style, tree_data),
+            style_lock=tree_data.style_lock,
+            node_handles=get_search_index(tree_data).positions,
+            lod=get_levels_of_detail(tree_data),
+            children_offsets=get_children_offsets(tree_data),
         )  # type: ignore
 
         return drawer_class
@@ -513,9 +1120,11 @@ def remove_search(tid: int, args: dict) -> tuple:  # typed
     if "text" not in args:
         raise HTTPException(status_code=400, detail="Missing search text")
 
-    searches: dict = GLOBAL_TREE_CACHE.trees[int(tid)].searches  # type: ignore
+    tree_data: TreeData = get_tree_data(int(tid))
+    searches: dict = tree_data.searches  # type: ignore
     text: str = args.pop("text").strip()
     search: tuple = searches.pop(text, None)
+    mark_tree_modified(tree_data)
 
     return search
 
@@ -532,29 +1141,50 @@ def store_search(tree_id: str, args: dict) -> tuple:  # Typed
     func: Optional[Callable] = get_search_function(text)
 
     try:
-        load_tree_v: Tree = load_tree(tree_id)
+        tree_data: TreeData
+        load_tree_v: Tree
+        tree_data, load_tree_v = load_tree_data(tree_id)
 
-        if load_tree_v is not None:
-            results: set = set(
-                node for node in load_tree_v.traverse() if func(node)  # type: ignore
-            )
+        results: set = set(search_nodes(tree_data, load_tree_v, text, func))
 
         if len(results) == 0:
             return 0, 0
 
         parents: defaultdict[str, int] = get_parents(results)
-        tid_subtree: tuple[int, list[int]] | None = get_tid(tree_id)
-        tid: int
-        if tid_subtree is not None:
-            tid, _ = tid_subtree
-
-        GLOBAL_TREE_CACHE.trees[tid].searches[text] = (results, parents)  # type: ignore
+        tree_data.searches[text] = (results, parents)  # type: ignore
+        mark_tree_modified(tree_data)
         len_parents_results: tuple[int, int] = len(results), len(parents)
         return len_parents_results
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"evaluating expression: {e}")
 
 
+def search_nodes(
+    tree_data: TreeData, tree: Tree, text: str, func: Optional[Callable]
+) -> list[Tree]:  # typed
+    """Return the nodes of the (sub)tree that match the search text.
+
+    Searches on the names (plain and /r) use the search index of the tree,
+    /e searches are evaluated over columns of values when possible, /t
+    searches only try the nodes that can hold the pattern, and the rest
+    evaluate func on every node.
+    """
+    command: str = text.split(None, 1)[0] if text.startswith("/") else ""
+    if command == "":
+        positions: list[int] = get_search_index(tree_data).search_text(
+            text, ignore_case=text == text.lower()
+        )
+    elif command == "/r":
+        positions = get_search_index(tree_data).search_regex(text.split(None, 1)[1])
+    elif isinstance(func, EvalSearch):
+        return func.search(get_search_index(tree_data).get_subtree_nodes(tree))
+    elif isinstance(func, TopologicalSearch):
+        return func.search(tree)
+    else:
+        return [node for node in tree.traverse() if func(node)]  # type: ignore
+    return get_search_index(tree_data).get_nodes(positions, tree)
+
+
 def find_node(tree: Tree, args: dict) -> Tree | None:
     global GLOBAL_TREE_CACHE
     if "text" not in args:
@@ -571,24 +1201,24 @@ def find_node(tree: Tree, args: dict) -> Tree | None:
 def get_selections(tree_id: int | str | None) -> list[str | int] | None:
     global GLOBAL_TREE_CACHE
     tid: int
-    subtree: list[int]
+    subtree: list[int | str]
 
     tid_subtree: tuple | None = get_tid(tree_id)
     if tid_subtree is None:
         return None
 
     tid, subtree = tid_subtree
-    tree_data: TreeData = GLOBAL_TREE_CACHE.trees[tid]
+    tree_data: TreeData = get_tree_data(tid)
     if tree_data.tree is None:
         return None
 
-    node: Tree = tree_data.tree[subtree]
+    node: Tree = get_node(tree_data, subtree)
     if tree_data.selected is None:
         return None
 
-    selection_result: list[str | int] = [
-        name for name, (results, _) in tree_data.selected.items() if node in results
-    ]
+    selection_result: list[str | int] = list(
+        tree_data.selected.results_of.get(node, ())  # type: ignore
+    )
 
     return selection_result
 
@@ -641,13 +1271,13 @@ def update_node_style(node: Tree, args: dict) -> None:  # typed
 
 # Get nodes info
 def get_nodes_info(
-    nodes: set, props: list
+    tree_data: TreeData, nodes: set, props: list
 ) -> list[dict[str, int]] | dict[str, list]:  # typed
     global GLOBAL_TREE_CACHE
     no_props: bool = len(props) == 1 and props[0] == ""
     node_ids: list
     if "id" in props or no_props or "*" in props:
-        node_ids = [",".join(map(str, node.id)) for node in nodes]
+        node_ids = [get_node_handle(tree_data, node) for node in nodes]
     if no_props:
         return node_ids
 
@@ -678,7 +1308,7 @@ def get_selection_info(
     nodes: set = tree_data.selected.get(name, [[]])[0]
 
     props: list[str] = args.pop("props", "").strip().split(",")
-    return get_nodes_info(nodes, props)
+    return get_nodes_info(tree_data, nodes, props)
 
 
 # remove selection
@@ -689,7 +1319,9 @@ def remove_selection(tid, args) -> tuple:  # typed
         raise HTTPException(status_code=400, detail="missing selection text")
 
     name: str = args.pop("text").strip()
-    selected: tuple = GLOBAL_TREE_CACHE.trees[int(tid)].selected.pop(name, None)  # type: ignore
+    tree_data: TreeData = get_tree_data(int(tid))
+    selected: tuple = tree_data.selected.pop(name, None)  # type: ignore
+    mark_tree_modified(tree_data)
     return selected
 
 
@@ -700,7 +1332,8 @@ def change_selection_name(tid: int, args: dict) -> None:  # typed
         raise HTTPException(status_code=400, detail="missing renaming parameters")
 
     name: str = args.pop("name").strip()
-    selected: dict = GLOBAL_TREE_CACHE.trees[int(tid)].selected  # type: ignore
+    tree_data: TreeData = get_tree_data(int(tid))
+    selected: dict = tree_data.selected  # type: ignore
 
     if name not in selected.keys():
         raise HTTPException(status_code=400, detail=f"selection {name} does not exist")
@@ -708,18 +1341,15 @@ def change_selection_name(tid: int, args: dict) -> None:  # typed
     new_name: str = args.pop("newname").strip()
     selected[new_name] = selected[name]
     selected.pop(name)
+    mark_tree_modified(tree_data)
 
 
 # Unselect node
 def unselect_node(tree_id, args) -> bool:  # Typed
     global GLOBAL_TREE_CACHE
     tree_data: Tree
-    subtree: List[int] | None
-    tid_subtree: tuple | None = get_tid(tree_id)
-    if tid_subtree is not None:
-        tid, subtree = tid_subtree
-    tree_data = GLOBAL_TREE_CACHE.trees[tid]  # type: ignore
-    node: Tree = tree_data.tree[subtree]
+    node: Tree
+    tree_data, node = load_tree_data(tree_id)
     name: str = args.pop("text", "").strip()
     selections: dict
     if name in tree_data.selected.keys():
@@ -728,17 +1358,14 @@ def unselect_node(tree_id, args) -> bool:  # Typed
         selections = dict(tree_data.selected)  # copy all
 
     removed: bool = False
-    for name, (results, parents) in selections.items():
-        nresults: int = len(results)
-        results.discard(node)
-        if len(results) == 0:
-            removed = True
-            tree_data.selected.pop(name)
-        elif nresults > len(results):
+    node_parents: defaultdict[str, int] = get_parents([node])
+    for name, (results, _) in selections.items():
+        if node in results:
             removed = True
-            parents = get_parents(results)
-            tree_data.selected[name] = (results, parents)
+            tree_data.selected.discard(name, [node], node_parents)  # type: ignore
 
+    if removed:
+        mark_tree_modified(tree_data)
     return removed
 
 
@@ -750,13 +1377,15 @@ def search_to_selection(tid: int, args: dict) -> None:  # Typed
         raise HTTPException(status_code=400, detail="missing selection text")
 
     text: str = args.copy().pop("text").strip()
-    selected: dict = GLOBAL_TREE_CACHE.trees[int(tid)].selected  # type: ignore
+    tree_data: TreeData = get_tree_data(int(tid))
+    selected: dict = tree_data.selected  # type: ignore
 
     if text in selected.keys():
         raise HTTPException(status_code=400, detail="selection already exists")
 
     search: tuple = remove_search(tid, args)
     selected[text] = search
+    mark_tree_modified(tree_data)
 
 
 # Prune by selection
@@ -768,7 +1397,7 @@ def prune_by_selection(tid: int, args: dict) -> None:  # typed
         raise HTTPException(status_code=400, detail="missing selection names")
 
     names: set = set(args.pop("names").strip().split(","))
-    tree_data: Tree = GLOBAL_TREE_CACHE.trees[int(tid)]  # type: ignore
+    tree_data: Tree = get_tree_data(int(tid))  # type: ignore
 
     selected: set = set()
     name: str
@@ -784,6 +1413,7 @@ def prune_by_selection(tid: int, args: dict) -> None:  # typed
     ops.update_sizes_all(tree_data.tree)
 
     tree_data.initialized = False
+    mark_tree_modified(tree_data, reindex=True)
 
 
 # Update selection
@@ -791,17 +1421,8 @@ def update_selection(
     tree_data: Trees, name: str, results: set, parents: dict
 ) -> tuple[int, int]:  # typed buy pending to review TODO
     global GLOBAL_TREE_CACHE
-    keys: list = tree_data.selected.keys()
-    if name in keys:
-        all_parents: dict
-        all_results: dict
-        all_results, all_parents = tree_data.selected[name]
-        all_results.update(results)
-        for p, v in parents.items():  # update parents defaultdict
-            all_parents[p] += v
-        tree_data.selected[name] = (all_results, all_parents)
-    else:
-        tree_data.selected[name] = (results, parents)
+    tree_data.selected.add(name, results, parents)  # only indexes the new nodes
+    mark_tree_modified(tree_data)
 
     results, parents = tree_data.selected[name]
     number_results: int = len(results)
@@ -829,6 +1450,20 @@ def get_parents(
     return parents
 
 
+def add_parents(parents: dict, new_parents: dict) -> None:  # typed
+    "Add to the counts of parents the ones of some new results"
+    for parent, count in new_parents.items():
+        parents[parent] += count
+
+
+def subtract_parents(parents: dict, old_parents: dict) -> None:  # typed
+    "Subtract from the counts of parents the ones of some removed results"
+    for parent, count in old_parents.items():
+        parents[parent] -= count
+        if parents[parent] <= 0:
+            del parents[parent]
+
+
 # Store selection
 def store_selection(tree_id: str, args: dict) -> tuple[int, int]:  # typed
     global GLOBAL_TREE_CACHE
@@ -836,12 +1471,8 @@ def store_selection(tree_id: str, args: dict) -> tuple[int, int]:  # typed
     if "text" not in args:
         raise HTTPException(status_code=400, detail="missing selection text")
     tree_data: Tree
-    subtree: list[int] | None
-    tid_subtree: tuple | None = get_tid(tree_id)
-    if tid_subtree is not None:
-        tid, subtree = tid_subtree
-    tree_data = GLOBAL_TREE_CACHE.trees[tid]  # type: ignore
-    node: Tree = tree_data.tree[subtree]
+    node: Tree
+    tree_data, node = load_tree_data(tree_id)
 
     parents = get_parents([node])
 
@@ -853,30 +1484,24 @@ def store_selection(tree_id: str, args: dict) -> tuple[int, int]:  # typed
 def activate_node(tree_id: str) -> None:  # typed
     global GLOBAL_TREE_CACHE
     tree_data: Tree
-    subtree: list[int] | None
-    tid_subtree: tuple | None = get_tid(tree_id)
-    if tid_subtree is not None:
-        tid, subtree = tid_subtree
-    tree_data = GLOBAL_TREE_CACHE.trees[int(tid)]  # type: ignore
-    node: Tree = tree_data.tree[subtree]
-    tree_data.active.nodes.results.add(node)
-    tree_data.active.nodes.parents.clear()
-    tree_data.active.nodes.parents.update(get_parents(tree_data.active.nodes.results))
+    node: Tree
+    tree_data, node = load_tree_data(tree_id)
+    if node not in tree_data.active.nodes.results:
+        tree_data.active.nodes.results.add(node)
+        add_parents(tree_data.active.nodes.parents, get_parents([node]))
+    mark_tree_modified(tree_data)
 
 
 # Deactivate node
 def deactivate_node(tree_id: Tree) -> None:  # typed
     global GLOBAL_TREE_CACHE
     tree_data: Tree
-    subtree: list[int] | None
-    tid_subtree: tuple | None = get_tid(tree_id)
-    if tid_subtree is not None:
-        tid, subtree = tid_subtree
-    tree_data = GLOBAL_TREE_CACHE.trees[tid]  # type: ignore
-    node = tree_data.tree[subtree]
-    tree_data.active.nodes.results.discard(node)
-    tree_data.active.nodes.parents.clear()
-    tree_data.active.nodes.parents.update(get_parents(tree_data.active.nodes.results))
+    node: Tree
+    tree_data, node = load_tree_data(tree_id)
+    if node in tree_data.active.nodes.results:
+        tree_data.active.nodes.results.discard(node)
+        subtract_parents(tree_data.active.nodes.parents, get_parents([node]))
+    mark_tree_modified(tree_data)
 
 
 # Get active clade
@@ -923,12 +1548,8 @@ def get_active_clades(
 def activate_clade(tree_id: str) -> None:  # typed
     global GLOBAL_TREE_CACHE
     tree_data: Tree
-    subtree: list[int] | None
-    tid_subtree: tuple | None = get_tid(tree_id)
-    if tid_subtree is not None:
-        tid, subtree = tid_subtree
-    tree_data = GLOBAL_TREE_CACHE.trees[int(tid)]  # type: ignore
-    node: Tree = tree_data.tree[subtree]
+    node: Tree
+    tree_data, node = load_tree_data(tree_id)
     tree_data.active.clades.results.add(node)
     n: Tree
     for n in node.descendants():
@@ -942,6 +1563,7 @@ def activate_clade(tree_id: str) -> None:  # typed
     tree_data.active.clades.parents.update(
         get_parents(active_parents, count_leaves=True)
     )
+    mark_tree_modified(tree_data)
 
 
 # Remove active clade
@@ -966,15 +1588,12 @@ def remove_active_clade(node: Tree, active: set[Tree]) -> None:
 def deactivate_clade(tree_id: Tree) -> None:  # typed
     global GLOBAL_TREE_CACHE
     tree_data: Tree
-    subtree: list[int] | None
-    tid_subtree: tuple | None = get_tid(tree_id)
-    if tid_subtree is not None:
-        tid, subtree = tid_subtree
-    tree_data = GLOBAL_TREE_CACHE.trees[int(tid)]  # type: ignore
-    node: Tree = tree_data.tree[subtree]
+    node: Tree
+    tree_data, node = load_tree_data(tree_id)
     remove_active_clade(node, tree_data.active.clades.results)
     tree_data.active.clades.parents.clear()
     tree_data.active.clades.parents.update(get_parents(tree_data.active.clades.results))
+    mark_tree_modified(tree_data)
 
 
 # Store active
@@ -996,6 +1615,7 @@ def remove_active(tree_data: Tree, idx: int) -> None:  # typed
     global GLOBAL_TREE_CACHE
     tree_data.active[idx].parents.clear()
     tree_data.active[idx].results.clear()
+    mark_tree_modified(tree_data)
 
 
 def get_search_function(
@@ -1031,7 +1651,7 @@ def get_command_search(
     if command == "/r":  # regex search
         return lambda node: re.search(arg, node.props.get("name", ""))
     elif command == "/e":  # eval expression
-        return get_eval_search(arg)  # TODO this function dont work
+        return get_eval_search(arg)
     elif command == "/t":  # topological search
         return get_topological_search_callback(arg)
     else:
@@ -1041,46 +1661,7 @@ def get_command_search(
 def get_eval_search(expression: str) -> Optional[Callable]:
     """Return a function of a node that evaluates the given expression"""
     global GLOBAL_TREE_CACHE
-    try:
-        code: CodeType = compile(expression, "<string>", "eval")
-
-    except SyntaxError as e:
-        raise HTTPException(status_code=400, detail=f"compiling expression: {e}")
-
-    return lambda node: safer_eval(
-        code,
-        {
-            "node": node,
-            "parent": node.parent,
-            "up": node.up,
-            "name": node.name,
-            "is_leaf": node.is_leaf,
-            "length": node.dist,
-            "dist": node.dist,
-            "d": node.dist,
-            "props": node.props,
-            "p": node.props,
-            "get": dict.get,
-            "children": node.children,
-            "ch": node.children,
-            "size": node.size,
-            "dx": node.size[0],
-            "dy": node.size[1],
-            "regex": re.search,
-            "startswith": str.startswith,
-            "endswith": str.endswith,
-            "upper": str.upper,
-            "lower": str.lower,
-            "split": str.split,
-            "any": any,
-            "all": all,
-            "len": len,
-            "sum": sum,
-            "abs": abs,
-            "float": float,
-            "pi": pi,
-        },
-    )
+    return EvalSearch(expression)
 
 
 def safer_eval(code: CodeType, context: dict) -> Optional[Callable]:
@@ -1098,6 +1679,21 @@ def safer_eval(code: CodeType, context: dict) -> Optional[Callable]:
     return eval(code, {"__builtins__": {}}, context)
 
 
+class TopologicalSearch:
+    """Node predicate for a topological pattern, which can also search all
+    the nodes of a (sub)tree at once."""
+
+    def __init__(self, tree_pattern: tm.TreePattern) -> None:
+        self.pattern: tm.TreePattern = tree_pattern
+
+    def __call__(self, node: Tree) -> bool:
+        return tm.match(self.pattern, node)
+
+    def search(self, tree: Tree) -> list[Tree]:
+        """Return the nodes of the tree that match, in preorder."""
+        return list(tm.search(self.pattern, tree, strategy="preorder"))
+
+
 def get_topological_search_callback(
     pattern,
 ) -> Optional[Callable]:
@@ -1110,47 +1706,93 @@ def get_topological_search_callback(
             status_code=400, detail="invalid pattern %r: %s" % (pattern, e)
         )
 
-    return lambda node: tm.match(tree_pattern, node)
+    return TopologicalSearch(tree_pattern)
 
 
-def get_stats(tree_id: str, pname: str) -> dict[str, float]:
+def get_property_names(tree_id: str | int | None) -> list[str]:  # typed
+    "Return the names of the properties of the nodes of the (sub)tree"
+    global GLOBAL_TREE_CACHE
+    tree_data: TreeData
+    tree: Tree
+    tree_data, tree = load_tree_data(tree_id)
+    with tree_data.lock.read():
+        return get_property_catalog(tree_data).get_names(
+            *get_subtree_range(tree_data, tree)
+        )
+
+
+def get_stats(tree_id: str, pname: str) -> dict[str, float]:  # typed
     global GLOBAL_TREE_CACHE
     "Return some statistics about the given property pname"
-    pmin: float
-    pmax: float
-    n: float
-    pmean: float
-    pmean2: float
-    value: float
-    pmin, pmax = inf, -inf
-    n, pmean, pmean2 = 0, 0, 0
-    node: Tree
+    tree_data: TreeData
+    tree: Tree
+    tree_data, tree = load_tree_data(tree_id)
     try:
-        for node in load_tree(tree_id):
-            if pname in node.props:
-                value = float(node.props[pname])
-                pmin, pmax = min(pmin, value), max(pmax, value)
-                pmean = (n * pmean + value) / (n + 1)
-                pmean2 = (n * pmean2 + value * value) / (n + 1)
-                n += 1
-        assert n > 0, "no node has the given property"
-        return {
-            "n": n,
-            "min": pmin,
-            "max": pmax,
-            "mean": pmean,
-            "var": pmean2 - pmean * pmean,
-        }
+        with tree_data.lock.read():
+            return get_property_catalog(tree_data).get_stats(
+                pname, *get_subtree_range(tree_data, tree)
+            )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=400, detail=f"when reading property {pname}: {e}"
+        )
+
+
+def get_percentiles(tree_id: str, pname: str, qs_text: str) -> dict[str, float]:
+    "Return the percentiles (comma-separated in qs_text) of the property pname"
+    global GLOBAL_TREE_CACHE
+    try:
+        qs: tuple[float, ...] = tuple(float(q) for q in qs_text.split(","))
+        assert all(0 <= q <= 100 for q in qs), "percentiles must be in [0, 100]"
     except (ValueError, AssertionError) as e:
+        raise HTTPException(status_code=400, detail=f"invalid percentiles: {e}")
+
+    tree_data: TreeData
+    tree: Tree
+    tree_data, tree = load_tree_data(tree_id)
+    try:
+        with tree_data.lock.read():
+            return get_property_catalog(tree_data).get_percentiles(
+                pname, *get_subtree_range(tree_data, tree), qs
+            )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=400, detail=f"when reading property {pname}: {e}"
+        )
+
+
+def get_histogram(tree_id: str, pname: str, bins: int) -> dict[str, list]:  # typed
+    "Return the histogram (counts and bin edges) of the property pname"
+    global GLOBAL_TREE_CACHE
+    if not 1 <= bins <= MAX_HISTOGRAM_BINS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"number of bins must be between 1 and {MAX_HISTOGRAM_BINS}",
+        )
+
+    tree_data: TreeData
+    tree: Tree
+    tree_data, tree = load_tree_data(tree_id)
+    try:
+        with tree_data.lock.read():
+            return get_property_catalog(tree_data).get_histogram(
+                pname, *get_subtree_range(tree_data, tree), bins
+            )
+    except ValueError as e:
         raise HTTPException(
             status_code=400, detail=f"when reading property {pname}: {e}"
         )
 
 
-def sort_subtree(tree_id: str, node_id: str, key_text: str, reverse: bool) -> None:
-    """Sort the (sub)tree corresponding to tree_id and node_id"""
+def sort_subtree(tree_id: str, node_id: str, key_text: str, reverse: bool) -> str:
+    """Sort the (sub)tree corresponding to tree_id and node_id, and return
+    the new node id of the subtree of tree_id"""
     global GLOBAL_TREE_CACHE
-    t: Tree = load_tree(tree_id)
+    tree_data: TreeData
+    tree: Tree
+    tree_data, tree = load_tree_data(tree_id)
+    tid_subtree: tuple[int, list[int | str]] | None = get_tid(tree_id)
+    subtree: list[int | str] = tid_subtree[1] if tid_subtree else []
     try:
         code: CodeType = compile(key_text, "<string>", "eval")
     except SyntaxError as e:
@@ -1178,7 +1820,10 @@ def sort_subtree(tree_id: str, node_id: str, key_text: str, reverse: bool) -> No
             },
         )
 
-    ops.sort(t[node_id], key, reverse)
+    node: Tree = get_node(tree_data, subtree + get_node_steps(node_id))
+    ops.sort(node, key, reverse)
+    mark_tree_modified(tree_data, reindex=True)
+    return get_subtree_id(tree_data, tree)
 
 
 # Get trees from nexus or newick
@@ -1235,7 +1880,7 @@ def add_tree(data: TreeViewData) -> int:
     # TODO: Do we need to do this? (Maybe for the trees uploaded with a POST)
     # ops.update_sizes_all(t)
     # Initialize the tree_data.
-    GLOBAL_TREE_CACHE.trees[tid] = TreeData(
+    tree_data: TreeData = TreeData(
         name=name,
         style=copy_style(TreeStyle()),
         nodestyles={},
@@ -1243,65 +1888,261 @@ def add_tree(data: TreeViewData) -> int:
         exclude_props=exclude_props,  # type: ignore
         layouts=default_layouts,
         timer=time(),
-        searches={},
-        selected={},
+        searches=drawer_module.NodeMarks(),
+        selected=drawer_module.NodeMarks(),
         active=drawer_module.get_empty_active(),
         tree=tree,
         tree_node_tooltip_data=data["tree_node_tooltip_data"],
         timestamp=datetime.now(),
+        added_layouts=layouts_to_include,
     )  # type: ignore
+    tree_data.tooltip_index = build_tooltip_index(tree_data)
+    GLOBAL_TREE_CACHE.put(tid, tree_data)
+
+    # Serialize now, before any request can modify the tree, so there
+    # is no need to copy it. Only the writing is left for later.
+    version: int = tree_data.version
+    try:
+        snapshot: bytes | None = tree_data_to_snapshot(tree_data)
+    except (pickle.PicklingError, TypeError) as e:
+        print(f"Tree {tid} cannot be serialized. ERROR: {e}", file=sys.stderr)
+        tree_data.serializable = False
+        GLOBAL_TREE_CACHE.stats.save_failures += 1
+        snapshot = None
 
     def write_tree_data() -> None:  # typed
         global GLOBAL_TREE_CACHE
 
-        """Write tree data as a temporary pickle file."""
-        data: TreeData = deepcopy(GLOBAL_TREE_CACHE.trees[tid])
-        data.style = None  # since it can't be pickled
-        data.layouts = layouts_to_include  # type: ignore
-        data.active = None  # same
-        try:
-            pickle.dump(data, open(f"/tmp/{tid}.pickle", "wb"))
-        except (pickle.PicklingError, PermissionError) as e:
-            print(f"Tree {tid} not saved to file. ERROR: {e}", file=sys.stderr)
-            # So changing to ultrametric and back will not work,
-            # because it is done by re-reading from the dumped file.
+        """Write tree data to the shared tree store."""
+        if snapshot is None:
+            return
+        with GLOBAL_TREE_CACHE.save_lock:  # see GlobalTreeCache.save()
+            if tree_data.saved_version is not None:
+                return  # a newer version was saved meanwhile
+            try:
+                GLOBAL_TREE_CACHE.store.save(tid, snapshot, original=True)
+                tree_data.store_stamp = GLOBAL_TREE_CACHE.store.save(tid, snapshot)
+            except (OSError, PermissionError) as e:
+                print(f"Tree {tid} not saved to file. ERROR: {e}", file=sys.stderr)
+                tree_data.failed_save_version = version
+                GLOBAL_TREE_CACHE.stats.save_failures += 1
+                return
+            tree_data.saved_version = version
 
     thr_write: Thread = Thread(
         daemon=True, target=write_tree_data
     )  # so we are not delayed
     thr_write.start()  # by big trees
+    G_THREADS[tid] = thr_write
     return tid
 
 
+def tree_data_to_snapshot(tree_data: TreeData) -> bytes:  # typed
+    """Return the snapshot (see utils.tree_snapshot) of the tree data.
+
+    Everything needed to rebuild it is saved, including its searches,
+    selections, active nodes and node styles (which refer to the nodes
+    by their position in preorder). The style is not.
+    """
+    positions: dict[int, int] = get_search_index(tree_data).positions
+    tooltips: Optional[str] = None
+    if tree_data.tree_node_tooltip_data is not None:
+        tooltips = json.dumps(
+            [
+                tooltip.model_dump()
+                for tooltip in tree_data.tree_node_tooltip_data.values()
+            ]
+        )
+
+    metadata: dict[str, Any] = {
+        "name": tree_data.name,
+        "include_props": tree_data.include_props,
+        "exclude_props": tree_data.exclude_props,
+        "layouts": tree_data.added_layouts,
+        "ultrametric": tree_data.ultrametric,
+        "timestamp": tree_data.timestamp,
+        "tree_node_tooltip_data": tooltips,
+        "searches": encode_marks(tree_data.searches, positions),
+        "selected": encode_marks(tree_data.selected, positions),
+        "active": (
+            [encode_mark(active, positions) for active in tree_data.active]
+            if tree_data.active is not None
+            else None
+        ),
+        "nodestyles": [
+            (positions[id(node)], args)
+            for node, args in (tree_data.nodestyles or {}).items()
+            if id(node) in positions
+        ],
+    }
+    # The ultrametric tree is saved with its original branch lengths, so
+    # it can be changed back (it is made ultrametric again when loaded).
+    return tree_snapshot.dumps(tree_data.tree, metadata, tree_data.original_dists)
+
+
+def encode_mark(
+    mark: tuple[set, dict], positions: dict[int, int]
+) -> tuple[list[int], dict[int, int]]:  # typed
+    "Return the results and parents of a search or selection, as positions"
+    results, parents = mark
+    return (
+        [positions[id(node)] for node in results if id(node) in positions],
+        {
+            positions[id(node)]: count
+            for node, count in parents.items()
+            if id(node) in positions
+        },
+    )
+
+
+def decode_mark(
+    mark: tuple[list[int], dict[int, int]], nodes: list[Tree]
+) -> tuple[set, defaultdict]:  # typed
+    "Return the results and parents of a search or selection saved as positions"
+    results, parents = mark
+    return (
+        set(nodes[position] for position in results),
+        defaultdict(
+            lambda: 0, {nodes[position]: count for position, count in parents.items()}
+        ),
+    )
+
+
+def encode_marks(marks: Optional[dict], positions: dict[int, int]) -> dict:  # typed
+    "Return the searches or selections with their nodes as positions"
+    return {text: encode_mark(mark, positions) for text, mark in (marks or {}).items()}
+
+
+def decode_marks(marks: dict, nodes: list[Tree]) -> drawer_module.NodeMarks:  # typed
+    "Return the searches or selections saved with encode_marks()"
+    return drawer_module.NodeMarks(
+        {text: decode_mark(mark, nodes) for text, mark in marks.items()}
+    )
+
+
+def tree_data_from_snapshot(snapshot: Any) -> TreeData:  # typed
+    """Return the tree data saved with tree_data_to_snapshot()."""
+    tree: Tree
+    metadata: dict[str, Any]
+    tree, metadata = tree_snapshot.loads(snapshot)
+    ops.update_sizes_all(tree)
+
+    tree_node_tooltip_data: Optional[dict[int, TreeNodeTooltipData]] = None
+    if metadata["tree_node_tooltip_data"] is not None:
+        # Already validated when they were read from the database.
+        tree_node_tooltip_data = {
+            tooltip["protein_id"]: TreeNodeTooltipData.model_construct(**tooltip)
+            for tooltip in json.loads(metadata["tree_node_tooltip_data"])
+        }
+
+    nodes: list[Tree] = list(tree.traverse("preorder"))
+    active: Optional[NamedTuple] = None
+    if metadata.get("active") is not None:
+        active = drawer_module.TreeActive(
+            *[drawer_module.Active(*decode_mark(mark, nodes)) for mark in metadata["active"]]
+        )
+
+    tree_data: TreeData = TreeData(
+        tree=tree,
+        name=metadata["name"],
+        nodestyles={
+            nodes[position]: args for position, args in metadata.get("nodestyles", [])
+        },
+        include_props=metadata["include_props"],
+        exclude_props=metadata["exclude_props"],
+        layouts=metadata["layouts"],
+        added_layouts=metadata["layouts"],
+        ultrametric=metadata["ultrametric"],
+        selected=decode_marks(metadata.get("selected", {}), nodes),
+        searches=decode_marks(metadata.get("searches", {}), nodes),
+        active=active,
+        tree_node_tooltip_data=tree_node_tooltip_data,
+        timestamp=metadata["timestamp"],
+    )
+    tree_data.tooltip_index = build_tooltip_index(tree_data)
+    for node, args in tree_data.nodestyles.items():  # type: ignore
+        update_node_style(node, dict(args))
+    return tree_data
+
+
+def get_tooltip_protein_id(name: str | None) -> Optional[int]:  # typed
+    "Return the protein id of a node named like 'Phy0000001_9606', or None"
+    if name is None or not name.lower().startswith("phy"):
+        return None
+    try:
+        return int(name.lower().replace("phy", "").split("_")[0])
+    except ValueError:
+        return None
+
+
+def index_node_tooltip(tree_data: TreeData, name: str | None) -> None:  # typed
+    "Add to the tooltip index of the tree the entry for the given node name"
+    protein_id: Optional[int] = get_tooltip_protein_id(name)
+    if (
+        protein_id is None
+        or tree_data.tooltip_index is None
+        or tree_data.tree_node_tooltip_data is None
+        or protein_id not in tree_data.tree_node_tooltip_data
+    ):
+        return
+    tree_data.tooltip_index[name] = {  # type: ignore
+        "node_id": name,
+        **tree_data.tree_node_tooltip_data[protein_id].model_dump(),
+    }
+
+
+def build_tooltip_index(tree_data: TreeData) -> dict[str, dict[str, Any]]:  # typed
+    "Return the index of node names to the tooltip data shown for them"
+    tree_data.tooltip_index = {}
+    if tree_data.tree is not None and tree_data.tree_node_tooltip_data:
+        for node in tree_data.tree.traverse():
+            index_node_tooltip(tree_data, node.name)
+    return tree_data.tooltip_index
+
+
+def wait_for_tree_store(tid: int) -> None:
+    """Wait until the tree added with add_tree() is written to the store.
+
+    Until then, the other workers cannot load it.
+    """
+    thr_write: Optional[Thread] = G_THREADS.pop(tid, None)
+    if thr_write is not None:
+        thr_write.join()
+
+
 def update_layouts(active_layouts: dict, tid: int) -> None:
     global GLOBAL_TREE_CACHE
     """Update APP_GLOBAL layouts based on front end status"""
-    tree_data: Tree = GLOBAL_TREE_CACHE.trees[int(tid)]
-    reinit_trees: bool = False
+    tree_data: Tree = get_tree_data(int(tid))
     module: str
     layouts: dict
+    changed_layouts: list[tuple[Any, bool]] = []
     for module, layouts in tree_data.layouts.items():
         for layout in layouts:
             if not layout.always_render:
                 name: str = f"{module}:{layout.name}"
                 new_status: bool = name in active_layouts
                 if layout.active != new_status:
-                    reinit_trees = True
-                    layout.active = new_status
-
-    if reinit_trees:
-        if GLOBAL_TREE_CACHE.safe_mode:
+                    changed_layouts.append((layout, new_status))
+
+    if changed_layouts:
+        # Only take the lock when changing them, so draws with the same
+        # layouts do not wait for each other.
+        with tree_data.lock.write():
+            for layout, new_status in changed_layouts:
+                layout.active = new_status
+            # Every tree has its own copy of the layouts, so the other
+            # trees are not affected.
             tree_data.initialized = False
-        else:
-            for tree_data in GLOBAL_TREE_CACHE.trees.values():
-                tree_data.initialized = False
+            mark_tree_modified(tree_data)
 
 
-def get_tid(tree_id: str | int | None) -> tuple[int, list[int]] | None:
+def get_tid(tree_id: str | int | None) -> tuple[int, list[int | str]] | None:
     global GLOBAL_TREE_CACHE
     """
     Return the tree id and the subtree id, with the apropiate types.
     Example: '3342,1,0,1,1' -> (3342, [1, 0, 1, 1])
+    The subtree id can have node handles too: '3342,@57' -> (3342, ['@57'])
     """
     try:
         if type(tree_id) == int:
@@ -1310,17 +2151,65 @@ def get_tid(tree_id: str | int | None) -> tuple[int, list[int]] | None:
             tid: str
             subtree: list[str]
             tid, *subtree = tree_id.split(",")
-            return int(tid), [int(n) for n in subtree]
+            return int(tid), [get_step(n) for n in subtree]
         return None
     except ValueError:
         raise HTTPException(status_code=400, detail=f"invalid tree id {tree_id}")
 
 
+def get_layout_tooltip(tree_id: str, layout_name: str, tooltip_id: int) -> str:  # typed
+    "Return the html of a tooltip that the faces of a layout refer to by id"
+    global GLOBAL_TREE_CACHE
+    tree_data: TreeData
+    tree_data, _ = load_tree_data(tree_id)
+    for lys in (tree_data.layouts or {}).values():  # type: ignore
+        for ly in lys:
+            if isinstance(ly, GeneOrderTreeLayout) and ly.name == layout_name:
+                if 0 <= tooltip_id < len(ly.tooltips):
+                    return ly.get_tooltip(tooltip_id)
+    raise HTTPException(
+        status_code=404,
+        detail=f"Tooltip {tooltip_id} not found in layout {layout_name} of tree {tree_id}",
+    )
+
+
+def get_layouts_state(tree_data: TreeData) -> dict[str, dict[str, bool]]:  # typed
+    """Return, for every layout module in the tree, a dict with the names
+    of its layouts and whether they are active or not."""
+    layouts: dict[str, dict[str, bool]] = {}
+    for module, lys in (tree_data.layouts or {}).items():  # type: ignore
+        layouts[module] = {ly.name: ly.active for ly in lys if ly.name}
+    return layouts
+
+
+def get_drawer_info(name: str, tree_data: TreeData) -> dict[str, str | int]:  # typed
+    "Return type (rect/circ) and number of panels of the drawer"
+    # NOTE: apparently we need to know the tree we are referring to
+    # because it checks if there are aligned faces in it to see if we are
+    # using a DrawerAlignX drawer (instead of DrawerX).
+    tree_layouts: list = sum((tree_data.layouts or {}).values(), [])  # type: ignore
+    if name not in ["Rect", "Circ"] and any(
+        getattr(ly, "aligned_faces", False) and ly.active for ly in tree_layouts
+    ):
+        name = "Align" + name
+    # TODO: We probably want to get rid of all this.
+    try:
+        drawer_class: Any = next(
+            d
+            for d in drawer_module.get_drawers()
+            if d.__name__[len("Drawer") :] == name
+        )
+    except StopIteration:
+        raise HTTPException(status_code=400, detail=f"not a valid drawer: {name}")
+    return {"type": drawer_class.TYPE, "npanels": drawer_class.NPANELS}
+
+
 def del_tree(tid: int) -> None:
     global GLOBAL_TREE_CACHE
     "Delete a tree and everywhere where it appears referenced"
-    shutil.rmtree(f"/tmp/{tid}.pickle", ignore_errors=True)
-    GLOBAL_TREE_CACHE.trees.pop(tid, None)
+    wait_for_tree_store(tid)  # so a pending write does not recreate it
+    GLOBAL_TREE_CACHE.delete(tid)
+    DRAW_RESPONSE_CACHE.invalidate(tid)
 
 
 # Copy style
@@ -608,14 +608,46 @@ class Walker:
         node, nch = self.visiting[-1]
         self.visiting.append(TreePos(node=node.children[nch], nch=0))
 
+    def jump(self, node):
+        """Continue the traversal at the given descendant of the current node.
+
+        The rest of the descendants of the current node are skipped, and
+        it is visited for the last time after the given node. The node_id
+        of the nodes visited from then on is not valid.
+        """
+        current, _ = self.visiting[-1]
+        self.visiting[-1] = TreePos(current, len(current.children))
+        self.visiting.append(TreePos(node=node, nch=0))
+        self.descend = True
+
+    def skip_children(self, nch):
+        """Continue the traversal at the child number nch of the current node.
+
+        Its previous children (and their descendants) are not visited.
+        """
+        node, _ = self.visiting[-1]
+        self.visiting[-1] = TreePos(node, nch)
+
+    def skip_siblings(self):
+        """Continue the traversal at the parent of the current node.
+
+        The siblings after the current node are not visited.
+        """
+        parent, _ = self.visiting[-2]
+        self.visiting[-2] = TreePos(parent, len(parent.children) - 1)
+
 
 def walk(tree):
     """Yield an iterator as it traverses the tree."""
     it = Walker(tree)  # node iterator
     while it.visiting:
         if it.first_visit:
+            node = it.node
             yield it
 
+            if it.node is not node:
+                continue  # it jumped to another node, which is visited next
+
             if it.node.is_leaf or not it.descend:
                 it.go_back()
                 continue
@@ -642,11 +674,65 @@ def update_sizes_from(node):
         node = node.up
 
 
+def update_sizes_dirty(nodes):
+    """Update the sizes of the given (dirty) nodes and their ancestors.
+
+    The dirty nodes are the ones whose dist or children changed. The
+    sizes of the rest of their descendants must be already right.
+
+    Each node is updated once, after its children, and the update stops
+    going up as soon as a size does not change. So after an edit it takes
+    O(depth) instead of the O(n) of update_sizes_all().
+    """
+    dirty = set()  # ids of the dirty nodes
+    depths = {}  # id(node) -> (depth, node), for the nodes and ancestors
+    for node in nodes:
+        if node is None:
+            continue
+        dirty.add(id(node))
+
+        lineage = []  # nodes up to the root (or to an already seen one)
+        while node is not None and id(node) not in depths:
+            lineage.append(node)
+            node = node.up
+
+        depth = 0 if node is None else depths[id(node)][0] + 1
+        for n in reversed(lineage):
+            depths[id(n)] = (depth, n)
+            depth += 1
+
+    pending = set()  # ids of the nodes with a child whose size changed
+    for _, node in sorted(depths.values(), key=lambda x: -x[0]):
+        if id(node) in dirty or id(node) in pending:
+            before = (node.size, node.nnodes, node.nseqs)
+            update_size(node)
+            after = (node.size, node.nnodes, node.nseqs)
+            if after != before and node.up is not None:
+                pending.add(id(node.up))
+
+
 def update_size(node):
-    """Update the size of the given node."""
+    """Update the size of the given node, and its counts of descendants."""
     sumdists, nleaves = get_size(node.children)
     dx = float(node.props.get('dist', 0 if node.up is None else 1)) + sumdists
     node.size = (dx, max(1, nleaves))
+    node.nnodes, node.nseqs = get_counts(node)
+
+
+cdef (int, int) get_counts(node):
+    """Return the number of nodes and of leaves with a sequence in node."""
+    cdef int nnodes, nseqs
+
+    if not node.children:
+        return 1, (1 if node.props.get('seq') else 0)
+
+    nnodes = 1
+    nseqs = 0
+    for child in node.children:
+        nnodes += child.nnodes
+        nseqs += child.nseqs
+
+    return nnodes, nseqs
 
 
 cdef (double, double) get_size(nodes):
@@ -48,6 +48,8 @@ cdef class Tree(object):
     cdef public list _children
 
     cdef public (double, double) size
+    cdef public int nnodes  # nodes in its subtree, itself included
+    cdef public int nseqs  # leaves in its subtree with a sequence ("seq")
 
     # All these members below should go away.
     cdef public object _img_style
@@ -83,6 +85,8 @@ cdef class Tree(object):
         self._initialized = 0 # Layout fns have not been run on node
 
         self.size = (0, 0)
+        self.nnodes = 0  # these counts are set with the size (see operations)
+        self.nseqs = 0
 
         data = data.read() if hasattr(data, 'read') else data
 
@@ -226,7 +230,7 @@ cdef class Tree(object):
         self.set_style(value)
 
     def _get_initialized(self):
-        return self._initialized == 1
+        return self._initialized != 0  # the style epoch it was initialized in
     def _set_initialized(self, value):
         if value:
             self._initialized = 1
@@ -2,15 +2,19 @@
 Classes and functions for drawing a tree.
 """
 
-from math import sin, cos, pi, sqrt, atan2
+from math import sin, cos, pi, sqrt, atan2, floor, log2
 from collections import namedtuple, OrderedDict, defaultdict, deque
+from itertools import accumulate
+from bisect import bisect_left
 import random
 
+from threading import Lock
 from time import time
 
 from ete4.core import operations as ops
 from .. import TreeStyle
 from .face_positions import FACE_POSITIONS, make_faces
+from .nodestyle import NODE_STYLE_DEFAULT
 from . import draw_helpers as dh
 
 Box = dh.Box  # shortcut, because we use it a lot
@@ -18,6 +22,8 @@ Box = dh.Box  # shortcut, because we use it a lot
 Size = namedtuple("Size", "dx dy")  # size of a 2D shape (sizes are always >= 0)
 TreeActive = namedtuple("TreeActive", "nodes clades")
 Active = namedtuple("Active", "results parents")
+Chunk = namedtuple("Chunk", "nodes box")  # small nodes drawn as one outline
+Ladder = namedtuple("Ladder", "inner end end_point top bottom")
 
 
 def get_empty_active():
@@ -26,6 +32,269 @@ def get_empty_active():
     return TreeActive(nodes, clades)
 
 
+class NodeMarks(dict):
+    """Searches or selections, like {text: (results, parents)}, indexed by node.
+
+    It also keeps, for every node, the texts it is a result of and the
+    texts it is a parent of, so the drawer can tell what marks a node with
+    a single lookup instead of testing it against every search. Adding or
+    removing results only updates the index for the nodes involved.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self.results_of = {}  # node -> {text: None} (an ordered set)
+        self.parents_of = {}
+        self.update(*args, **kwargs)
+
+    def __setitem__(self, text, value):
+        if text in self:
+            self._unmark(text, *self[text])
+        results, parents = value
+        if not isinstance(parents, defaultdict):
+            parents = defaultdict(lambda: 0, parents)
+        super().__setitem__(text, (results, parents))
+        self._mark(text, results, parents)
+
+    def __delitem__(self, text):
+        self._unmark(text, *self[text])
+        super().__delitem__(text)
+
+    def __reduce__(self):
+        return self.__class__, (dict(self),)
+
+    def pop(self, text, *default):
+        if text not in self:
+            return super().pop(text, *default)
+        value = self[text]
+        del self[text]
+        return value
+
+    def clear(self):
+        super().clear()
+        self.results_of.clear()
+        self.parents_of.clear()
+
+    def update(self, *args, **kwargs):
+        for text, value in dict(*args, **kwargs).items():
+            self[text] = value
+
+    def add(self, text, results, parents):
+        "Add results (and the counts of their parents) to the given text"
+        if text not in self:
+            self[text] = (set(results), defaultdict(lambda: 0, parents))
+            return
+
+        all_results, all_parents = self[text]
+        for node in results:
+            if node not in all_results:
+                all_results.add(node)
+                self.results_of.setdefault(node, {})[text] = None
+        for node, count in parents.items():
+            if node not in all_parents:
+                self.parents_of.setdefault(node, {})[text] = None
+            all_parents[node] += count
+
+    def discard(self, text, results, parents):
+        "Remove results (and their parents counts), and the text if left empty"
+        all_results, all_parents = self[text]
+        for node in results:
+            if node in all_results:
+                all_results.discard(node)
+                unmark(self.results_of, node, text)
+        for node, count in parents.items():
+            if node in all_parents:
+                all_parents[node] -= count
+                if all_parents[node] <= 0:
+                    del all_parents[node]
+                    unmark(self.parents_of, node, text)
+
+        if not all_results:
+            del self[text]
+
+    def _mark(self, text, results, parents):
+        for node in results:
+            self.results_of.setdefault(node, {})[text] = None
+        for node in parents:
+            self.parents_of.setdefault(node, {})[text] = None
+
+    def _unmark(self, text, results, parents):
+        for node in results:
+            unmark(self.results_of, node, text)
+        for node in parents:
+            unmark(self.parents_of, node, text)
+
+
+def unmark(marks, node, text):
+    "Remove text from the marks of the node"
+    texts = marks.get(node)
+    if texts is not None:
+        texts.pop(text, None)
+        if not texts:
+            del marks[node]
+
+
+def as_marks(searches):
+    "Return the searches (or selections) as NodeMarks, indexed by node"
+    if isinstance(searches, NodeMarks):
+        return searches
+    return NodeMarks(searches or {})
+
+
+class LevelsOfDetail:
+    """Summaries of the ladders of a tree, to draw it fast when zoomed out.
+
+    A ladder is a chain of nodes where each one has a single child that
+    is not small (the next one in the chain), and the rest are small. When
+    zoomed out, huge trees can have very long ladders (think of a
+    caterpillar tree), and drawing all their nodes is a lot of work for
+    things that are too small to see. Instead, the drawer can jump from
+    the first node of a ladder to its end, and draw the small children
+    along it as a few collapsed outlines ("chunks"), each at least as
+    tall as a small node. So the work depends on the pixels to draw, and
+    not on the size of the tree.
+
+    What is small depends on the zoom, so the ladders are found for sizes
+    that are powers of 2 (in units of leaves), the first time that they
+    are needed, and kept for the next draws. They must be dropped when
+    the topology or the sizes of the tree change.
+    """
+
+    def __init__(self):
+        self.ladders = {}  # (size, node) -> Ladder (or None if there is none)
+
+    def get_ladder(self, node, min_size):
+        """Return the ladder starting at node, if any.
+
+        Nodes smaller than min_size (in units of leaves) count as small.
+        """
+        if min_size < 2:
+            return None  # a leaf is not small, so there are no ladders
+
+        size = 2 ** floor(log2(min_size))  # the level of detail to use
+        key = (size, node)
+        if key not in self.ladders:
+            self.ladders[key] = make_ladder(node, size)
+        return self.ladders[key]
+
+
+class ChildrenOffsets:
+    """Where the children of the nodes start, to find the ones in a viewport.
+
+    For a node with n children, its offsets are a list with the n + 1
+    cumulative heights (in units of leaves) of its children, starting at
+    0. So its child i goes from offsets[i] to offsets[i+1] (relative to
+    the node), and the children that intersect any range can be found
+    with a binary search, without visiting them.
+
+    They are computed the first time that they are needed, and kept for
+    the next draws. They must be dropped when the topology or the sizes
+    of the tree change.
+    """
+
+    def __init__(self):
+        self.offsets = {}  # node -> offsets of its children
+
+    def get(self, node):
+        "Return the offsets of the children of node"
+        if node not in self.offsets:
+            self.offsets[node] = list(
+                accumulate((child.size[1] for child in node.children), initial=0))
+        return self.offsets[node]
+
+
+def make_ladder(node, size):
+    """Return the ladder starting at node, for nodes smaller than size.
+
+    Only ladders with nodes to jump over are returned. The positions of
+    their end and chunks are relative to where the children of the first
+    node start.
+    """
+    chain = []  # nodes in the ladder, and the position of their next one
+    child, nch = get_ladder_child(node, size)
+    while child is not None:
+        chain.append((node, nch))
+        node = child
+        child, nch = get_ladder_child(node, size)
+
+    if len(chain) < 2:
+        return None  # nothing to jump over
+
+    x, y = 0, 0  # where the children of the current node in the chain start
+    top = []  # groups of small children above the chain, from top to bottom
+    xs = []
+    for i, (n, nch) in enumerate(chain):
+        if i > 0:
+            x += dist(n)
+        xs.append(x)
+        top.append((x, y, n.children[:nch]))
+        y += sum(c.size[1] for c in n.children[:nch])
+
+    end_point = (x, y)  # where the branch of the end starts
+
+    y += node.size[1]
+    bottom = []  # groups of small children below the chain
+    for (n, nch), x in zip(reversed(chain), reversed(xs)):
+        bottom.append((x, y, n.children[nch + 1:]))
+        y += sum(c.size[1] for c in n.children[nch + 1:])
+
+    inner = [n for n, _ in chain[1:]]  # nodes that are jumped over
+    return Ladder(inner, node, end_point, get_chunks(top, size),
+                  get_chunks(bottom, size))
+
+
+def get_ladder_child(node, size):
+    """Return the only child of node not smaller than size, and its position.
+
+    Return (None, -1) if it has no such child, or more than one.
+    """
+    big, nch = None, -1
+    for i, child in enumerate(node.children):
+        if child.size[1] >= size:
+            if big is not None:
+                return None, -1
+            big, nch = child, i
+    return big, nch
+
+
+def has_custom_style(node):
+    """Return True if node has a style other than the default one.
+
+    That includes not drawing its descendants. Nodes whose style was
+    never used have none yet, so they do not get one created here.
+    """
+    style = node._sm_style
+    return style is not None and any(style.get(key, value) != value
+                                     for key, value, _ in NODE_STYLE_DEFAULT)
+
+
+def get_chunks(groups, size):
+    """Return the chunks that result from joining groups of small nodes.
+
+    Each group is (x, y, nodes), with the nodes one on top of the other.
+    Consecutive groups are joined until they are at least size tall.
+    """
+    chunks = []
+    nodes, xs, x_ends, y0, dy = [], [], [], None, 0
+    for x, y, group in groups:
+        if not group:
+            continue
+        if y0 is None:
+            y0 = y
+        nodes += group
+        xs.append(x)
+        x_ends.append(x + max(c.size[0] for c in group))
+        dy += sum(c.size[1] for c in group)
+        if dy >= size:
+            chunks.append(Chunk(nodes, Box(min(xs), y0, max(x_ends) - min(xs), dy)))
+            nodes, xs, x_ends, y0, dy = [], [], [], None, 0
+
+    if nodes:
+        chunks.append(Chunk(nodes, Box(min(xs), y0, max(x_ends) - min(xs), dy)))
+
+    return chunks
+
+
 # The coordinates (x, y, dx, dy) are all "generalized coordinates" (x and y
 # can refer to radius and angle, for example).
 
@@ -76,6 +345,8 @@ class Drawer:
 
     NPANELS = 1  # number of drawing panels (including the aligned ones)
 
+    MIN_CHILDREN_TO_SKIP = 16  # nodes with less are visited child by child
+
     def __init__(
         self,
         tree,
@@ -91,6 +362,12 @@ class Drawer:
         tree_style=None,
         include_props=None,
         exclude_props=None,
+        style_epoch=1,
+        init_node_style=None,
+        style_lock=None,
+        node_handles=None,
+        lod=None,
+        children_offsets=None,
     ):
         self.tree = tree
         self.viewport = Box(*viewport) if viewport else None
@@ -99,12 +376,20 @@ class Drawer:
         self.xmin, self.xmax, self.ymin, self.ymax = limits or (0, 0, 0, 0)
         self.collapsed_ids = collapsed_ids or set()  # manually collapsed
         self.active = active or get_empty_active()  # looks like (results, parents)
-        self.selected = selected or {}  # looks like {node_id: (node, parents)}
-        self.searches = searches or {}  # looks like {text: (results, parents)}
+        self.selected = as_marks(selected)  # looks like {text: (results, parents)}
+        self.searches = as_marks(searches)  # looks like {text: (results, parents)}
         self.layouts = layouts or []
         self.include_props = include_props
         self.exclude_props = exclude_props
         self.tree_style = tree_style or TreeStyle()
+        self.style_epoch = style_epoch  # nodes initialized before are reset
+        self.init_node_style = init_node_style  # function to restyle them
+        self.style_lock = style_lock or Lock()  # shared by draws of the tree
+        self.node_handles = node_handles  # id(node) -> handle, to use as ids
+        self.lod = lod  # LevelsOfDetail, to jump over ladders when zoomed out
+        self.children_offsets = (  # to skip the children out of the viewport
+            children_offsets if children_offsets is not None else ChildrenOffsets()
+        )
 
     def draw(self):
         "Yield graphic elements to draw the tree"
@@ -113,6 +398,7 @@ class Drawer:
         self.nodeboxes = []  # boxes surrounding all nodes and collapsed boxes
         self.node_dxs = [[]]  # lists of nodes dx (to find the max)
         self.bdy_dys = [[]]  # lists of branch dys and total dys
+        self.ladders = []  # ladders we are in: (node, ladder, origin, n_top)
 
         if self.panel == 0:
             self.tree_style.aligned_grid_dxs = defaultdict(lambda: 0)
@@ -151,13 +437,15 @@ class Drawer:
         if not self.in_viewport(box_node):
             self.bdy_dys[-1].append((box_node.dy / 2, box_node.dy))
             it.descend = False  # skip children
-            return x, y + box_node.dy
+            return x, y + box_node.dy + self.skip_siblings(box_node, it)
+
+        node_id = self.get_node_id(it.node, it)
 
         if not it.node.sm_style["draw_descendants"]:
             # Skip descendants => in collapsed_ids
-            self.collapsed_ids.add(it.node_id)
+            self.collapsed_ids.add(node_id)
 
-        is_manually_collapsed = it.node_id in self.collapsed_ids
+        is_manually_collapsed = node_id in self.collapsed_ids
 
         if is_manually_collapsed and self.outline:
             graphics += self.get_outline()  # so we won't stack with its outline
@@ -179,19 +467,20 @@ class Drawer:
             return self.on_last_visit((x + dx, y + dy), it, graphics)
         else:
             self.node_dxs.append([])
-            return x + dx, y
+            ladder = self.get_ladder(it.node)
+            if ladder:
+                return self.enter_ladder((x + dx, y), it, ladder, graphics)
+            return x + dx, y + self.skip_children(y, it)
 
     def on_last_visit(self, point, it, graphics):
         "Update list of graphics to draw and return new position"
+        if self.ladders and self.ladders[-1][0] is it.node:
+            point = self.leave_ladder(graphics)
 
         # Searches
-        searched_by = set(
-            text for text, (results, _) in self.searches.items() if it.node in results
-        )
+        searched_by = set(self.searches.results_of.get(it.node, ()))
         # Selection
-        selected_by = [
-            text for text, (results, _) in self.selected.items() if it.node in results
-        ]
+        selected_by = list(self.selected.results_of.get(it.node, ()))
         active_clade = (
             ["active_clades"] if it.node in self.active.clades.results else []
         )
@@ -200,14 +489,7 @@ class Drawer:
         active_children = TreeActive(0, 0)
         if self.outline:
             if all(child in self.collapsed for child in it.node.children):
-                searched_by.update(
-                    text
-                    for text, (results, parents) in self.searches.items()
-                    if any(
-                        node in results or node in parents.keys()
-                        for node in self.collapsed
-                    )
-                )
+                searched_by.update(self.get_searched_collapsed())
                 active_children = self.get_active_children()
                 selected_children = self.get_selected_children()
 
@@ -234,7 +516,7 @@ class Drawer:
         box = Box(x_before, y_before, ndx, dy)
         self.nodeboxes += self.draw_nodebox(
             it.node,
-            it.node_id,
+            self.get_node_id(it.node, it),
             box,
             list(searched_by) + selected_by + active_clade,
             {"fill": it.node.sm_style.get("bgcolor")},
@@ -269,16 +551,8 @@ class Drawer:
         if self.panel == 0:
             node_style = node.sm_style
             if dx > 0:
-                parent_of = set(
-                    text
-                    for text, (_, parents) in self.searches.items()
-                    if node in parents.keys()
-                )
-                parent_of.update(
-                    text
-                    for text, (_, parents) in self.selected.items()
-                    if node in parents.keys()
-                )
+                parent_of = set(self.searches.parents_of.get(node, ()))
+                parent_of.update(self.selected.parents_of.get(node, ()))
                 hz_line_style = {
                     "type": node_style["hz_line_type"],
                     "stroke-width": node_style["hz_line_width"],
@@ -412,17 +686,11 @@ class Drawer:
         x, y, _, _ = self.outline
         collapsed_node = self.get_collapsed_node()
 
-        searched_by = [
-            text
-            for text, (results, parents) in self.searches.items()
-            if collapsed_node in results
-            or any(node in results or node in parents for node in self.collapsed)
-        ]
-        selected_by = [
-            text
-            for text, (results, parents) in self.selected.items()
-            if collapsed_node in results
-        ]
+        searched_by = list(
+            self.searches.results_of.get(collapsed_node, {}).keys()
+            | self.get_searched_collapsed()
+        )
+        selected_by = list(self.selected.results_of.get(collapsed_node, ()))
         active_clade = (
             ["active_clades"] if collapsed_node in self.active.clades.results else []
         )
@@ -451,7 +719,9 @@ class Drawer:
             name = collapsed_node.name
             properties = self.get_popup_props(collapsed_node)
 
-            node_id = tuple(collapsed_node.id) if is_manually_collapsed else []
+            node_id = (
+                self.get_node_id(collapsed_node) if is_manually_collapsed else []
+            )
             box = dh.draw_nodebox(
                 self.flush_outline(ndx),
                 name,
@@ -466,6 +736,120 @@ class Drawer:
 
         yield from graphics
 
+    def get_node_id(self, node, it=None):
+        """Return the id of the node, as used in collapsed_ids and nodeboxes.
+
+        It is its handle (like "@57") if we have them, or else its path
+        (from the walker it, if given, or else from the root).
+        """
+        if self.node_handles is not None:
+            return f"@{self.node_handles[id(node)]}"
+        return it.node_id if it is not None else tuple(node.id)
+
+    def get_ladder(self, node):
+        "Return the ladder to jump over, starting at node (None if none)"
+        return None  # only drawers that know how to summarize them have it
+
+    def get_viewport_ys(self):
+        "Return the ys that a node must intersect to be in the viewport"
+        return None  # only drawers where that is simple to know have them
+
+    def skip_children(self, y, it):
+        """Skip the first children of the node, if they are above the viewport.
+
+        The node starts at y. Return how much its children were moved down.
+        """
+        node = it.node
+        ys = self.get_viewport_ys()
+        if ys is None or len(node.children) < self.MIN_CHILDREN_TO_SKIP:
+            return 0
+
+        offsets = self.children_offsets.get(node)
+        nch = bisect_left(offsets, ys[0] - y, 1, len(node.children)) - 1
+        if nch <= 0:
+            return 0  # the first child is (at least partially) in the viewport
+
+        # Add their branch dys as if they were visited (exact for the first).
+        dy0 = self.node_size(node.children[0]).dy
+        self.bdy_dys[-1].append((dy0 / 2, dy0))
+        if nch > 1:
+            self.bdy_dys[-1].append((0, offsets[nch] - offsets[1]))
+
+        it.skip_children(nch)
+        return offsets[nch]
+
+    def skip_siblings(self, box_node, it):
+        """Skip the next siblings of the node, if it is below the viewport.
+
+        Return how much space they take.
+        """
+        ys = self.get_viewport_ys()
+        if ys is None or box_node.y <= ys[1] or len(it.visiting) < 2:
+            return 0
+
+        parent, nch = it.visiting[-2]
+        n = len(parent.children)
+        if (parent is not it.node.up or  # it jumped here (from a ladder)
+            n < self.MIN_CHILDREN_TO_SKIP or nch >= n - 1):
+            return 0
+
+        # Add their branch dys as if they were visited (exact for the last).
+        offsets = self.children_offsets.get(parent)
+        if nch < n - 2:
+            self.bdy_dys[-1].append((0, offsets[n - 1] - offsets[nch + 1]))
+        dy1 = self.node_size(parent.children[-1]).dy
+        self.bdy_dys[-1].append((dy1 / 2, dy1))
+
+        it.skip_siblings()
+        return offsets[n] - offsets[nch + 1]
+
+    def enter_ladder(self, origin, it, ladder, graphics):
+        """Draw the top of the ladder and jump to its end.
+
+        The origin is where the children of the first node of the ladder
+        start. Return the point where its end is drawn.
+        """
+        graphics += self.draw_chunks(origin, ladder.top)
+        self.ladders.append((it.node, ladder, origin, len(self.node_dxs[-1])))
+        it.jump(ladder.end)
+        x0, y0 = origin
+        x, y = ladder.end_point
+        return x0 + x, y0 + y
+
+    def leave_ladder(self, graphics):
+        """Draw the bottom of the ladder we are in, and leave it.
+
+        Return the point after the contents of its first node, as if all
+        its descendants had been drawn.
+        """
+        node, ladder, origin, n_top = self.ladders.pop()
+
+        if self.outline:
+            graphics += self.get_outline()  # the end could be collapsed
+
+        dxs = self.node_dxs[-1]
+        for i in range(n_top, len(dxs)):
+            dxs[i] += ladder.end_point[0]  # the end is not at the origin
+
+        graphics += self.draw_chunks(origin, ladder.bottom)
+
+        x0, y0 = origin
+        return x0, y0 + node.size[1]
+
+    def draw_chunks(self, origin, chunks):
+        "Yield the graphics of the chunks of a ladder, as collapsed nodes"
+        x0, y0 = origin
+        for nodes, (x, y, dx, dy) in chunks:
+            box = Box(x0 + x, y0 + y, dx, dy)
+            if not self.in_viewport(box):
+                self.bdy_dys[-1].append((dy / 2, dy))
+                continue
+
+            self.collapsed = list(nodes)
+            self.outline = box
+            yield from self.get_outline()
+            self.node_dxs[-1][-1] += x  # its dx is from the ladder's origin
+
     def flush_outline(self, minimum_dx=0):
         "Return box outlining the collapsed nodes and reset the current outline"
         x, y, dx, dy = self.outline
@@ -516,6 +900,9 @@ class Drawer:
         return is_manually_collapsed or self.is_small(box_node)
 
     def get_active_children(self):
+        if not self.active.nodes.results and not self.active.clades.results:
+            return TreeActive(0, 0)
+
         nodes = sum(1 for node in self.collapsed if node in self.active.nodes.results)
         nodes += sum(self.active.nodes.parents.get(node, 0) for node in self.collapsed)
         clades = sum(
@@ -527,13 +914,61 @@ class Drawer:
         return TreeActive(nodes, clades)
 
     def get_selected_children(self):
-        selected_children = []
-        for text, (results, parents) in self.selected.items():
-            hits = sum(1 for node in self.collapsed if node in results)
-            hits += sum(parents.get(node, 0) for node in self.collapsed)
-            if hits:
-                selected_children.append((text, hits))
-        return selected_children
+        if not self.selected:
+            return []
+
+        hits = defaultdict(lambda: 0)  # selection text -> number of hits
+        for node in self.collapsed:
+            for text in self.selected.results_of.get(node, ()):
+                hits[text] += 1
+            for text in self.selected.parents_of.get(node, ()):
+                hits[text] += self.selected[text][1][node]
+        return [(text, hits[text]) for text in self.selected if text in hits]
+
+    def get_searched_collapsed(self):
+        "Return the texts of the searches with results in the collapsed nodes"
+        if not self.searches:
+            return set()
+
+        searched = set()
+        for node in self.collapsed:
+            searched.update(self.searches.results_of.get(node, ()))
+            searched.update(self.searches.parents_of.get(node, ()))
+        return searched
+
+    def initialize_node(self, node, reset_faces=False):
+        """Apply the layouts to the node, unless done already in this epoch.
+
+        Nodes initialized in a previous style epoch (before the layouts of
+        the tree changed) get their faces and style reset first. So a
+        change of layouts does not need to traverse the whole tree: only
+        the nodes that are drawn afterwards are updated.
+
+        Draws of the same tree can run at the same time (like the ones of
+        its panels), so the nodes are styled holding style_lock, and only
+        marked as initialized once their faces are complete.
+        """
+        if node._initialized == self.style_epoch:
+            return
+
+        with self.style_lock:
+            if node._initialized == self.style_epoch:
+                return  # styled by another draw meanwhile
+
+            if reset_faces:
+                node.faces = make_faces()
+                node.collapsed_faces = make_faces()
+
+            if node._initialized != 0:  # initialized in a previous epoch
+                node._smfaces = None
+                node._collapsed_faces = None
+                node._sm_style = None
+                if self.init_node_style is not None:
+                    self.init_node_style(node)
+
+            for layout in self.layouts:
+                layout.set_node_style(node)
+            node._initialized = self.style_epoch
 
     def get_popup_props(self, node):
         """Return dictionary of web-safe node properties (to use in a popup)."""
@@ -608,6 +1043,32 @@ class DrawerRect(Drawer):
         zx, zy, _ = self.zoom
         return box.dy * zy < self.COLLAPSE_SIZE
 
+    def get_ladder(self, node):
+        "Return the ladder to jump over, starting at node (None if none)"
+        if self.lod is None or self.node_handles is None:
+            return None  # the paths of the nodes after a jump would be wrong
+
+        ladder = self.lod.get_ladder(node, self.COLLAPSE_SIZE / self.zoom[1])
+
+        if ladder and any(has_custom_style(inner) for inner in ladder.inner):
+            return None  # their style (or not drawing descendants) would be lost
+
+        if ladder and (self.collapsed_ids or self.searches or self.selected or
+                       self.active.nodes.results or self.active.clades.results):
+            for inner in ladder.inner:  # they must not need to be drawn
+                if (self.get_node_id(inner) in self.collapsed_ids or
+                    inner in self.searches.results_of or
+                    inner in self.selected.results_of or
+                    inner in self.active.nodes.results or
+                    inner in self.active.clades.results):
+                    return None
+
+        return ladder
+
+    def get_viewport_ys(self):
+        "Return the ys that a node must intersect to be in the viewport"
+        return dh.get_ys(self.viewport) if self.viewport else None
+
     def get_box(self, element):
         zx, zy, za = self.zoom
         if self.panel == 0:
@@ -702,6 +1163,12 @@ class DrawerCirc(Drawer):
         tree_style=None,
         include_props=None,
         exclude_props=None,
+        style_epoch=1,
+        init_node_style=None,
+        style_lock=None,
+        node_handles=None,
+        lod=None,
+        children_offsets=None,
     ):
         super().__init__(
             tree,
@@ -717,6 +1184,12 @@ class DrawerCirc(Drawer):
             tree_style,
             include_props=include_props,
             exclude_props=exclude_props,
+            style_epoch=style_epoch,
+            init_node_style=init_node_style,
+            style_lock=style_lock,
+            node_handles=node_handles,
+            lod=lod,
+            children_offsets=children_offsets,
         )
 
         assert self.zoom[0] == self.zoom[1], "zoom must be equal in x and y"
@@ -982,12 +1455,7 @@ class DrawerRectFaces(DrawerRect):
                 else:
                     dx_before += dx_max
 
-        if not node.is_initialized:
-            node.is_initialized = True
-            node.faces = make_faces()
-            node.collapsed_faces = make_faces()
-            for layout in self.layouts:
-                layout.set_node_style(node)
+        self.initialize_node(node, reset_faces=True)
 
         # Render Faces in different panels
         if self.NPANELS > 1:
@@ -1160,10 +1628,7 @@ class DrawerCircFaces(DrawerCirc):
                 else:
                     dr_before += dr_max
 
-        if not node.is_initialized:
-            node.is_initialized = True
-            for layout in self.layouts:
-                layout.set_node_style(node)
+        self.initialize_node(node)
 
         # Render Faces in different panels
         if self.NPANELS > 1:
@@ -6,6 +6,7 @@ with expressions and strings.
 """
 
 from itertools import permutations
+import ast
 import re
 
 from ete4 import Tree
@@ -53,8 +54,23 @@ class TreePattern(Tree):
         return search(self, tree, context, strategy)
 
 
-def match(pattern, node, context=None):
-    """Return True if the pattern matches the given node."""
+def match(pattern, node, context=None, cache=None):
+    """Return True if the pattern matches the given node.
+
+    If a cache (a dict) is given, it is used to remember the results of
+    matching subpatterns with nodes, which are otherwise recomputed for
+    every permutation of the children that is tried.
+    """
+    if cache is None:
+        return _match(pattern, node, context, None)
+
+    key = (id(pattern), id(node))
+    if key not in cache:
+        cache[key] = _match(pattern, node, context, cache)
+    return cache[key]
+
+
+def _match(pattern, node, context, cache):
     if pattern.children and len(node.children) != len(pattern.children):
         return False  # no match if there's not the same number of children
 
@@ -108,7 +124,7 @@ def match(pattern, node, context=None):
     # Check all possible comparisons between pattern children and node children.
     for ch_perm in permutations(pattern.children):
         if all(
-            match(sub_pattern, node.children[i], context)
+            match(sub_pattern, node.children[i], context, cache)
             for i, sub_pattern in enumerate(ch_perm)
         ):
             return True
@@ -117,12 +133,180 @@ def match(pattern, node, context=None):
 
 
 def search(pattern, tree, context=None, strategy="levelorder"):
-    """Yield nodes that match the given pattern."""
+    """Yield nodes that match the given pattern.
+
+    Only the nodes that can hold the pattern are evaluated: they need at
+    least as many leaves and levels below as the pattern, and if some of
+    its nodes require a name (like "name == 'A'"), nodes with that name
+    at the same depth under them.
+    """
+    is_candidate = get_candidate_filter(pattern, tree)
+
+    # Subpatterns are matched again with the same nodes only when trying
+    # permutations of more than two children.
+    needs_cache = any(len(node.children) > 2 for node in pattern.traverse())
+    cache = {} if needs_cache else None
+
     for node in tree.traverse(strategy):
-        if match(pattern, node, context):
+        if is_candidate(node) and match(pattern, node, context, cache):
             yield node
 
 
+def get_candidate_filter(pattern, tree):
+    """Return a function that tells if a node of the tree can match the pattern.
+
+    It only discards nodes that cannot match, so it is safe to use before
+    calling match() on the nodes that it accepts.
+    """
+    anchors = get_name_anchors(pattern)
+    roots = get_anchored_roots(anchors, tree) if anchors else None
+
+    nchildren = len(pattern.children)
+
+    if roots is not None:  # few candidates already, no need to look further
+        return lambda node: id(node) in roots and (
+            not nchildren or len(node.children) == nchildren
+        )
+
+    if not nchildren:  # a single condition: nothing to check
+        return lambda node: True
+
+    nleaves, height = get_signature(pattern)
+    signatures = get_signatures(tree)
+
+    def is_candidate(node):
+        node_nleaves, node_height = signatures[id(node)]
+        return (
+            len(node.children) == nchildren
+            and node_nleaves >= nleaves
+            and node_height >= height
+        )
+
+    return is_candidate
+
+
+def get_signature(pattern):
+    """Return the number of leaves and the height of the pattern."""
+    nleaves, height = 0, 0
+    for node, depth in traverse_with_depth(pattern):
+        nleaves += int(not node.children)
+        height = max(height, depth)
+    return nleaves, height
+
+
+def get_signatures(tree):
+    """Return a dict with the number of leaves and height of all tree nodes.
+
+    The dict is indexed by id(node).
+    """
+    signatures = {}
+    for node in tree.traverse("postorder"):
+        nleaves, height = (0, 0) if node.children else (1, 0)
+        for child in node.children:
+            child_nleaves, child_height = signatures[id(child)]
+            nleaves += child_nleaves
+            height = max(height, child_height + 1)
+        signatures[id(node)] = (nleaves, height)
+    return signatures
+
+
+def get_name_anchors(pattern):
+    """Return a list of (depth, names) for the pattern nodes with known names.
+
+    Those are the nodes whose condition requires the name to be one of a
+    few constant strings, like "name == 'A'" or "name in ['A', 'B'] and d > 1".
+    """
+    anchors = []
+    for node, depth in traverse_with_depth(pattern):
+        names = get_required_names(node.name)
+        if names is not None:
+            anchors.append((depth, names))
+    return anchors
+
+
+def get_required_names(condition):
+    """Return the set of names that satisfying the condition needs, or None."""
+    try:
+        expression = ast.parse(condition or "True", mode="eval").body
+    except SyntaxError:
+        return None
+
+    if isinstance(expression, ast.BoolOp) and isinstance(expression.op, ast.And):
+        clauses = expression.values  # any of them can restrict the name
+    else:
+        clauses = [expression]
+
+    for clause in clauses:
+        if not (
+            isinstance(clause, ast.Compare)
+            and len(clause.ops) == 1
+            and isinstance(clause.left, ast.Name)
+            and clause.left.id == "name"
+        ):
+            continue
+
+        op, value = clause.ops[0], clause.comparators[0]
+        if isinstance(op, ast.Eq) and is_str_constant(value):
+            return {value.value}
+        if (
+            isinstance(op, ast.In)
+            and isinstance(value, (ast.List, ast.Tuple, ast.Set))
+            and all(is_str_constant(element) for element in value.elts)
+        ):
+            return {element.value for element in value.elts}
+
+    return None
+
+
+def is_str_constant(element):
+    return isinstance(element, ast.Constant) and type(element.value) == str
+
+
+def get_anchored_roots(anchors, tree):
+    """Return the ids of the nodes that have all the anchors under them.
+
+    For an anchor (depth, names), that means having a node at that depth
+    below with one of the names.
+    """
+    all_names = set().union(*(names for _, names in anchors))
+    nodes_by_name = {}
+    for node in tree.traverse():
+        name = node.props.get("name", "")
+        if name in all_names:
+            nodes_by_name.setdefault(name, []).append(node)
+
+    roots = None
+    for depth, names in anchors:
+        anchor_roots = set()
+        for name in names:
+            for node in nodes_by_name.get(name, []):
+                root = get_ancestor(node, depth)
+                if root is not None:
+                    anchor_roots.add(id(root))
+        roots = anchor_roots if roots is None else roots & anchor_roots
+        if not roots:
+            break
+    return roots
+
+
+def get_ancestor(node, depth):
+    """Return the ancestor that is depth levels above the node, or None."""
+    for _ in range(depth):
+        node = node.up
+        if node is None:
+            return None
+    return node
+
+
+def traverse_with_depth(pattern):
+    """Yield (node, depth) for all the nodes of the pattern."""
+    pending = [(pattern, 0)]
+    while pending:
+        node, depth = pending.pop()
+        yield node, depth
+        pending.extend((child, depth + 1) for child in node.children)
+
+
 # Calling eval() directly in match() can be a security problem. Specially for
 # web services, we are better off using this following function:
 def safer_eval(code, context):
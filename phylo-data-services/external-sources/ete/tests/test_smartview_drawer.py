@@ -0,0 +1,176 @@
+"""
+Tests for the drawers of smartview.
+"""
+
+import random
+import unittest
+from collections import Counter
+from threading import Barrier, Lock, Thread
+from time import sleep
+
+from ete4 import Tree
+from ete4.core import operations as ops
+from ete4.smartview import TextFace, TreeLayout
+from ete4.smartview.renderer.drawer import (
+    DrawerRect, DrawerRectFaces, LevelsOfDetail)
+
+
+def caterpillar(n):
+    """Return a tree where every inner node has a leaf and the rest."""
+    newick = "l0:1"
+    for i in range(1, n):
+        newick = f"(l{i}:1,{newick}):1"
+    tree = Tree(newick + ";")
+    ops.update_sizes_all(tree)
+    return tree
+
+
+def get_node_handles(tree):
+    return {id(node): i for i, node in enumerate(tree.traverse("preorder"))}
+
+
+def get_nodeboxes(graphics):
+    return {g[4]: g[1] for g in graphics if g[0] == "nodebox" and g[4]}
+
+
+class Test_Drawer_Ladders(unittest.TestCase):
+    """Test that jumping over ladders draws what matters of a plain draw."""
+
+    def draw(self, tree, lod=None):
+        drawer = DrawerRect(tree, zoom=(1, 0.1, 1), lod=lod,
+                            node_handles=get_node_handles(tree))
+        return list(drawer.draw())
+
+    def count_lines(self, graphics, stroke):
+        return sum(1 for g in graphics
+                   if g[0] == "line" and g[-1].get("stroke") == stroke)
+
+    def test_ladder_draw(self):
+        tree = caterpillar(200)
+
+        plain = self.draw(tree)
+        jumped = self.draw(tree, LevelsOfDetail())
+
+        # The inner nodes are jumped over, and their small children are
+        # drawn as outlines, so the drawing changes but covers the same.
+        self.assertLess(len(jumped), len(plain))
+        self.assertEqual(get_nodeboxes(jumped)["@0"],
+                         get_nodeboxes(plain)["@0"])
+
+    def test_ladder_keeps_styled_nodes(self):
+        tree = caterpillar(200)
+        node = tree.children[1].children[1].children[1]  # an inner node
+        node.sm_style["hz_line_color"] = "#ff0000"
+
+        plain = self.draw(tree)
+        jumped = self.draw(tree, LevelsOfDetail())
+
+        self.assertEqual(self.count_lines(plain, "#ff0000"), 1)
+        self.assertEqual(self.count_lines(jumped, "#ff0000"), 1)
+
+    def test_ladder_keeps_nodes_without_descendants_drawn(self):
+        tree = caterpillar(200)
+        node = tree.children[1].children[1].children[1]  # an inner node, @6
+        node.sm_style["draw_descendants"] = False
+
+        plain = self.draw(tree)
+        jumped = self.draw(tree, LevelsOfDetail())
+
+        self.assertEqual(get_nodeboxes(jumped)["@6"],
+                         get_nodeboxes(plain)["@6"])
+        self.assertNotIn("@7", get_nodeboxes(jumped))  # not descended
+
+class Test_Drawer_Skipping_Children(unittest.TestCase):
+    """Test that skipping the children out of the viewport draws the same."""
+
+    def make_tree(self):
+        # 20 clades of 20 leaves, so both the root and the clades have
+        # enough children to skip them.
+        rng = random.Random(1)
+        clades = []
+        for i in range(20):
+            leaves = ",".join(f"l{i}_{j}:{rng.randint(1, 5)}" for j in range(20))
+            clades.append(f"({leaves}):{rng.randint(1, 5)}")
+        tree = Tree("(" + ",".join(clades) + ");")
+        ops.update_sizes_all(tree)
+        return tree
+
+    def draw(self, tree, viewport, skip):
+        drawer = DrawerRect(tree, viewport=viewport, zoom=(10, 10, 1),
+                            node_handles=get_node_handles(tree))
+        if not skip:
+            drawer.MIN_CHILDREN_TO_SKIP = len(tree) + 1  # never
+        skipped = []
+        for method in ["skip_children", "skip_siblings"]:
+            skip_method = getattr(drawer, method)
+            def record(*args, skip_method=skip_method):
+                space = skip_method(*args)
+                skipped.append(space)
+                return space
+            setattr(drawer, method, record)
+        return list(drawer.draw()), any(skipped)
+
+    def test_skipping_draws_the_same(self):
+        tree = self.make_tree()
+        self.assertGreaterEqual(len(tree.children), DrawerRect.MIN_CHILDREN_TO_SKIP)
+
+        for viewport in [(0, 150, 100, 100), (0, 155.5, 100, 3)]:
+            skipping, skipped = self.draw(tree, viewport, skip=True)
+            full, _ = self.draw(tree, viewport, skip=False)
+
+            self.assertTrue(skipped)
+            self.assertEqual(get_nodeboxes(skipping), get_nodeboxes(full))
+            self.assertEqual(skipping, full)  # branch positions too
+
+
+class CountingLayout(TreeLayout):
+    """Layout that adds a face to every node, and counts the nodes styled."""
+
+    def __init__(self):
+        super().__init__("counting")
+        self.styled = Counter()
+
+    def set_node_style(self, node):
+        self.styled[id(node)] += 1
+        sleep(0.001)  # so draws at the same time would overlap
+        node.add_face(TextFace("x"), position="branch_right", column=0)
+
+
+class Test_Drawer_Style_Epochs(unittest.TestCase):
+    """Test that draws at the same time style again the nodes only once."""
+
+    def test_concurrent_draws_restyle_nodes_once(self):
+        tree = Tree("(((a:1,b:1):1,(c:1,d:1):1):1,((e:1,f:1):1,(g:1,h:1):1):1);")
+        ops.update_sizes_all(tree)
+        old_layout = CountingLayout()
+        for node in tree.traverse():
+            old_layout.set_node_style(node)
+            node._initialized = 1  # as if styled in the epoch 1
+
+        layout = CountingLayout()
+        style_lock = Lock()
+        start = Barrier(2, timeout=5)
+
+        def draw(panel):
+            drawer = DrawerRectFaces(tree, panel=panel, zoom=(100, 100, 100),
+                                     layouts=[layout], style_epoch=2,
+                                     style_lock=style_lock)
+            start.wait()
+            list(drawer.draw())
+
+        threads = [Thread(target=draw, args=(panel,)) for panel in (0, 1)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(set(layout.styled.values()), {1})
+        self.assertEqual(len(layout.styled), len(list(tree.traverse())))
+        for node in tree.traverse():
+            self.assertEqual(node._initialized, 2)
+            self.assertTrue(node.is_initialized)
+            self.assertEqual(len(node.faces.branch_right[0]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
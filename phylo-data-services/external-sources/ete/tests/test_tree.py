@@ -6,6 +6,7 @@ from tempfile import NamedTemporaryFile
 import unittest
 
 from ete4 import Tree, PhyloTree
+from ete4.core import operations as ops
 from ete4.core.tree import TreeError
 from ete4.parser.newick import NewickError
 from ete4.parser import newick
@@ -2293,6 +2294,118 @@ class Test_Core_Tree(unittest.TestCase):
         self.assertEqual((t_pkl["A"]).props["complex"][0], [0, 1])
         self.assertEqual((t_deep["A"]).props["testfn"](), "YES")
 
+    def test_update_sizes_dirty(self):
+        def sizes(t):
+            return [n.size for n in t.traverse()]
+
+        random.seed(42)
+        t = Tree()
+        t.populate(50, dist_fn=lambda: random.random())
+        ops.update_sizes_all(t)
+
+        # Change a dist.
+        leaf = random.choice(list(t.leaves()))
+        leaf.dist = 10
+        ops.update_sizes_dirty([leaf])
+        expected = sizes(t)
+        ops.update_sizes_all(t)
+        self.assertEqual(expected, sizes(t))
+
+        # Remove a node (the parent is the dirty one).
+        node = t.children[0].children[0]
+        parent = node.up
+        ops.remove(node)
+        ops.update_sizes_dirty([parent])
+        expected = sizes(t)
+        ops.update_sizes_all(t)
+        self.assertEqual(expected, sizes(t))
+
+        # Several dirty nodes, sharing ancestors.
+        leaves = list(t.leaves())
+        for leaf in leaves[:5]:
+            leaf.dist = 0.01
+        ops.update_sizes_dirty(leaves[:5])
+        expected = sizes(t)
+        ops.update_sizes_all(t)
+        self.assertEqual(expected, sizes(t))
+
+        # Set an outgroup (its lineage and their new children are dirty).
+        t.dist = None
+        node = list(t.leaves())[7]
+        lineage = list(node.lineage())
+        t.set_outgroup(node)
+        ops.update_sizes_dirty(lineage + [n for x in lineage for n in x.children])
+        expected = sizes(t)
+        ops.update_sizes_all(t)
+        self.assertEqual(expected, sizes(t))
+
+    def test_node_counts(self):
+        def counts(t):
+            return [
+                (
+                    node.nnodes,
+                    node.nseqs,
+                    sum(1 for _ in node.traverse()),
+                    sum(1 for leaf in node.leaves() if leaf.props.get("seq")),
+                )
+                for node in t.traverse()
+            ]
+
+        t = Tree("((a,b),(c,(d,e)));")
+        for leaf in t.leaves():
+            if leaf.name in ["a", "d", "e"]:
+                leaf.add_prop("seq", "ACGT")
+        ops.update_sizes_all(t)
+        self.assertEqual((t.nnodes, t.nseqs), (9, 3))
+        for nnodes, nseqs, nnodes_expected, nseqs_expected in counts(t):
+            self.assertEqual((nnodes, nseqs), (nnodes_expected, nseqs_expected))
+
+        # They are also kept by the incremental updates after an edit.
+        node = t["d"]
+        parent = node.up
+        ops.remove(node)
+        ops.update_sizes_dirty([parent])
+        self.assertEqual((t.nnodes, t.nseqs), (8, 2))
+        for nnodes, nseqs, nnodes_expected, nseqs_expected in counts(t):
+            self.assertEqual((nnodes, nseqs), (nnodes_expected, nseqs_expected))
+
+    def test_walk_jump(self):
+        t = Tree("((a,b)c,((d,e)f,g)h)r;", parser=1)
+
+        def visits(jumps):
+            names = []
+            for it in ops.walk(t):
+                names.append(("<" if it.first_visit else ">") + it.node.name)
+                if it.first_visit and it.node.name in jumps:
+                    it.jump(t[jumps[it.node.name]])
+            return names
+
+        self.assertEqual(visits({}), [
+            '<r', '<c', '<a', '<b', '>c', '<h', '<f', '<d', '<e', '>f',
+            '<g', '>h', '>r'])
+
+        # Jumping skips the rest of the descendants, and comes back after.
+        self.assertEqual(visits({'r': 'f'}), [
+            '<r', '<f', '<d', '<e', '>f', '>r'])
+        self.assertEqual(visits({'h': 'e', 'c': 'b'}), [
+            '<r', '<c', '<b', '>c', '<h', '<e', '>h', '>r'])
+
+    def test_walk_skip(self):
+        t = Tree("(a,(b,c,d)e,f,g)r;", parser=1)
+
+        names = []
+        for it in ops.walk(t):
+            names.append(("<" if it.first_visit else ">") + it.node.name)
+            if it.first_visit and it.node.name == 'r':
+                it.skip_children(1)  # start at e
+            elif it.first_visit and it.node.name == 'e':
+                it.skip_children(2)  # start at d
+            elif it.first_visit and it.node.name == 'f':
+                self.assertEqual(it.node_id, (2,))
+                it.skip_siblings()  # do not go to g
+
+        self.assertEqual(names, ['<r', '<e', '<d', '>e', '<f', '>r'])
+
     def test_cophenetic_matrix(self):
         t = Tree(ds.nw_full)
         dists, leaves = t.cophenetic_matrix()
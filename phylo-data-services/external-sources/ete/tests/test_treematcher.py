@@ -90,3 +90,38 @@ def test_safer():
     )
     with pytest.raises(ValueError):
         list(tp_safer.search(t))  # asked for unknown function get_species()
+
+
+def test_required_names():
+    from ete4.treematcher.treematcher import get_required_names
+
+    assert get_required_names("name == 'A'") == {"A"}
+    assert get_required_names("'A' == name") is None  # only name on the left
+    assert get_required_names("name in ['A', 'B'] and d > 1") == {"A", "B"}
+    assert get_required_names("d > 1 and name == 'A'") == {"A"}
+    assert get_required_names("name == 'A' or d > 1") is None
+    assert get_required_names("name in ['A', x]") is None
+    assert get_required_names("len(ch) > 2") is None
+    assert get_required_names("") is None
+
+
+def test_search_candidates():
+    # Searching only the candidate nodes gives the same as trying them all.
+    tree = Tree(
+        "(((A,B)x,(A,(B,C))y)z,((C,A),(A,B,C)w)v,(B,(A,B))u,((A,B),C));", parser=1
+    )
+
+    for newick in [
+        "(\"name == 'A'\", \"name == 'B'\")",
+        "((\"name == 'A'\", True), \"name in ['B', 'C']\")",
+        "(\"name == 'C'\", \"name == 'A'\", \"name == 'B'\")",
+        "((True, True), True)",
+        "(True, (True, True, True))",
+        "(\"name == 'D'\", True)",
+        "\"name == 'B'\"",
+    ]:
+        pattern = tm.TreePattern(newick)
+        for strategy in ["levelorder", "preorder", "postorder"]:
+            assert list(tm.search(pattern, tree, strategy=strategy)) == [
+                node for node in tree.traverse(strategy) if tm.match(pattern, node)
+            ]